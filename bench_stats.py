@@ -0,0 +1,1340 @@
+# pylint: disable=invalid-name
+"""
+Sport stats benchmarks.
+
+Run with ``python bench_stats.py -h`` to see the available benchmarks.
+"""
+import array
+import collections
+import gzip
+import inspect
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from xml.sax.saxutils import quoteattr
+
+import stats
+
+
+JSONFILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "options.json"
+)
+
+XMLFILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "options.xml"
+)
+
+SPORTS = [
+    "Football",
+    "Tennis",
+    "Rugby Union",
+    "Basketball",
+    "Ice Hockey",
+    "Baseball",
+    "Aussie Rules",
+    "Cricket",
+]
+
+MARKETS = [
+    "Head to Head",
+    "Head to Head-Live betting",
+    "Points Start",
+    "Winning Team & Margin",
+    "Half/Full Time Double",
+    "Tri-Bet",
+    "Outright Winner",
+    "Total Goals",
+]
+
+
+def sport_name(index):
+    """
+    Return the name of the synthetic sport ``index``.
+    """
+    if index < len(SPORTS):
+        return SPORTS[index]
+    return "Sport {}".format(index)
+
+
+def competition_name(index, sports=len(SPORTS)):
+    """
+    Return the name of the synthetic competition ``index``.
+    """
+    return "{} League {}".format(sport_name(index % sports), index)
+
+
+def generate_options(count, selections=8, seed=0, sports=len(SPORTS),
+                     competitions=50):
+    """
+    Generate synthetic options shaped like the ``options.json`` ones.
+
+    :param count: Number of options to generate.
+    :type count: :class:`int`
+    :param selections: Number of selections per option.
+    :type selections: :class:`int`
+    :param seed: Seed for the random generator.
+    :type seed: :class:`int`
+    :param sports: Number of distinct sports.
+    :type sports: :class:`int`
+    :param competitions: Number of distinct competitions, each competition
+        belongs to a single sport.
+    :type competitions: :class:`int`
+    :returns: Decoded JSON options.
+    :rtype: iterable of :class:`dict`
+    """
+    rnd = random.Random(seed)
+
+    for number in range(count):
+        comp = number % competitions
+        game = "Team {} v Team {}".format(number % 997, number % 991)
+        yield {
+            "venue": "Venue {}".format(number % 101),
+            "competition": competition_name(comp, sports),
+            "closes": "2016-04-{:02d} {:02d}:{:02d}:00".format(
+                1 + number % 28,
+                number % 24,
+                number % 60,
+            ),
+            "name": MARKETS[number % len(MARKETS)],
+            "number": str(number),
+            "sport": sport_name(comp % sports),
+            "game": game,
+            "selections": {
+                "selection": [
+                    {
+                        "number": str(i + 1),
+                        "name": "Selection {}".format(i + 1),
+                        "odds": str(rnd.randint(101, 5000)),
+                        "status": "OK",
+                    }
+                    for i in range(selections)
+                ],
+            },
+        }
+
+
+def write_json_feed(fh, options):
+    """
+    Write options to a text file handler in the ``options.json`` layout.
+
+    :param fh: Text write file handler.
+    :type fh: :class:`file`
+    :param options: Decoded JSON options.
+    :type options: iterable of :class:`dict`
+    """
+    fh.write('{"options": {"option": [')
+    for index, each in enumerate(options):
+        if index:
+            fh.write(", ")
+        json.dump(each, fh)
+    fh.write("]}}")
+
+
+def write_xml_feed(fh, options):
+    """
+    Write options to a text file handler in the ``options.xml`` layout.
+
+    :param fh: Text write file handler.
+    :type fh: :class:`file`
+    :param options: Decoded JSON options.
+    :type options: iterable of :class:`dict`
+    """
+    fh.write('<?xml version="1.0" encoding="utf-8"?>\n<options>\n')
+    for each in options:
+        attrs = " ".join(
+            '{}={}'.format(key, quoteattr(value))
+            for key, value in each.items()
+            if key != "selections"
+        )
+        fh.write("  <option {}>\n    <selections>\n".format(attrs))
+        for sel in each["selections"]["selection"]:
+            fh.write(
+                "      <selection {}/>\n".format(
+                    " ".join(
+                        '{}={}'.format(key, quoteattr(value))
+                        for key, value in sel.items()
+                    )
+                )
+            )
+        fh.write("    </selections>\n  </option>\n")
+    fh.write("</options>\n")
+
+
+def write_feeds(directory, files, count, selections=8, fmt="json",
+                **kwargs):
+    """
+    Write synthetic feed files to a directory.
+
+    Extra keyword arguments are passed on to :func:`generate_options`.
+
+    :returns: Names of the files written.
+    :rtype: :class:`list` of :class:`str`
+    """
+    writer = write_json_feed if fmt == "json" else write_xml_feed
+    filenames = []
+    for index in range(files):
+        filename = os.path.join(
+            directory,
+            "feed-{:04d}.{}".format(index, fmt),
+        )
+        with open(filename, "w") as fh:
+            writer(
+                fh,
+                generate_options(count, selections, seed=index, **kwargs),
+            )
+        filenames.append(filename)
+    return filenames
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of the current process in kilobytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _in_child(func, *args):
+    """
+    Run ``func`` in a fresh child process so the peak RSS it reports is not
+    polluted by earlier benchmarks.
+    """
+    ctx = multiprocessing.get_context("fork")
+    with ctx.Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+def _bench_objects(count, selections):
+    baseline = peak_rss()
+    start = time.perf_counter()
+    comps = [
+        stats._make_json_competition(each)  # pylint: disable=protected-access
+        for each in generate_options(count, selections)
+    ]
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for each in comps:
+        each.market_percentage()
+    calc = time.perf_counter() - start
+
+    return {
+        "name": "objects",
+        "model": "objects",
+        "wall_s": build + calc,
+        "build_s": build,
+        "market_percentage_s": calc,
+        "rss_kb": peak_rss() - baseline,
+    }
+
+
+def _bench_columnar(count, selections):
+    baseline = peak_rss()
+    start = time.perf_counter()
+    store = stats.CompetitionStore()
+    store.extend(
+        stats._make_json_competition(each)  # pylint: disable=protected-access
+        for each in generate_options(count, selections)
+    )
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store.market_percentages()
+    calc = time.perf_counter() - start
+
+    return {
+        "name": "columnar",
+        "model": "columnar",
+        "wall_s": build + calc,
+        "build_s": build,
+        "market_percentage_s": calc,
+        "rss_kb": peak_rss() - baseline,
+    }
+
+
+def _bench_model(scale):
+    with open(JSONFILE) as fh:
+        options = json.load(fh)["options"]["option"]
+
+    baseline = peak_rss()
+    start = time.perf_counter()
+    comps = [
+        stats._make_json_competition(each)  # pylint: disable=protected-access
+        for _ in range(scale)
+        for each in options
+    ]
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for each in comps:
+        each.get_selections()
+    selections = time.perf_counter() - start
+
+    return {
+        "name": "model",
+        "options": len(comps),
+        "wall_s": build + selections,
+        "build_s": build,
+        "get_selections_s": selections,
+        "rss_kb": peak_rss() - baseline,
+    }
+
+
+def bench_model(scale=1000):
+    """
+    Measure the memory used by the :class:`stats.Competition` and
+    :class:`stats.Selection` objects of ``options.json`` repeated ``scale``
+    times.
+
+    :returns: Single result.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    return [_in_child(_bench_model, scale)]
+
+
+def bench_columnar(count=1000000, selections=8):
+    """
+    Compare the object model with :class:`stats.CompetitionStore`.
+
+    :returns: One result per model.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    return [
+        _in_child(_bench_objects, count, selections),
+        _in_child(_bench_columnar, count, selections),
+    ]
+
+
+def bench_market_percentage(count=1000000, selections=8, seed=0):
+    """
+    Compare :func:`stats.calc_market_percentage` called once per option with
+    the batch :func:`stats.calc_market_percentages`, on a flat buffer of
+    random odds with between 1 and ``2 * selections`` odds per option.
+
+    :returns: One result per method, with the largest relative difference
+        from the per option results.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    rnd = random.Random(seed)
+    offsets = array.array("q", [0])
+    for _ in range(count):
+        offsets.append(offsets[-1] + rnd.randint(1, 2 * selections))
+    odds = array.array(
+        "q",
+        (rnd.randint(101, 5000) for _ in range(offsets[-1])),
+    )
+
+    start = time.perf_counter()
+    expected = [
+        stats.calc_market_percentage(odds[offsets[i]:offsets[i + 1]])
+        for i in range(count)
+    ]
+    scalar = time.perf_counter() - start
+    results = [{
+        "name": "calc_market_percentage",
+        "method": "calc_market_percentage",
+        "options": count,
+        "wall_s": scalar,
+        "speedup": 1.0,
+        "max_rel_error": 0.0,
+    }]
+
+    for exact in [True, False]:
+        start = time.perf_counter()
+        got = stats.calc_market_percentages(odds, offsets, exact=exact)
+        elapsed = time.perf_counter() - start
+        method = "calc_market_percentages(exact={})".format(exact)
+        results.append({
+            "name": method,
+            "method": method,
+            "options": count,
+            "wall_s": elapsed,
+            "speedup": scalar / elapsed,
+            "max_rel_error": max(
+                abs(a - b) / a for a, b in zip(expected, got)
+            ),
+        })
+    return results
+
+
+def _bench_load(filename, parser_name, mapped, allocations):
+    reporter = stats.Reporter(getattr(stats, parser_name)())
+
+    def load():
+        if mapped:
+            reporter.load(stats.map_file(filename))
+            # the streaming parsers only read the file when walked.
+            reporter.option_count()
+        else:
+            with open(filename, "rb") as fh:
+                reporter.load(fh)
+                reporter.option_count()
+
+    return _measure(load, allocations)
+
+
+def bench_load(count=200000, selections=8):
+    """
+    Compare loading a synthetic feed from a file handler with loading it
+    from a memory mapped file, for every parser.
+
+    Pages of a mapped file count towards the RSS but are shared with the
+    page cache, the traced allocations show the copies made on the Python
+    heap.
+
+    :returns: One result per parser and input.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        for fmt, parsers in [
+            ("json", ["JSONParser", "JSONStreamParser"]),
+            ("xml", ["XMLParser", "XMLStreamParser"]),
+        ]:
+            filename, = write_feeds(directory, 1, count, selections, fmt)
+            for parser_name in parsers:
+                for mapped in [False, True]:
+                    result = _in_child(
+                        _bench_load,
+                        filename,
+                        parser_name,
+                        mapped,
+                        False,
+                    )
+                    result["alloc_peak_bytes"] = _in_child(
+                        _bench_load,
+                        filename,
+                        parser_name,
+                        mapped,
+                        True,
+                    )["alloc_peak_bytes"]
+                    result.update({
+                        "name": "{}.{}".format(
+                            parser_name,
+                            "mmap" if mapped else "file",
+                        ),
+                        "parser": parser_name,
+                        "input": "mmap" if mapped else "file",
+                        "bytes": os.path.getsize(filename),
+                    })
+                    results.append(result)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def _xpath_competitions(root):
+    """
+    Extract the competitions of a parsed XML feed by searching the document
+    with XPath every time, the way :class:`stats.XMLParser` used to.
+    """
+    for element in root.xpath("//options/option"):
+        kwargs = dict(element.attrib)
+        comp = stats.Competition(
+            venue=kwargs.get("venue"),
+            competition=kwargs.get("competition"),
+            closes=kwargs.get("closes"),
+            name=kwargs.get("name"),
+            number=int(kwargs.get("number", 0)),
+            sport=kwargs.get("sport"),
+            game=kwargs.get("game"),
+        )
+        for sel in element.xpath("selections/selection"):
+            # copied for every selection, and never used.
+            dict(sel.attrib)
+            comp.add_selection(
+                stats.Selection(
+                    number=int(sel.get("number", 0)),
+                    name=sel.get("name"),
+                    odds=int(sel.get("odds", 0)),
+                    status=sel.get("status"),
+                )
+            )
+        yield comp
+
+
+def _bench_xml(filename, method):
+    parser = stats.XMLParser()
+    with open(filename, "rb") as fh:
+        parser.parse(fh)
+
+    def extract():
+        if method == "xpath":
+            count = int(parser.data.xpath("count(//options/option)"))
+            competitions = _xpath_competitions(parser.data)
+        else:
+            count = parser.option_count()
+            competitions = parser.get_competitions()
+        for each in competitions:
+            each.market_percentage()
+        return count
+
+    return _measure(extract, False)
+
+
+def bench_xml(count=200000, selections=8):
+    """
+    Time counting the options of a synthetic XML feed and extracting their
+    competitions and market percentages with :class:`stats.XMLParser`,
+    against searching the document with XPath for every walk.
+
+    :returns: One result per method.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        filename, = write_feeds(directory, 1, count, selections, "xml")
+        for method in ["xpath", "parser"]:
+            result = _in_child(_bench_xml, filename, method)
+            result.update({"name": "xml.{}".format(method)})
+            results.append(result)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def _corrupt_options(options, every):
+    """
+    Give every ``every``-th option a selection with invalid odds.
+    """
+    for index, each in enumerate(options):
+        if index % every == every - 1:
+            each["selections"]["selection"][0]["odds"] = "n/a"
+        yield each
+
+
+def _bench_validate(filename, parser_name, errors):
+    def load():
+        reporter = stats.Reporter(getattr(stats, parser_name)(errors=errors))
+        with open(filename, "rb") as fh:
+            reporter.load(fh)
+            reporter.aggregate()
+    return _measure(load, False)
+
+
+def bench_validate(count=200000, selections=8, every=1000):
+    """
+    Time loading a synthetic feed and generating every report without
+    checking the options, checking them, and skipping the invalid ones of a
+    feed where every ``every``-th option is invalid.
+
+    :returns: One result per parser and mode.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        for fmt, parsers in [
+            ("json", ["JSONParser", "JSONStreamParser"]),
+            ("xml", ["XMLParser", "XMLStreamParser"]),
+        ]:
+            writer = write_json_feed if fmt == "json" else write_xml_feed
+            clean, = write_feeds(directory, 1, count, selections, fmt)
+            corrupt = os.path.join(directory, "corrupt." + fmt)
+            with open(corrupt, "w") as fh:
+                writer(
+                    fh,
+                    _corrupt_options(
+                        generate_options(count, selections),
+                        every,
+                    ),
+                )
+
+            for parser_name in parsers:
+                for errors, filename in [
+                    (None, clean),
+                    ("strict", clean),
+                    ("skip", corrupt),
+                ]:
+                    result = _in_child(
+                        _bench_validate,
+                        filename,
+                        parser_name,
+                        errors,
+                    )
+                    result.update({
+                        "name": "{}.{}".format(parser_name, errors),
+                    })
+                    results.append(result)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def _bench_query(filename, parser_name, method, query):
+    parser = getattr(stats, parser_name)()
+    with open(filename, "rb") as fh:
+        parser.parse(fh)
+
+        def select():
+            if method == "filter":
+                competitions = [
+                    each for each in parser.get_competitions()
+                    if query.match(each)
+                ]
+            else:
+                competitions = list(parser.query(query))
+            for each in competitions:
+                each.market_percentage()
+
+        return _measure(select, False)
+
+
+def bench_query(count=200000, selections=8):
+    """
+    Time selecting the options of a sport closing within a day, and then
+    calculating their market percentage, with :meth:`stats.IStatsParser.query`
+    against filtering every competition.
+
+    :returns: One result per parser and method.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    query = stats.Query(
+        where={"sport": sport_name(0)},
+        closes_after="2016-04-02 00:00:00",
+        closes_before="2016-04-03 00:00:00",
+    )
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        for fmt, parsers in [
+            ("json", ["JSONParser", "JSONStreamParser"]),
+            ("xml", ["XMLParser", "XMLStreamParser"]),
+        ]:
+            filename, = write_feeds(directory, 1, count, selections, fmt)
+            for parser_name in parsers:
+                for method in ["filter", "query"]:
+                    result = _in_child(
+                        _bench_query,
+                        filename,
+                        parser_name,
+                        method,
+                        query,
+                    )
+                    result.update({
+                        "name": "{}.{}".format(parser_name, method),
+                    })
+                    results.append(result)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def _move_odds(options, every):
+    """
+    Double the first odds of every ``every``-th option.
+    """
+    for index, each in enumerate(options):
+        if index % every == 0:
+            selection = each["selections"]["selection"][0]
+            selection["odds"] = str(int(selection["odds"]) * 2)
+        yield each
+
+
+def _bench_diff(old, new, method, buffer_rows):
+    def diff():
+        if method == "load":
+            # the snapshots are loaded whole and joined in a dictionary.
+            reporters = []
+            for filename in [old, new]:
+                reporter = stats.Reporter(stats.JSONParser())
+                with open(filename, "rb") as fh:
+                    reporter.load(fh)
+                reporters.append(reporter)
+            before = {
+                stats.option_key(each): each
+                for each in reporters[0].parser.get_competitions()
+            }
+            for each in reporters[1].parser.get_competitions():
+                previous = before.pop(stats.option_key(each), None)
+                if previous is not None and (
+                    stats._fingerprint(previous) != stats._fingerprint(each)
+                ):
+                    previous.market_percentage()
+                    each.market_percentage()
+        else:
+            parsers = [stats.JSONStreamParser(), stats.JSONStreamParser()]
+            with open(old, "rb") as first, open(new, "rb") as second:
+                parsers[0].parse(first)
+                parsers[1].parse(second)
+                stats.write_diff(
+                    io.StringIO(),
+                    *parsers,
+                    buffer_rows=buffer_rows
+                )
+    return _measure(diff, False)
+
+
+def bench_diff(count=200000, selections=8, every=100):
+    """
+    Time computing the changes between two snapshots of a synthetic feed,
+    where every ``every``-th option has new odds, by loading both of them
+    against :func:`stats.write_diff` merging them in memory and spilling to
+    temporary files.
+
+    :returns: One result per method and sort buffer.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        old, = write_feeds(directory, 1, count, selections)
+        new = os.path.join(directory, "new.json")
+        with open(new, "w") as fh:
+            write_json_feed(
+                fh,
+                _move_odds(generate_options(count, selections), every),
+            )
+
+        for method, buffer_rows in [
+            ("load", None),
+            ("write_diff", count),
+            ("write_diff", count // 20),
+        ]:
+            result = _in_child(_bench_diff, old, new, method, buffer_rows)
+            result.update({
+                "name": "{}.{}".format(method, buffer_rows),
+                "method": method,
+                "buffer_rows": buffer_rows,
+            })
+            results.append(result)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def _bench_dump(filename, method, buffer_rows, competitions):
+    reporter = stats.Reporter(stats.JSONParser())
+    with open(filename, "rb") as fh:
+        reporter.load(fh)
+
+    directory = tempfile.mkdtemp()
+    try:
+        def dump():
+            if method == "dump_compentition_market_prices":
+                for index in range(competitions):
+                    reporter.dump_compentition_market_prices(
+                        competition_name(index),
+                        io.StringIO(),
+                    )
+            elif method == "dump_market_prices":
+                with open(os.path.join(directory, "all.csv"), "w") as fh:
+                    reporter.dump_market_prices(fh, buffer_rows=buffer_rows)
+            else:
+                reporter.dump_market_prices_by_competition(
+                    directory,
+                    buffer_rows=buffer_rows,
+                )
+        return _measure(dump, False)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_dump(count=200000, selections=8, competitions=50):
+    """
+    Compare dumping the market prices of every competition by calling
+    :meth:`stats.Reporter.dump_compentition_market_prices` once per
+    competition with the streaming dumps, sorting in memory and spilling
+    to temporary files.
+
+    :returns: One result per method and sort buffer, with rows written per
+        second.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        filename, = write_feeds(
+            directory,
+            1,
+            count,
+            selections,
+            competitions=competitions,
+        )
+        for method, buffer_rows in [
+            ("dump_compentition_market_prices", None),
+            ("dump_market_prices", count),
+            ("dump_market_prices", count // 20),
+            ("dump_market_prices_by_competition", count),
+            ("dump_market_prices_by_competition", count // 20),
+        ]:
+            result = _in_child(
+                _bench_dump,
+                filename,
+                method,
+                buffer_rows,
+                competitions,
+            )
+            result.update({
+                "name": "{}.{}".format(method, buffer_rows),
+                "method": method,
+                "buffer_rows": buffer_rows,
+                "rows": count,
+                "rows_per_s": count / result["wall_s"],
+            })
+            results.append(result)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def _bench_reload(filename):
+    reporter = stats.Reporter(stats.make_parser(filename))
+
+    def load():
+        with open(filename, "rb") as fh:
+            reporter.load(fh)
+            reporter.aggregate()
+    return _measure(load, False)
+
+
+def _bench_export(filename, exported):
+    def export():
+        reporter = stats.Reporter(stats.JSONParser())
+        with open(filename, "rb") as fh:
+            reporter.load(fh)
+        with open(exported, "wb") as fh:
+            reporter.export(fh)
+    return _measure(export, False)
+
+
+def bench_export(count=200000, selections=8):
+    """
+    Time exporting a synthetic feed with :meth:`stats.Reporter.export` and
+    generating every report from the export, against generating them from
+    the JSON feed.
+
+    :returns: One result per step.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        filename, = write_feeds(directory, 1, count, selections)
+        exported = os.path.join(directory, "feed.stx")
+
+        result = _in_child(_bench_export, filename, exported)
+        result.update({"name": "export", "bytes": os.path.getsize(exported)})
+        results.append(result)
+
+        for name in [filename, exported]:
+            result = _in_child(_bench_reload, name)
+            result.update({
+                "name": "aggregate" + os.path.splitext(name)[1],
+                "bytes": os.path.getsize(name),
+            })
+            results.append(result)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def bench_batch(count=20000, selections=8, files=32, jobs=None):
+    """
+    Time :func:`stats.aggregate_files` over many synthetic files with an
+    increasing number of worker processes.
+
+    :returns: One result per worker count.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    directory = tempfile.mkdtemp()
+    try:
+        filenames = write_feeds(directory, files, count, selections)
+        results = []
+        workers = 1
+        while True:
+            start = time.perf_counter()
+            stats.aggregate_files(filenames, comp=competition_name(0),
+                                  jobs=workers)
+            elapsed = time.perf_counter() - start
+            results.append({
+                "name": "jobs.{}".format(workers),
+                "files": files,
+                "options_per_file": count,
+                "jobs": workers,
+                "wall_s": elapsed,
+                "speedup": results[0]["wall_s"] / elapsed if results else 1.0,
+            })
+            if workers >= jobs:
+                break
+            workers = min(workers * 2, jobs)
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_chunks(count=None, selections=8, jobs=None):
+    """
+    Compare the serial XML path with :func:`stats.aggregate_xml_chunks` for
+    increasing file sizes and worker counts.
+
+    :param count: Number of options of the largest file, smaller files have
+        a quarter and a sixteenth of it.
+    :type count: :class:`int`
+    :returns: One result per file size and worker count.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    if count is None:
+        count = 200000
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        for size in [count // 16, count // 4, count]:
+            filename, = write_feeds(directory, 1, size, selections, "xml")
+
+            start = time.perf_counter()
+            reporter = stats.Reporter(stats.XMLParser())
+            with open(filename, "rb") as fh:
+                reporter.load(fh)
+            reporter.aggregate()
+            serial = time.perf_counter() - start
+            results.append({
+                "name": "{}.serial".format(size),
+                "options": size,
+                "bytes": os.path.getsize(filename),
+                "jobs": 0,
+                "wall_s": serial,
+                "speedup": 1.0,
+            })
+
+            workers = 1
+            while True:
+                start = time.perf_counter()
+                stats.aggregate_xml_chunks(filename, jobs=workers)
+                elapsed = time.perf_counter() - start
+                results.append({
+                    "name": "{}.jobs.{}".format(size, workers),
+                    "options": size,
+                    "bytes": os.path.getsize(filename),
+                    "jobs": workers,
+                    "wall_s": elapsed,
+                    "speedup": serial / elapsed,
+                })
+                if workers >= jobs:
+                    break
+                workers = min(workers * 2, jobs)
+            os.remove(filename)
+        return results
+    finally:
+        shutil.rmtree(directory)
+
+
+#: Operations timed by the suite benchmark, each one runs on a loaded
+#: :class:`stats.Reporter`.
+OPERATIONS = collections.OrderedDict([
+    ("option_count", lambda r, comp: r.parser.option_count()),
+    ("get_competitions", lambda r, comp: list(r.parser.get_competitions())),
+    ("Reporter.option_count", lambda r, comp: r.option_count()),
+    (
+        "Reporter.largest_market_percentage",
+        lambda r, comp: r.largest_market_percentage(),
+    ),
+    (
+        "Reporter.least_market_percentage",
+        lambda r, comp: r.least_market_percentage(),
+    ),
+    ("Reporter.summary", lambda r, comp: r.summary()),
+    (
+        "Reporter.dump_compentition_market_prices",
+        lambda r, comp: r.dump_compentition_market_prices(comp, io.StringIO()),
+    ),
+    ("Reporter.aggregate", lambda r, comp: r.aggregate(comp=comp)),
+])
+
+
+def _measure(func, allocations):
+    """
+    Call ``func`` and measure its wall time, peak RSS growth and, when
+    ``allocations`` is set, its traced memory allocations.
+    """
+    baseline = peak_rss()
+    if allocations:
+        tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    result = {"wall_s": elapsed, "peak_rss_kb": peak_rss() - baseline}
+    if allocations:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["alloc_peak_bytes"] = peak
+    return result
+
+
+def _bench_operation(filename, parser_name, operation, comp, allocations):
+    reporter = stats.Reporter(getattr(stats, parser_name)())
+    with open(filename, "rb") as fh:
+        if operation == "parse":
+            return _measure(lambda: reporter.load(fh), allocations)
+        reporter.load(fh)
+        return _measure(
+            lambda: OPERATIONS[operation](reporter, comp),
+            allocations,
+        )
+
+
+def _bench_cli(filename):
+    return _bench_command([
+        stats.__file__,
+        filename,
+        "--options",
+        "--summary",
+        "--largest-market-percentage",
+        "--least-market-percentage",
+    ])
+
+
+def _bench_command(arguments):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable] + arguments,
+        stdout=subprocess.DEVNULL,
+        cwd=os.path.dirname(os.path.abspath(stats.__file__)),
+        check=True,
+    )
+    elapsed = time.perf_counter() - start
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "wall_s": elapsed,
+        "returncode": proc.returncode,
+        "peak_rss_kb": usage.ru_maxrss,
+    }
+
+
+def bench_suite(count=20000, selections=8, sports=len(SPORTS),
+                competitions=50, repeat=3, allocations=False):
+    """
+    Time the parsers, the :class:`stats.Reporter` methods and the CLI on a
+    synthetic JSON and XML feed.
+
+    Every measurement runs in a fresh process, the best wall time of
+    ``repeat`` runs is kept together with the peak RSS growth of that run.
+
+    :param allocations: Also trace the peak Python allocations of each
+        operation. Tracing slows everything down, so it is a separate run
+        that does not affect the wall times.
+    :type allocations: :class:`bool`
+    :returns: One result per parser and operation.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    directory = tempfile.mkdtemp()
+    results = []
+    comp = competition_name(0, sports)
+    try:
+        for fmt, parser_name in [("json", "JSONParser"), ("xml", "XMLParser")]:
+            filename, = write_feeds(
+                directory,
+                1,
+                count,
+                selections,
+                fmt,
+                sports=sports,
+                competitions=competitions,
+            )
+
+            for operation in ["parse"] + list(OPERATIONS):
+                runs = [
+                    _in_child(
+                        _bench_operation,
+                        filename,
+                        parser_name,
+                        operation,
+                        comp,
+                        False,
+                    )
+                    for _ in range(repeat)
+                ]
+                result = min(runs, key=lambda x: x["wall_s"])
+                if allocations:
+                    result["alloc_peak_bytes"] = _in_child(
+                        _bench_operation,
+                        filename,
+                        parser_name,
+                        operation,
+                        comp,
+                        True,
+                    )["alloc_peak_bytes"]
+                result.update(
+                    {"name": "{}.{}".format(parser_name, operation)}
+                )
+                results.append(result)
+
+            runs = [_in_child(_bench_cli, filename) for _ in range(repeat)]
+            result = min(runs, key=lambda x: x["wall_s"])
+            result.update({"name": "cli.{}".format(fmt)})
+            results.append(result)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def bench_startup(repeat=10):
+    """
+    Time cold starts of the CLI on the small sample feeds: importing the
+    module, printing the help and counting the options of a JSON, an XML
+    and a gzip compressed feed without extension, and of the JSON feed
+    through ``python -m stats``.
+
+    :returns: One result per command, the best wall time of ``repeat``
+        runs.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        compressed = os.path.join(directory, "feed")
+        with open(JSONFILE, "rb") as fh, gzip.open(compressed, "wb") as out:
+            shutil.copyfileobj(fh, out)
+
+        commands = [
+            ("import", ["-c", "import stats"]),
+            ("help", [stats.__file__, "-h"]),
+            ("json", [stats.__file__, JSONFILE, "--options"]),
+            ("module", ["-m", "stats", JSONFILE, "--options"]),
+            ("xml", [stats.__file__, XMLFILE, "--options"]),
+            ("gzip", [stats.__file__, compressed, "--options"]),
+        ]
+        for name, arguments in commands:
+            runs = [
+                _in_child(_bench_command, arguments)
+                for _ in range(repeat)
+            ]
+            result = min(runs, key=lambda x: x["wall_s"])
+            result.update({"name": "startup.{}".format(name)})
+            results.append(result)
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def metadata(**params):
+    """
+    Describe the environment of a benchmark run so results can be compared
+    across commits.
+    """
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": multiprocessing.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "params": params,
+    }
+
+
+def compare(old, new, threshold=1.1):
+    """
+    Compare two benchmark documents.
+
+    :param old: Baseline document.
+    :type old: :class:`dict`
+    :param new: Document being compared.
+    :type new: :class:`dict`
+    :param threshold: Ratio of the wall times above which a result is
+        reported as a regression.
+    :type threshold: :class:`float`
+    :returns: Comparison of every result found in both documents.
+    :rtype: :class:`list` of :class:`dict`
+    """
+    # results written before every benchmark named its results are skipped.
+    before = dict(
+        (each["name"], each)
+        for each in old["results"]
+        if "name" in each
+    )
+    rows = []
+    for each in new["results"]:
+        if each.get("name") not in before:
+            continue
+        ratio = each["wall_s"] / before[each["name"]]["wall_s"]
+        rows.append({
+            "name": each["name"],
+            "old_wall_s": before[each["name"]]["wall_s"],
+            "new_wall_s": each["wall_s"],
+            "ratio": ratio,
+            "regression": ratio > threshold,
+        })
+    return rows
+
+
+#: Benchmarks run from the command line, by name.
+BENCHMARKS = {
+    "batch": bench_batch,
+    "chunks": bench_chunks,
+    "columnar": bench_columnar,
+    "diff": bench_diff,
+    "dump": bench_dump,
+    "export": bench_export,
+    "load": bench_load,
+    "market_percentage": bench_market_percentage,
+    "model": bench_model,
+    "query": bench_query,
+    "startup": bench_startup,
+    "suite": bench_suite,
+    "validate": bench_validate,
+    "xml": bench_xml,
+}
+
+
+def benchmark_params(name, params):
+    """
+    Check the parameters given to a benchmark.
+
+    :param name: Name of the benchmark in :data:`BENCHMARKS`.
+    :type name: :class:`str`
+    :param params: Parameters given on the command line, the ones left
+        unset are ``None``.
+    :type params: :class:`dict`
+    :returns: Keyword arguments of the benchmark.
+    :rtype: :class:`dict`
+    :raises ValueError: If a parameter does not apply to the benchmark.
+    """
+    accepted = inspect.signature(BENCHMARKS[name]).parameters
+    kwargs = dict(
+        (key, value) for key, value in params.items() if value is not None
+    )
+    unknown = sorted(key for key in kwargs if key not in accepted)
+    if unknown:
+        raise ValueError(
+            "{} does not apply to the {} benchmark".format(
+                ", ".join("--" + key for key in unknown),
+                name,
+            )
+        )
+    return kwargs
+
+
+if __name__ == "__main__":  # pragma: no cover
+    import argparse
+
+    args = argparse.ArgumentParser(description="Run the stats benchmarks.")
+
+    args.add_argument(
+        "benchmark",
+        choices=sorted(BENCHMARKS),
+        help="Benchmark to run."
+    )
+
+    args.add_argument(
+        "--count",
+        type=int,
+        help="Number of synthetic options (per file)."
+    )
+
+    args.add_argument(
+        "--selections",
+        type=int,
+        help="Number of selections per synthetic option."
+    )
+
+    args.add_argument(
+        "--sports",
+        type=int,
+        help="Number of distinct sports of the suite benchmark feeds."
+    )
+
+    args.add_argument(
+        "--competitions",
+        type=int,
+        help="Number of distinct competitions of the suite benchmark feeds."
+    )
+
+    args.add_argument(
+        "--repeat",
+        type=int,
+        help="Number of runs of each suite and startup measurement, the "
+             "best is kept."
+    )
+
+    args.add_argument(
+        "--allocations",
+        action="store_true",
+        default=None,
+        help="Also trace the peak allocations in the suite benchmark."
+    )
+
+    args.add_argument(
+        "--files",
+        type=int,
+        help="Number of synthetic files for the batch benchmark."
+    )
+
+    args.add_argument(
+        "--jobs",
+        type=int,
+        help="Maximum number of worker processes for the batch and chunks "
+             "benchmarks."
+    )
+
+    args.add_argument(
+        "--scale",
+        type=int,
+        help="Number of times options.json is repeated for the model "
+             "benchmark."
+    )
+
+    args.add_argument(
+        "--output",
+        metavar="FILENAME",
+        help="Write the results to a JSON file."
+    )
+
+    args.add_argument(
+        "--compare",
+        metavar="FILENAME",
+        help="Compare the results with a previous --output file."
+    )
+
+    ns = args.parse_args()
+    try:
+        kwargs = benchmark_params(
+            ns.benchmark,
+            dict(
+                (key, value)
+                for key, value in vars(ns).items()
+                if key not in ("benchmark", "output", "compare")
+            ),
+        )
+    except ValueError as err:
+        args.error(str(err))
+    document = metadata(benchmark=ns.benchmark, **kwargs)
+    document["results"] = BENCHMARKS[ns.benchmark](**kwargs)
+
+    if ns.output:
+        with open(ns.output, "w") as fh:
+            json.dump(document, fh, indent=2)
+
+    if ns.compare:
+        with open(ns.compare) as fh:
+            document = {"comparison": compare(json.load(fh), document)}
+
+    print(json.dumps(document, indent=2))
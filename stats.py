@@ -3,10 +3,93 @@
 Sport stats reporter.
 """
 import abc
+import array
+import bisect
+import codecs
 import collections
-import csv
-import json
-from lxml import etree
+import contextlib
+import functools
+import heapq
+import importlib
+import io
+import itertools
+import operator
+import os
+import re
+import struct
+import sys
+import time
+
+
+class _LazyModule(object):
+    """
+    Stand-in for a module imported when one of its attributes is first used.
+
+    Keeps the start-up of the script short, the parser back-ends, the
+    server and the modules only some runs use are imported by the runs
+    needing them.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+asyncio = _LazyModule("asyncio")
+csv = _LazyModule("csv")
+etree = _LazyModule("lxml.etree")
+futures = _LazyModule("concurrent.futures")
+glob = _LazyModule("glob")
+hashlib = _LazyModule("hashlib")
+json = _LazyModule("json")
+mmap = _LazyModule("mmap")
+pickle = _LazyModule("pickle")
+tempfile = _LazyModule("tempfile")
+tracemalloc = _LazyModule("tracemalloc")
+urlparse = _LazyModule("urllib.parse")
+
+
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    """
+    Import :mod:`numpy`, if available.
+    """
+    try:
+        return importlib.import_module("numpy")
+    except ImportError:  # pragma: no cover
+        return None
+
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+#: Size of the chunks read from a file handle by the streaming parsers.
+CHUNK_SIZE = 64 * 1024
+
+#: Version of the parsed output, bump whenever the competitions built from a
+#: file change so cached results are not reused.
+PARSER_VERSION = 1
+
+#: Binary layout of the :class:`~.CompetitionStore` files.
+STORE_MAGIC = b"STATSCOL"
+STORE_VERSION = 2
+STORE_HEADER = struct.Struct("<8sI?I")
+STORE_SECTION = struct.Struct("<cIQ")
+
+#: Binary layout of the :class:`~.ColumnarWriter` export files.
+EXPORT_SUFFIX = ".stx"
+EXPORT_MAGIC = b"STATSEXP"
+EXPORT_VERSION = 1
+EXPORT_HEADER = struct.Struct("<8sI4x")
+EXPORT_CHUNK = struct.Struct("<QQQ")
+EXPORT_FOOTER = struct.Struct("<Q8s")
 
 
 def calc_market_percentage(prices):
@@ -26,17 +109,394 @@ def calc_market_percentage(prices):
     return value
 
 
-class IStatsParser(object):  # pragma: no cover
+def calc_market_percentages(prices, offsets, exact=True):
+    """
+    Calculate the market percentages of many sets of prices at once.
+
+    The prices of every set are stored one after the other in a single flat
+    buffer, the prices of set ``i`` are found between ``offsets[i]`` and
+    ``offsets[i + 1]``. Prices which are not positive are skipped, like in
+    :meth:`Competition.market_percentage`.
+
+    With :mod:`numpy` the calculation is vectorised across the sets. When
+    ``exact`` is set the inverse prices of every set are still added from
+    left to right, so the results are identical to the ones of
+    :func:`calc_market_percentage`. Otherwise each set is reduced with
+    :func:`numpy.add.reduceat`, which is faster but only matches within a
+    relative error of ``n * 2 ** -53`` for a set of ``n`` prices.
+
+    :param prices: Prices in cents of all the sets.
+    :type prices: sequence or buffer of :class:`int`
+    :param offsets: Start of every set in ``prices`` followed by the end of
+        the last one.
+    :type offsets: sequence or buffer of :class:`int`
+    :param exact: Add the prices in the same order as
+        :func:`calc_market_percentage`.
+    :type exact: :class:`bool`
+    :returns: Market percentage of every set.
+    :rtype: sequence of :class:`float`
+    """
+    numpy = _numpy()
+    if numpy is None:  # pragma: no cover
+        return [
+            calc_market_percentage(
+                price
+                for price in prices[offsets[i]:offsets[i + 1]]
+                if price > 0
+            )
+            for i in range(len(offsets) - 1)
+        ]
+
+    prices = numpy.asarray(prices, dtype=numpy.float64)
+    offsets = numpy.asarray(offsets, dtype=numpy.int64)
+    starts = offsets[:-1]
+    lengths = offsets[1:] - starts
+
+    # the trailing zero keeps reduceat in bounds for trailing empty sets.
+    inverse = numpy.zeros(len(prices) + 1)
+    priced = prices > 0
+    inverse[:-1][priced] = 1.0 / prices[priced]
+
+    if not exact:
+        if not len(starts):
+            return numpy.zeros(0)
+        sums = numpy.add.reduceat(inverse, starts)
+        sums[lengths == 0] = 0.0
+        return sums
+
+    # add the n-th price of every set long enough at once, the sets are
+    # ordered by decreasing length so the ones still going are a prefix.
+    order = numpy.argsort(-lengths, kind="stable")
+    starts = starts[order]
+    descending = -lengths[order]
+    longest = -descending[0] if len(descending) else 0
+    counts = numpy.searchsorted(descending, -numpy.arange(longest), "left")
+
+    sums = numpy.zeros(len(order))
+    for position, count in enumerate(counts):
+        sums[:count] += inverse[starts[:count] + position]
+
+    result = numpy.empty(len(order))
+    result[order] = sums
+    return result
+
+
+#: Fields of an option and their types, in :class:`~.Competition` order.
+OPTION_SCHEMA = (
+    ("venue", str),
+    ("competition", str),
+    ("closes", str),
+    ("name", str),
+    ("number", int),
+    ("sport", str),
+    ("game", str),
+)
+
+#: Fields of a selection and their types, in :class:`~.Selection` order.
+SELECTION_SCHEMA = (
+    ("number", int),
+    ("name", str),
+    ("odds", int),
+    ("status", str),
+)
+
+
+class RecordError(ValueError):
+    """
+    Option of a stats file not matching :data:`OPTION_SCHEMA` or
+    :data:`SELECTION_SCHEMA`.
+
+    :param position: Position of the option in the file.
+    :type position: :class:`int`
+    :param field: Invalid field, selection fields are prefixed with
+        ``selection.``.
+    :type field: :class:`str`
+    :param value: Invalid value.
+    :param expected: Type the field is expected to hold.
+    :type expected: :class:`str`
+    """
+    def __init__(self, position, field, value, expected):
+        super(RecordError, self).__init__(
+            "Invalid option at position {}: {} is {!r}, expected {}".format(
+                position,
+                field,
+                value,
+                expected,
+            )
+        )
+        self.position = position
+        self.field = field
+        self.value = value
+        self.expected = expected
+
+
+def _check_fields(schema, get, position, prefix=""):
+    """
+    Check the fields of a record against a schema, missing fields are
+    allowed.
+
+    :returns: The error of the first invalid field, if any.
+    :rtype: :class:`~.RecordError`
+    """
+    for field, kind in schema:
+        value = get(field)
+        if value is None:
+            continue
+        if kind is int:
+            try:
+                int(value)
+            except (TypeError, ValueError):
+                return RecordError(position, prefix + field, value, "int")
+        elif not isinstance(value, kind):
+            return RecordError(position, prefix + field, value, kind.__name__)
+    return None
+
+
+class Query(object):
+    """
+    Query selecting options by their attributes and selection odds.
+
+    Parsers evaluate queries with :meth:`IStatsParser.query` on the parsed
+    options, so options not matching are never turned into
+    :class:`~.Competition` objects.
+
+    :param where: Values of option attributes keyed by attribute, an option
+        matches when every attribute holds one of its values. Eg:
+        ``{"sport": ["Football", "Tennis"]}``
+    :type where: :class:`dict`
+    :param closes_after: Earliest closing time, inclusive.
+    :type closes_after: :class:`str`
+    :param closes_before: Latest closing time, exclusive.
+    :type closes_before: :class:`str`
+    :param odds_min: Options match when one of their selections has odds of
+        at least this.
+    :type odds_min: :class:`int`
+    :param odds_max: Options match when one of their selections has odds of
+        at most this.
+    :type odds_max: :class:`int`
+    :raises ValueError: If an attribute is not an option field, or a value
+        does not have its type.
+    """
+    def __init__(self, where=None, closes_after=None, closes_before=None,
+                 odds_min=None, odds_max=None):
+        types = dict(OPTION_SCHEMA)
+        self.where = {}
+        for field, values in (where or {}).items():
+            if field not in types:
+                raise ValueError("Unsupported field {!r}".format(field))
+            if isinstance(values, (str, int)):
+                values = [values]
+            self.where[field] = frozenset(types[field](x) for x in values)
+        self.closes_after = closes_after
+        self.closes_before = closes_before
+        self.odds_min = odds_min
+        self.odds_max = odds_max
+
+    @classmethod
+    def parse(cls, conditions, **kwargs):
+        """
+        Build a query from ``FIELD=VALUE`` conditions.
+
+        :param conditions: Conditions, several for the same field match any
+            of their values.
+        :type conditions: iterable of :class:`str`
+        :returns: The query, extra keyword arguments are passed on to it.
+        :rtype: :class:`~.Query`
+        :raises ValueError: If a condition is malformed.
+        """
+        where = {}
+        for each in conditions:
+            field, sep, value = each.partition("=")
+            if not sep:
+                raise ValueError("Expected FIELD=VALUE, got {!r}".format(each))
+            where.setdefault(field.strip(), []).append(value)
+        return cls(where=where, **kwargs)
+
+    def __repr__(self):
+        return "Query(where={!r}, closes_after={!r}, closes_before={!r}, " \
+            "odds_min={!r}, odds_max={!r})".format(
+                sorted(
+                    (field, sorted(values))
+                    for field, values in self.where.items()
+                ),
+                self.closes_after,
+                self.closes_before,
+                self.odds_min,
+                self.odds_max,
+            )
+
+    def restrict(self, field, value):
+        """
+        Return a query also requiring an attribute to hold a value.
+
+        :param field: Option attribute.
+        :type field: :class:`str`
+        :param value: Value the attribute must be equal to.
+        :returns: The narrower query.
+        :rtype: :class:`~.Query`
+        """
+        where = dict(self.where)
+        value = dict(OPTION_SCHEMA)[field](value)
+        where[field] = where.get(field, frozenset([value])) & set([value])
+        return Query(
+            where=where,
+            closes_after=self.closes_after,
+            closes_before=self.closes_before,
+            odds_min=self.odds_min,
+            odds_max=self.odds_max,
+        )
+
+    def match_option(self, get):
+        """
+        Check the attributes of an option.
+
+        :param get: Return the value of an option attribute, such as the
+            ``get`` method of a decoded JSON option or an XML element.
+        :type get: callable
+        :returns: Whether the attributes match.
+        :rtype: :class:`bool`
+        """
+        for field, values in self.where.items():
+            value = get(field)
+            if field == "number":
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    return False
+            if value not in values:
+                return False
+        if self.closes_after is not None or self.closes_before is not None:
+            closes = get("closes") or ""
+            if self.closes_after is not None and closes < self.closes_after:
+                return False
+            if self.closes_before is not None and (
+                closes >= self.closes_before
+            ):
+                return False
+        return True
+
+    def match_odds(self, odds):
+        """
+        Check the selection odds of an option, only consumed when odds
+        thresholds were given.
+
+        :param odds: Odds of the selections.
+        :type odds: iterable of :class:`int`
+        :returns: Whether the odds match.
+        :rtype: :class:`bool`
+        """
+        if self.odds_min is None and self.odds_max is None:
+            return True
+        for each in odds:
+            if (self.odds_min is None or each >= self.odds_min) and (
+                self.odds_max is None or each <= self.odds_max
+            ):
+                return True
+        return False
+
+    def match(self, competition):
+        """
+        Check a competition.
+
+        :param competition: Competition being checked.
+        :type competition: :class:`~.Competition`
+        :returns: Whether the competition matches.
+        :rtype: :class:`bool`
+        """
+        return self.match_option(
+            functools.partial(getattr, competition)
+        ) and self.match_odds(
+            sel.odds for sel in competition.get_selections()
+        )
+
+
+class IStatsParser(metaclass=abc.ABCMeta):
     """
     Interface for a stats parser.
+
+    Parsers of JSON and XML feeds can check every option and its selections
+    against :data:`OPTION_SCHEMA` and :data:`SELECTION_SCHEMA` in a single
+    pass when parsing. With ``errors="strict"`` the first invalid option
+    raises a :class:`~.RecordError` from :meth:`parse`. With
+    ``errors="skip"`` invalid options are left out of every report, counted
+    in :attr:`skipped` and written to ``quarantine`` as JSON lines. Options
+    are not checked by default.
+
+    :param errors: ``None``, ``"strict"`` or ``"skip"``.
+    :type errors: :class:`str`
+    :param quarantine: Text write file handler receiving the skipped
+        options.
+    :type quarantine: :class:`file`
     """
-    __metaclass__ = abc.ABCMeta
+    def __init__(self, errors=None, quarantine=None):
+        if errors not in (None, "strict", "skip"):
+            raise ValueError("Unsupported errors mode {!r}".format(errors))
+        self.data = None
+        self.errors = errors
+        self.quarantine = quarantine
+        self.skipped = 0
 
-    def __init__(self):
+    def release(self):
+        """
+        Release the parsed document, the parser can parse another file
+        afterwards.
+        """
         self.data = None
 
+    def check_record(self, record, position):
+        """
+        Check a parsed option and its selections against the schemas.
+
+        :param record: Parsed option.
+        :param position: Position of the option in the file.
+        :type position: :class:`int`
+        :returns: The error found, if any.
+        :rtype: :class:`~.RecordError`
+        """
+        return None
+
+    def dump_record(self, record):
+        """
+        Serialise a parsed option for the quarantine file.
+
+        :param record: Parsed option.
+        :returns: The option as found in the file.
+        :rtype: :class:`str`
+        """
+        return repr(record)
+
+    def _invalid_positions(self, records):
+        """
+        Check the parsed options as configured by ``errors``.
+
+        :param records: Parsed options.
+        :type records: iterable
+        :returns: Positions of the skipped options.
+        :rtype: :class:`set`
+        :raises RecordError: On the first invalid option in strict mode.
+        """
+        invalid = set()
+        for position, record in enumerate(records):
+            error = self.check_record(record, position)
+            if error is None:
+                continue
+            if self.errors != "skip":
+                raise error
+            invalid.add(position)
+            if self.quarantine is not None:
+                self.quarantine.write(
+                    json.dumps({
+                        "position": position,
+                        "field": error.field,
+                        "error": str(error),
+                        "record": self.dump_record(record),
+                    }) + "\n"
+                )
+        self.skipped = len(invalid)
+        return invalid
+
     @abc.abstractmethod
-    def parse(self, fh):
+    def parse(self, fh):  # pragma: no cover
         """
         Parse the file handler.
 
@@ -45,8 +505,23 @@ class IStatsParser(object):  # pragma: no cover
         """
         pass
 
+    def parse_buffer(self, buffer):
+        """
+        Parse the content of a file held in a buffer.
+
+        Buffers with a file interface, like memory mapped files, are parsed
+        in place. Others are wrapped in a file handler, parsers which can
+        read a buffer directly override this.
+
+        :param buffer: Content of the file. Eg: :func:`map_file`
+        :type buffer: bytes-like object
+        """
+        if not hasattr(buffer, "seek"):
+            buffer = io.BytesIO(buffer)
+        self.parse(buffer)
+
     @abc.abstractmethod
-    def option_count(self):
+    def option_count(self):  # pragma: no cover
         """
         Count how many options are available.
 
@@ -56,7 +531,7 @@ class IStatsParser(object):  # pragma: no cover
         pass
 
     @abc.abstractmethod
-    def get_competitions_by_name(self, name):
+    def get_competitions_by_name(self, name):  # pragma: no cover
         """
         Get all the competitions by name.
 
@@ -68,7 +543,7 @@ class IStatsParser(object):  # pragma: no cover
         pass
 
     @abc.abstractmethod
-    def get_competitions(self):
+    def get_competitions(self):  # pragma: no cover
         """
         Get all the competitions.
 
@@ -77,6 +552,278 @@ class IStatsParser(object):  # pragma: no cover
         """
         pass
 
+    def get_competitions_by(self, field, value):
+        """
+        Get all the competitions with an attribute matching a value.
+
+        :param field: Competition attribute. Eg: sport
+        :type field: :class:`str`
+        :param value: Value the attribute must be equal to.
+        :returns: All the competitions found that match the provided value.
+        :rtype" iterable of :class:`~.Competition`
+        """
+        return (
+            each
+            for each in self.get_competitions()
+            if getattr(each, field) == value
+        )
+
+    def query(self, query):
+        """
+        Get the competitions matching a query.
+
+        Parsers check the parsed options before building competitions, this
+        fallback filters the competitions.
+
+        :param query: Query the competitions must match.
+        :type query: :class:`~.Query`
+        :returns: All the competitions found in document order.
+        :rtype" iterable of :class:`~.Competition`
+        """
+        return (
+            each
+            for each in self.get_competitions()
+            if query.match(each)
+        )
+
+    def query_count(self, query):
+        """
+        Count the options matching a query.
+
+        Parsers count the parsed options without building competitions,
+        this fallback counts the competitions returned by :meth:`query`.
+
+        :param query: Query the options must match.
+        :type query: :class:`~.Query`
+        :returns: Number of matching options.
+        :rtype: :class:`int`
+        """
+        count = 0
+        for _ in self.query(query):
+            count += 1
+        return count
+
+    def get_competitions_by_closes(self, start=None, end=None):
+        """
+        Get all the competitions closing within a time range.
+
+        :param start: Earliest closing time, inclusive. Open if omitted.
+        :type start: :class:`str`
+        :param end: Latest closing time, exclusive. Open if omitted.
+        :type end: :class:`str`
+        :returns: All the competitions found ordered by closing time.
+        :rtype" iterable of :class:`~.Competition`
+        """
+        return sorted(
+            (
+                each
+                for each in self.get_competitions()
+                if (start is None or (each.closes or "") >= start) and
+                (end is None or (each.closes or "") < end)
+            ),
+            key=lambda x: x.closes or "",
+        )
+
+
+class OptionIndex(object):
+    """
+    Hash indexes over the options of a parsed stats file.
+
+    Options are indexed by position, so they can be found again in the
+    sequence the index was built from.
+
+    :param records: Options being indexed. Any object with a ``get`` method
+        returning attribute values, such as a decoded JSON option or an XML
+        option element.
+    :type records: sequence
+    """
+    FIELDS = ("competition", "sport", "venue", "game")
+
+    def __init__(self, records):
+        self.fields = dict((field, {}) for field in self.FIELDS)
+        closes = []
+
+        for position, record in enumerate(records):
+            for field, index in self.fields.items():
+                index.setdefault(record.get(field), []).append(position)
+            closes.append((record.get("closes") or "", position))
+
+        closes.sort()
+        self.closes = [each[0] for each in closes]
+        self.closes_positions = [each[1] for each in closes]
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    def lookup(self, field, value):
+        """
+        Find the options with an attribute matching a value.
+
+        :param field: Indexed attribute.
+        :type field: :class:`str`
+        :param value: Value the attribute must be equal to.
+        :returns: Positions of the matching options in document order.
+        :rtype: :class:`list` of :class:`int`
+        """
+        return self.fields[field].get(value, [])
+
+    def closes_between(self, start=None, end=None):
+        """
+        Find the options closing within a time range.
+
+        :param start: Earliest closing time, inclusive. Open if omitted.
+        :type start: :class:`str`
+        :param end: Latest closing time, exclusive. Open if omitted.
+        :type end: :class:`str`
+        :returns: Positions of the matching options ordered by closing time.
+        :rtype: :class:`list` of :class:`int`
+        """
+        lo = 0 if start is None else bisect.bisect_left(self.closes, start)
+        hi = (
+            len(self.closes) if end is None
+            else bisect.bisect_left(self.closes, end)
+        )
+        return self.closes_positions[lo:hi]
+
+    def candidates(self, query):
+        """
+        Find the options which may match a query, from the most selective
+        indexed attribute or the closing time range.
+
+        :param query: Query being evaluated.
+        :type query: :class:`~.Query`
+        :returns: Positions of the options in document order, ``None`` when
+            the index can not narrow them down.
+        :rtype: :class:`list` of :class:`int`
+        """
+        best = None
+        for field, values in query.where.items():
+            if field in self.fields:
+                positions = set()
+                for value in values:
+                    positions.update(self.fields[field].get(value, []))
+                if best is None or len(positions) < len(best):
+                    best = positions
+        if query.closes_after is not None or query.closes_before is not None:
+            positions = self.closes_between(
+                query.closes_after,
+                query.closes_before,
+            )
+            if best is None or len(positions) < len(best):
+                best = positions
+        return None if best is None else sorted(best)
+
+
+class IndexedStatsParser(IStatsParser):
+    """
+    Base for the parsers which hold every option in memory after parsing.
+
+    Sub classes call :meth:`_build_index` from :meth:`parse` with all the
+    parsed options, lookups by an indexed attribute then only build the
+    matching competitions.
+    """
+    def __init__(self, errors=None, quarantine=None):
+        super(IndexedStatsParser, self).__init__(
+            errors=errors,
+            quarantine=quarantine,
+        )
+        self.records = None
+        self.index = None
+
+    def release(self):
+        super(IndexedStatsParser, self).release()
+        self.records = None
+        self.index = None
+
+    def _build_index(self, records):
+        """
+        Check and index the parsed options, replacing any previous index.
+
+        :param records: All the parsed options.
+        :type records: sequence
+        """
+        if self.errors is not None:
+            invalid = self._invalid_positions(records)
+            if invalid:
+                records = [
+                    each
+                    for position, each in enumerate(records)
+                    if position not in invalid
+                ]
+        self.records = records
+        self.index = OptionIndex(records)
+
+    @abc.abstractmethod
+    def make_competition(self, record):  # pragma: no cover
+        """
+        Build a competition from a parsed option.
+
+        :param record: Parsed option.
+        :returns: Competition with all its selections.
+        :rtype: :class:`~.Competition`
+        """
+        pass
+
+    @abc.abstractmethod
+    def record_odds(self, record):  # pragma: no cover
+        """
+        Iterate over the selection odds of a parsed option.
+
+        :param record: Parsed option.
+        :returns: Odds of the selections.
+        :rtype: iterable of :class:`int`
+        """
+        pass
+
+    def _candidates(self, query):
+        """
+        Return the parsed options the index can not rule out for a query.
+        """
+        positions = self.index.candidates(query)
+        if positions is None:
+            return self.records
+        return (self.records[position] for position in positions)
+
+    def query(self, query):
+        if self.index is None:
+            return super(IndexedStatsParser, self).query(query)
+        return _query_records(
+            self,
+            self._candidates(query),
+            query,
+            self.make_competition,
+        )
+
+    def query_count(self, query):
+        if self.index is None:
+            return super(IndexedStatsParser, self).query_count(query)
+        return _count_records(self, self._candidates(query), query)
+
+    def get_competitions_by_name(self, name):
+        return self.get_competitions_by("competition", name)
+
+    def get_competitions_by(self, field, value):
+        if self.index is None or field not in self.index:
+            return super(IndexedStatsParser, self).get_competitions_by(
+                field,
+                value,
+            )
+        return (
+            self.make_competition(self.records[position])
+            for position in self.index.lookup(field, value)
+        )
+
+    def get_competitions_by_closes(self, start=None, end=None):
+        if self.index is None:
+            return super(IndexedStatsParser, self).get_competitions_by_closes(
+                start,
+                end,
+            )
+        return (
+            self.make_competition(self.records[position])
+            for position in self.index.closes_between(start, end)
+        )
+
 
 class Selection(object):  # pylint: disable=too-few-public-methods
     """
@@ -91,6 +838,8 @@ class Selection(object):  # pylint: disable=too-few-public-methods
     :param status: Selection status. Eg: OK
     :type status: :class:`str`
     """
+    __slots__ = ("number", "name", "odds", "status")
+
     def __init__(self, number, name, odds, status):
         self.number = number
         self.name = name
@@ -129,7 +878,23 @@ class Competition(object):
     :type sport: :class:`str`
     :param game: Team versing each other.
     :type game: :class:`str`
+
+    Selections can also be given by a ``source`` which is only decoded the
+    first time they are needed, see :meth:`lazy`.
     """
+    __slots__ = (
+        "venue",
+        "competition",
+        "closes",
+        "name",
+        "number",
+        "sport",
+        "game",
+        "_selections",
+        "_sorted",
+        "_source",
+    )
+
     def __init__(self, venue, competition, closes, name, number, sport, game):
         self.venue = venue
         self.competition = competition
@@ -138,16 +903,85 @@ class Competition(object):
         self.number = number
         self.sport = sport
         self.game = game
-        self.selections = set()
+        self._selections = []
+        self._sorted = None
+        self._source = None
+
+    def lazy(self, source, decode):
+        """
+        Defer adding the selections until they are first needed.
+
+        Reports which never look at the selections, like the summary, then
+        never pay for decoding them.
+
+        :param source: Raw selections. Eg: a decoded JSON option.
+        :param decode: Callable taking ``source`` and returning its
+            selections.
+        :type decode: callable
+        :returns: The competition itself.
+        :rtype: :class:`~.Competition`
+        """
+        self._source = (source, decode)
+        return self
+
+    def _decoded(self):
+        """
+        Return the selections list, decoding any pending source first.
+        """
+        if self._source is not None:
+            source, decode = self._source
+            # decode everything first, a failure leaves the source pending
+            # rather than a partial selection list.
+            decoded = list(decode(source))
+            self._source = None
+            for selection in decoded:
+                self.add_selection(selection)
+        return self._selections
+
+    @property
+    def selections(self):
+        """
+        All the selections of the competition.
+
+        :rtype: :class:`frozenset` of :class:`~.Selection`
+        """
+        return frozenset(self._decoded())
 
     def add_selection(self, selection):
         """
         Add a new selection to the competition.
 
+        Selections are kept ordered by their number as they are added, adding
+        the same selection twice has no effect.
+
         :param selection: Selection being added to the competition.
         :type selections: :class:`~.Selection`
         """
-        self.selections.add(selection)
+        selections = self._decoded()
+        number = selection.number
+
+        # selections nearly always arrive in number order.
+        if not selections or selections[-1].number < number:
+            selections.append(selection)
+            self._sorted = None
+            return
+
+        lo, hi = 0, len(selections)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if number < selections[mid].number:
+                hi = mid
+            else:
+                lo = mid + 1
+
+        pos = lo
+        while pos > 0 and selections[pos - 1].number == number:
+            if selections[pos - 1] is selection:
+                return
+            pos -= 1
+
+        selections.insert(lo, selection)
+        self._sorted = None
 
     def get_selections(self, key=None):
         """
@@ -155,265 +989,3914 @@ class Competition(object):
 
         :param key: Callable that takes a single value and returns a
             boolean value. This callable is used for sorting. If key is
-            omitted then the default sorted algorithm is used.
+            omitted then the selections are ordered by number.
         :type key: callable which takes a single argument and returns
             a :class:`bool`
         :returns: Iterable of selections for the compatition.
         :rtype: iterable of :class:`Selection`
         """
+        selections = self._decoded()
         if key is None:
-            key = lambda x: x.number
-        return sorted(self.selections, key=key)
+            return list(selections)
+
+        # only the last custom ordering is cached, it is dropped as soon as
+        # a selection is added.
+        if self._sorted is None or self._sorted[0] is not key:
+            self._sorted = (key, sorted(selections, key=key))
+        return list(self._sorted[1])
+
+    def market_percentage(self):
+        """
+        Calculate the market percentage of the competition from the odds of
+        all its priced selections.
+
+        :returns: Market percentage.
+        :rtype: :class:`float`
+        """
+        return calc_market_percentage(
+            sel.odds
+            for sel in self._decoded()
+            if sel.odds > 0
+        )
 
 
-class JSONParser(IStatsParser):
+class JSONParser(IndexedStatsParser):
     """
     JSON stats file parser.
     """
     def parse(self, fh):
         self.data = json.load(fh, parse_float=True)
+        self._build_index(self.data.get("options", {}).get("option", []))
+
+    def parse_buffer(self, buffer):
+        # the decoder only works on text, decode straight from the buffer
+        # instead of reading a copy of it first.
+        text = str(buffer, json.detect_encoding(buffer[:4]))
+        if text.startswith("\ufeff"):
+            text = text[1:]
+        self.data = json.loads(text, parse_float=True)
+        self._build_index(self.data.get("options", {}).get("option", []))
 
     def option_count(self):
-        options = self.data.get("options", {})
-        return len(options.get("option", []))
+        return len(self.records)
 
     def get_competitions(self):
-        for each in self.data.get("options", {}).get("option", []):
-
-            comp = Competition(
-                venue=each.get("venue"),
-                competition=each.get("competition"),
-                closes=each.get("closes"),
-                name=each.get("name"),
-                number=int(each.get("number", 0)),
-                sport=each.get("sport"),
-                game=each.get("game"),
-            )
-
-            for sel in each.get("selections", {}).get("selection", []):
-                selection = Selection(
-                    number=int(sel.get("number", 0)),
-                    name=sel.get("name"),
-                    odds=int(sel.get("odds", 0)),
-                    status=sel.get("status"),
-                )
+        for each in self.records:
+            yield _make_json_competition(each, lazy=True)
 
-                comp.add_selection(selection)
+    def make_competition(self, record):
+        return _make_json_competition(record, lazy=True)
 
-            yield comp
+    def record_odds(self, record):
+        for sel in record.get("selections", {}).get("selection", []):
+            yield int(sel.get("odds", 0))
 
-    def get_competitions_by_name(self, name):
-        for each in self.get_competitions():
-            if each.competition != name:
-                continue
-            yield each
+    def check_record(self, record, position):
+        return _check_json_option(record, position)
+
+    def dump_record(self, record):
+        return json.dumps(record)
 
 
-class XMLParser(IStatsParser):
+class JSONStreamParser(JSONParser):
     """
-    XML stats file parser.
+    Incremental JSON stats file parser.
+
+    Unlike :class:`~.JSONParser` the document is never loaded as a whole.
+    The ``options.option`` array is decoded one element at a time straight
+    from the file handler, so only a single option is held in memory at
+    once.
+
+    .. note::
+
+        The file handler is kept open and re-read from the start every time
+        the competitions are walked, so it needs to be seekable and must
+        not be closed while the parser is in use.
     """
     def parse(self, fh):
-        self.data = etree.parse(fh).getroot()
+        self.data = fh
+        self.records = None
+        self.index = None
+        self.invalid = set()
+        if self.errors is not None:
+            self.invalid = self._invalid_positions(self.iter_options())
+
+    def parse_buffer(self, buffer):
+        # read the buffer through a file interface like any other file.
+        IStatsParser.parse_buffer(self, buffer)
+
+    def iter_options(self):
+        """
+        Iterate over the decoded ``options.option`` array elements.
+
+        :returns: Options in document order.
+        :rtype: iterable of :class:`dict`
+        """
+        self.data.seek(0)
+        return _JSONStream(self.data).iter_array(("options", "option"))
 
     def option_count(self):
-        return int(self.data.xpath("count(//options/option)"))
+        count = 0
+        for _ in _valid_options(self):
+            count += 1
+        return count
 
     def get_competitions(self):
-        for each in self.data.xpath("//options/option"):
-            kwargs = {}
-            for key, value in each.items():
-                kwargs[key] = value
-
-            comp = Competition(
-                venue=kwargs.get("venue"),
-                competition=kwargs.get("competition"),
-                closes=kwargs.get("closes"),
-                name=kwargs.get("name"),
-                number=int(kwargs.get("number", 0)),
-                sport=kwargs.get("sport"),
-                game=kwargs.get("game"),
-            )
-
-            for sel in each.xpath("selections/selection"):
-                sel_kwargs = {}
-                for key, value in sel.items():
-                    sel_kwargs[key] = value
-
-                selection = Selection(
-                    number=int(sel.get("number", 0)),
-                    name=sel.get("name"),
-                    odds=int(sel.get("odds", 0)),
-                    status=sel.get("status"),
-                )
-
-                comp.add_selection(selection)
+        for each in _valid_options(self):
+            yield _make_json_competition(each, lazy=True)
 
-            yield comp
+    def query(self, query):
+        return _query_records(
+            self,
+            _valid_options(self),
+            query,
+            self.make_competition,
+        )
 
-    def get_competitions_by_name(self, name):
-        for each in self.get_competitions():
-            if each.competition != name:
-                continue
-            yield each
+    def query_count(self, query):
+        return _count_records(self, _valid_options(self), query)
 
 
-class Reporter(object):
+class _JSONStream(object):
     """
-    Reporter generates a stats summary report.
+    Minimal pull tokenizer over a JSON file handler.
 
-    :param parser: Parser used for parser stats files.
-    :type parser: :class:`IStatsParser`
+    Only the object and array structure leading to the requested array is
+    tokenized by hand, every value is decoded with the standard
+    :class:`json.JSONDecoder` as soon as enough of it has been buffered.
+
+    :param fh: Text or binary file handler to read from.
+    :type fh: :class:`file`
     """
-    def __init__(self, parser):
-        self.parser = parser
+    WHITESPACE = " \t\n\r"
 
-    def load(self, fh):
-        """
+    def __init__(self, fh):
+        self.fh = fh
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        self.bytes_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+
+    def _fill(self, size=None):
+        chunk = self.fh.read(size or CHUNK_SIZE)
+        if isinstance(chunk, bytes):
+            chunk = self.bytes_decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def _error(self, msg):
+        return json.JSONDecodeError(msg, self.buffer, self.pos)
+
+    def peek(self):
+        """
+        Skip any whitespace and return the next character without consuming
+        it. An empty string is returned at the end of the file.
+        """
+        while True:
+            while (
+                self.pos < len(self.buffer) and
+                self.buffer[self.pos] in self.WHITESPACE
+            ):
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, char):
+        """
+        Consume the next non whitespace character which must be ``char``.
+        """
+        if self.peek() != char:
+            raise self._error("Expecting {!r}".format(char))
+        self.pos += 1
+
+    def read_value(self):
+        """
+        Decode and consume the next JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # a number at the very end of the buffer may still be
+                # missing some of its digits.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            # grow geometrically so large values are not rescanned over and
+            # over again.
+            self._fill(max(CHUNK_SIZE, len(self.buffer) - self.pos))
+
+    def iter_array(self, path):
+        """
+        Iterate over the elements of the array found by following the
+        object keys in ``path`` from the document root.
+
+        :param path: Object keys leading to the array.
+        :type path: :class:`tuple` of :class:`str`
+        :returns: Decoded array elements.
+        :rtype: iterable
+        """
+        for key in path:
+            self.expect("{")
+            while True:
+                if self.peek() == "}":
+                    return
+                found = self.read_value()
+                self.expect(":")
+                if found == key:
+                    break
+                self.read_value()
+                if self.peek() == ",":
+                    self.pos += 1
+
+        self.expect("[")
+        if self.peek() == "]":
+            return
+        while True:
+            yield self.read_value()
+            char = self.peek()
+            if char == "]":
+                return
+            self.expect(",")
+
+
+def _matching_records(parser, records, query):
+    """
+    Iterate over the parsed options matching a query.
+    """
+    for each in records:
+        if query.match_option(each.get) and query.match_odds(
+            parser.record_odds(each)
+        ):
+            yield each
+
+
+def _query_records(parser, records, query, make_competition):
+    """
+    Build the competitions of the parsed options matching a query.
+    """
+    for each in _matching_records(parser, records, query):
+        yield make_competition(each)
+
+
+def _count_records(parser, records, query):
+    """
+    Count the parsed options matching a query.
+    """
+    count = 0
+    for _ in _matching_records(parser, records, query):
+        count += 1
+    return count
+
+
+def _valid_options(parser):
+    """
+    Iterate over the options of a streaming parser, leaving out the ones
+    skipped when it parsed the file.
+    """
+    if not parser.invalid:
+        return parser.iter_options()
+    return (
+        each
+        for position, each in enumerate(parser.iter_options())
+        if position not in parser.invalid
+    )
+
+
+def _check_json_option(record, position):
+    """
+    Check a decoded JSON option and its selections against the schemas.
+    """
+    if not isinstance(record, dict):
+        return RecordError(position, "option", record, "object")
+    error = _check_fields(OPTION_SCHEMA, record.get, position)
+    if error is not None:
+        return error
+
+    selections = record.get("selections", {})
+    if not isinstance(selections, dict):
+        return RecordError(position, "selections", selections, "object")
+    selections = selections.get("selection", [])
+    if not isinstance(selections, list):
+        return RecordError(position, "selection", selections, "array")
+    for sel in selections:
+        if not isinstance(sel, dict):
+            return RecordError(position, "selection", sel, "object")
+        error = _check_fields(SELECTION_SCHEMA, sel.get, position, "selection.")
+        if error is not None:
+            return error
+    return None
+
+
+def _make_json_competition(record, lazy=False):
+    """
+    Build a competition from a decoded JSON option.
+
+    :param record: Decoded option.
+    :type record: :class:`dict`
+    :param lazy: Only decode the selections when they are first needed.
+    :type lazy: :class:`bool`
+    :returns: Competition with all its selections.
+    :rtype: :class:`~.Competition`
+    """
+    comp = Competition(
+        venue=record.get("venue"),
+        competition=record.get("competition"),
+        closes=record.get("closes"),
+        name=record.get("name"),
+        number=int(record.get("number", 0)),
+        sport=record.get("sport"),
+        game=record.get("game"),
+    )
+
+    if lazy:
+        return comp.lazy(record, _decode_json_selections)
+    for selection in _decode_json_selections(record):
+        comp.add_selection(selection)
+    return comp
+
+
+def _decode_json_selections(record):
+    """
+    Decode the selections of a decoded JSON option.
+    """
+    for sel in record.get("selections", {}).get("selection", []):
+        yield Selection(
+            number=int(sel.get("number", 0)),
+            name=sel.get("name"),
+            odds=int(sel.get("odds", 0)),
+            status=sel.get("status"),
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def _options_path():
+    """
+    Compile the XPath finding the ``<option>`` elements of a document.
+    """
+    return etree.XPath("//options/option")
+
+
+def _xml_options(root):
+    """
+    Return the ``<option>`` elements of a parsed XML document.
+    """
+    if root.tag == "options":
+        # the options of a feed sit right under the root, walking the
+        # children is several times faster than searching the whole tree.
+        return list(root.iterchildren("option"))
+    return _options_path()(root)
+
+
+class XMLParser(IndexedStatsParser):
+    """
+    XML stats file parser.
+
+    The ``<option>`` elements are listed once when parsing, counting and
+    walking them afterwards does not search the document again.
+    """
+    def parse(self, fh):
+        self.data = etree.parse(fh).getroot()
+        self._build_index(_xml_options(self.data))
+
+    def parse_buffer(self, buffer):
+        self.data = etree.fromstring(buffer)
+        self._build_index(_xml_options(self.data))
+
+    def option_count(self):
+        return len(self.records)
+
+    def get_competitions(self):
+        for each in self.records:
+            yield _make_xml_competition(each, lazy=True)
+
+    def make_competition(self, record):
+        return _make_xml_competition(record, lazy=True)
+
+    def record_odds(self, record):
+        for sel in record.iter("selection"):
+            yield int(sel.get("odds", 0))
+
+    def check_record(self, record, position):
+        return _check_xml_option(record, position)
+
+    def dump_record(self, record):
+        return etree.tostring(record, encoding="unicode", with_tail=False)
+
+
+class XMLStreamParser(XMLParser):
+    """
+    Incremental XML stats file parser.
+
+    Unlike :class:`~.XMLParser` the document is never loaded as a whole.
+    Each ``<option>`` element is turned into a :class:`~.Competition` as
+    soon as it is closed and then cleared, so memory usage stays flat no
+    matter how big the file is.
+
+    .. note::
+
+        The file handler is kept open and re-read from the start every time
+        the competitions are walked, so it needs to be seekable and must
+        not be closed while the parser is in use.
+    """
+    def parse(self, fh):
+        self.data = fh
+        self.records = None
+        self.index = None
+        self.invalid = set()
+        if self.errors is not None:
+            self.invalid = self._invalid_positions(self.iter_options())
+
+    def parse_buffer(self, buffer):
+        # read the buffer through a file interface like any other file.
+        IStatsParser.parse_buffer(self, buffer)
+
+    def iter_options(self):
+        """
+        Iterate over the ``<option>`` elements of the document.
+
+        Every element is cleared, together with any previously processed
+        siblings, once the consumer moves on to the next one.
+
+        :returns: Option elements in document order.
+        :rtype: iterable of :class:`lxml.etree._Element`
+        """
+        self.data.seek(0)
+        parser = etree.XMLPullParser(events=("end",), tag="option")
+
+        while True:
+            chunk = self.data.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            for element in _read_option_events(parser):
+                yield element
+
+        parser.close()
+        for element in _read_option_events(parser):
+            yield element
+
+    def option_count(self):
+        count = 0
+        for _ in _valid_options(self):
+            count += 1
+        return count
+
+    def get_competitions(self):
+        # the elements are cleared as soon as the next one is read, so the
+        # selections can not be decoded lazily.
+        for each in _valid_options(self):
+            yield _make_xml_competition(each)
+
+    def query(self, query):
+        return _query_records(
+            self,
+            _valid_options(self),
+            query,
+            _make_xml_competition,
+        )
+
+    def query_count(self, query):
+        return _count_records(self, _valid_options(self), query)
+
+
+def _read_option_events(parser):
+    """
+    Drain the pending events from a pull parser, clearing each element after
+    it has been consumed.
+    """
+    for _, element in parser.read_events():
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+        yield element
+        element.clear()
+
+
+def _check_xml_option(element, position):
+    """
+    Check an ``<option>`` element and its selections against the schemas.
+    """
+    error = _check_fields(OPTION_SCHEMA, element.get, position)
+    if error is not None:
+        return error
+    for sel in element.iter("selection"):
+        error = _check_fields(SELECTION_SCHEMA, sel.get, position, "selection.")
+        if error is not None:
+            return error
+    return None
+
+
+def _make_xml_competition(element, lazy=False):
+    """
+    Build a competition from an ``<option>`` element.
+
+    :param element: Option element.
+    :type element: :class:`lxml.etree._Element`
+    :param lazy: Only decode the selections when they are first needed, the
+        element must not be cleared until then.
+    :type lazy: :class:`bool`
+    :returns: Competition with all its selections.
+    :rtype: :class:`~.Competition`
+    """
+    # attribute lookups on lxml elements are costly, bind the method once.
+    get = element.get
+    comp = Competition(
+        venue=get("venue"),
+        competition=get("competition"),
+        closes=get("closes"),
+        name=get("name"),
+        number=int(get("number", 0)),
+        sport=get("sport"),
+        game=get("game"),
+    )
+
+    if lazy:
+        return comp.lazy(element, _decode_xml_selections)
+    for selection in _decode_xml_selections(element):
+        comp.add_selection(selection)
+    return comp
+
+
+def _decode_xml_selections(element):
+    """
+    Decode the selections of an ``<option>`` element.
+    """
+    for sel in element.iter("selection"):
+        get = sel.get
+        yield Selection(
+            number=int(get("number", 0)),
+            name=get("name"),
+            odds=int(get("odds", 0)),
+            status=get("status"),
+        )
+
+
+class CompetitionStore(IStatsParser):
+    """
+    Columnar store of competitions and their selections.
+
+    Instead of a :class:`~.Competition` object per option and a
+    :class:`~.Selection` object per selection, every attribute is kept in a
+    flat column. Numbers and odds are stored in typed arrays, string
+    attributes are interned and stored as codes into a per column table and
+    the selections of option ``i`` are found between ``offsets[i]`` and
+    ``offsets[i + 1]``, ordered by selection number.
+
+    The market percentages of all the competitions are calculated with a
+    single vectorised reduction when :mod:`numpy` is available.
+
+    :param parser: Parser used for parsing the stats files loaded into the
+        store. The parsed document is released once the store is filled.
+    :type parser: :class:`IStatsParser`
+    """
+    OPTION_FIELDS = ("venue", "competition", "closes", "name", "sport", "game")
+    SELECTION_FIELDS = ("name", "status")
+
+    def __init__(self, parser=None):
+        self.parser = parser
+        self.data = None
+        self.buffer = None
+        self.clear()
+
+    def clear(self):
+        """
+        Remove all the competitions from the store.
+        """
+        self.tables = {}
+        self.codes = {}
+        self.options = {}
+        self.selections = {}
+        for field in self.OPTION_FIELDS:
+            self.tables["option." + field] = []
+            self.options[field] = array.array("q")
+        for field in self.SELECTION_FIELDS:
+            self.tables["selection." + field] = []
+            self.selections[field] = array.array("q")
+        self.options["number"] = array.array("q")
+        self.selections["number"] = array.array("q")
+        self.selections["odds"] = array.array("q")
+        self.offsets = array.array("q", [0])
+        self.extra = {}
+
+    def parse(self, fh):
+        self.parser.parse(fh)
+        self._fill()
+
+    def parse_buffer(self, buffer):
+        self.parser.parse_buffer(buffer)
+        self._fill()
+
+    def _fill(self):
+        self.clear()
+        self.extend(self.parser.get_competitions())
+        # release the parsed document, only the columns are kept.
+        self.parser.release()
+        self.data = self.options
+
+    def _columns(self):
+        """
+        Return every column of the store keyed by a unique name.
+        """
+        columns = {"offsets": self.offsets}
+        for field, column in self.options.items():
+            columns["option." + field] = column
+        for field, column in self.selections.items():
+            columns["selection." + field] = column
+        return columns
+
+    def dump(self, fh, extra=None):
+        """
+        Write the store to a binary file.
+
+        The file starts with a header followed by one section per column and
+        string table. Array sections are 8 byte aligned so they can be used
+        in place from a memory mapped file by :meth:`from_buffer`.
+
+        :param fh: Binary write file handler to write to.
+        :type fh: :class:`file`
+        :param extra: Additional float columns, one value per option, found
+            in :attr:`extra` once loaded.
+        :type extra: :class:`dict` of sequence of :class:`float`
+        """
+        sections = []
+        for name, column in sorted(self._columns().items()):
+            sections.append((name, b"q", column.tobytes()))
+        for name, column in sorted((extra or {}).items()):
+            if len(column) != self.option_count():
+                raise ValueError(
+                    "Column {!r} does not have a value per option".format(name)
+                )
+            sections.append(
+                ("extra." + name, b"d", array.array("d", column).tobytes())
+            )
+        for name, table in sorted(self.tables.items()):
+            sections.append(
+                ("table." + name, b"s", json.dumps(table).encode("utf-8"))
+            )
+
+        fh.write(
+            STORE_HEADER.pack(
+                STORE_MAGIC,
+                STORE_VERSION,
+                sys.byteorder == "little",
+                len(sections),
+            )
+        )
+        offset = STORE_HEADER.size
+        for name, kind, payload in sections:
+            name = name.encode("utf-8")
+            head = STORE_SECTION.pack(kind, len(name), len(payload))
+            padding = -(offset + len(head) + len(name)) % 8
+            fh.write(head + name + b"\0" * padding + payload)
+            offset += len(head) + len(name) + padding + len(payload)
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        """
+        Load a store written by :meth:`dump`.
+
+        Columns are read-only views into ``buffer``, so a memory mapped file
+        is used in place without copying the arrays.
+
+        :param buffer: Content of a file written by :meth:`dump`.
+        :type buffer: bytes-like object
+        :returns: Read-only store.
+        :rtype: :class:`~.CompetitionStore`
+        :raises ValueError: If the buffer is not a valid store.
+        """
+        view = memoryview(buffer)
+        try:
+            magic, version, little, count = STORE_HEADER.unpack_from(view)
+        except struct.error:
+            raise ValueError("Truncated store header")
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError("Unsupported store format")
+        if little != (sys.byteorder == "little"):
+            raise ValueError("Store written with a different byte order")
+
+        sections = {}
+        offset = STORE_HEADER.size
+        for _ in range(count):
+            try:
+                kind, size, length = STORE_SECTION.unpack_from(view, offset)
+            except struct.error:
+                raise ValueError("Truncated store section")
+            offset += STORE_SECTION.size
+            name = bytes(view[offset:offset + size]).decode("utf-8")
+            offset += size
+            offset += -offset % 8
+            if offset + length > len(view):
+                raise ValueError("Truncated store section {!r}".format(name))
+            payload = view[offset:offset + length]
+            offset += length
+            if kind in (b"q", b"d"):
+                if length % 8:
+                    raise ValueError(
+                        "Misaligned store section {!r}".format(name)
+                    )
+                sections[name] = payload.cast(kind.decode("ascii"))
+            else:
+                sections[name] = json.loads(bytes(payload).decode("utf-8"))
+
+        store = cls()
+        store.buffer = buffer
+        try:
+            store.offsets = sections.pop("offsets")
+            for field in list(store.options):
+                store.options[field] = sections.pop("option." + field)
+            for field in list(store.selections):
+                store.selections[field] = sections.pop("selection." + field)
+            for table in list(store.tables):
+                store.tables[table] = sections.pop("table." + table)
+        except KeyError as err:
+            raise ValueError("Missing store section {}".format(err))
+        for name in list(sections):
+            if name.startswith("extra."):
+                store.extra[name[len("extra."):]] = sections.pop(name)
+
+        for table, values in store.tables.items():
+            store.codes[table] = dict(
+                (value, code) for code, value in enumerate(values)
+            )
+
+        if not len(store.offsets):
+            raise ValueError("Empty store offsets")
+        lengths = set(len(column) for column in store.options.values())
+        lengths.update(len(column) for column in store.extra.values())
+        lengths.add(len(store.offsets) - 1)
+        if len(lengths) != 1 or store.offsets[-1] != len(
+            store.selections["odds"]
+        ):
+            raise ValueError("Inconsistent store columns")
+
+        # every coded column must point into its string table.
+        for prefix, columns, fields in [
+            ("option.", store.options, cls.OPTION_FIELDS),
+            ("selection.", store.selections, cls.SELECTION_FIELDS),
+        ]:
+            for field in fields:
+                column = columns[field]
+                if len(column) and (
+                    min(column) < 0 or
+                    max(column) >= len(store.tables[prefix + field])
+                ):
+                    raise ValueError(
+                        "Store column {!r} out of its table".format(
+                            prefix + field
+                        )
+                    )
+
+        store.data = store.options
+        return store
+
+    def _intern(self, table, value):
+        codes = self.codes.setdefault(table, {})
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.tables[table])
+            self.tables[table].append(value)
+        return code
+
+    def extend(self, competitions):
+        """
+        Append competitions to the store.
+
+        :param competitions: Competitions being added.
+        :type competitions: iterable of :class:`~.Competition`
+        """
+        for comp in competitions:
+            for field in self.OPTION_FIELDS:
+                self.options[field].append(
+                    self._intern("option." + field, getattr(comp, field))
+                )
+            self.options["number"].append(comp.number)
+
+            for sel in comp.get_selections():
+                for field in self.SELECTION_FIELDS:
+                    self.selections[field].append(
+                        self._intern("selection." + field, getattr(sel, field))
+                    )
+                self.selections["number"].append(sel.number)
+                self.selections["odds"].append(sel.odds)
+
+            self.offsets.append(len(self.selections["odds"]))
+
+    def option_count(self):
+        return len(self.offsets) - 1
+
+    def get_option(self, field, index):
+        """
+        Return an option attribute.
+
+        :param field: Name of the attribute.
+        :type field: :class:`str`
+        :param index: Position of the option in the store.
+        :type index: :class:`int`
+        :returns: Attribute value.
+        """
+        if field == "number":
+            return self.options["number"][index]
+        return self.tables["option." + field][self.options[field][index]]
+
+    def get_competition(self, index):
+        """
+        Rebuild the competition stored at the given position.
+
+        :param index: Position of the option in the store.
+        :type index: :class:`int`
+        :returns: Competition with all its selections.
+        :rtype: :class:`~.Competition`
+        """
+        comp = Competition(
+            number=self.options["number"][index],
+            **dict(
+                (field, self.get_option(field, index))
+                for field in self.OPTION_FIELDS
+            )
+        )
+        return comp.lazy(index, self._decode_selections)
+
+    def _decode_selections(self, index):
+        """
+        Decode the selections of the option stored at the given position.
+        """
+        names = self.tables["selection.name"]
+        statuses = self.tables["selection.status"]
+        for pos in range(self.offsets[index], self.offsets[index + 1]):
+            yield Selection(
+                number=self.selections["number"][pos],
+                name=names[self.selections["name"][pos]],
+                odds=self.selections["odds"][pos],
+                status=statuses[self.selections["status"][pos]],
+            )
+
+    def get_competitions(self):
+        for index in range(self.option_count()):
+            yield self.get_competition(index)
+
+    def get_competitions_by_name(self, name):
+        code = self.codes.get("option.competition", {}).get(name)
+        if code is None:
+            return
+        for index, each in enumerate(self.options["competition"]):
+            if each == code:
+                yield self.get_competition(index)
+
+    def query(self, query):
+        for index in self._query_positions(query):
+            yield self.get_competition(index)
+
+    def query_count(self, query):
+        count = 0
+        for _ in self._query_positions(query):
+            count += 1
+        return count
+
+    def _query_positions(self, query):
+        """
+        Iterate over the positions of the competitions matching a query.
+        """
+        odds = self.selections["odds"]
+        offsets = self.offsets
+        for index in range(self.option_count()):
+            if query.match_option(
+                functools.partial(self._get_option, index)
+            ) and query.match_odds(odds[offsets[index]:offsets[index + 1]]):
+                yield index
+
+    def _get_option(self, index, field):
+        return self.get_option(field, index)
+
+    def market_percentages(self, exact=True):
+        """
+        Calculate the market percentage of every competition in the store.
+
+        The odds column is passed as is to :func:`calc_market_percentages`.
+
+        :param exact: Add the odds in the same order as
+            :func:`calc_market_percentage`.
+        :type exact: :class:`bool`
+        :returns: Market percentages in option order.
+        :rtype: sequence of :class:`float`
+        """
+        return calc_market_percentages(
+            self.selections["odds"],
+            self.offsets,
+            exact=exact,
+        )
+
+    def iter_market_percentages(self):
+        """
+        Iterate over the competitions together with their market percentage.
+
+        :returns: Competitions and their market percentage.
+        :rtype: iterable of (:class:`~.Competition`, :class:`float`)
+        """
+        for index, market_price in enumerate(self.market_percentages()):
+            yield self.get_competition(index), float(market_price)
+
+
+class FeedCache(object):
+    """
+    On-disk cache of parsed stats files.
+
+    Parsed competitions are stored as :class:`~.CompetitionStore` files
+    keyed by the hash of the source file content, the parser used and the
+    :data:`PARSER_VERSION`. Cached files are memory mapped when loaded and
+    the least recently used ones are evicted once the cache grows over its
+    size limit. Unreadable or corrupt entries are removed and treated as a
+    cache miss.
+
+    :param directory: Directory holding the cached files.
+    :type directory: :class:`str`
+    :param max_size: Maximum total size of the cached files in bytes.
+    :type max_size: :class:`int`
+    """
+    SUFFIX = ".stc"
+
+    def __init__(self, directory, max_size=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(fh, parser):
+        """
+        Build the cache key of a file.
+
+        The file content is read in chunks and rewound afterwards.
+
+        :param fh: File being parsed, or its content.
+        :type fh: :class:`file` or bytes-like object
+        :param parser: Parser used for parsing the file.
+        :type parser: :class:`IStatsParser`
+        :returns: Cache key.
+        :rtype: :class:`str`
+        """
+        digest = hashlib.sha256()
+        digest.update(
+            "{}:{}:{}\0".format(
+                type(parser).__name__,
+                PARSER_VERSION,
+                STORE_VERSION,
+            ).encode("utf-8")
+        )
+        # wrapped parsers, like a query under a columnar store, change the
+        # parsed competitions too.
+        for each in _parser_chain(parser):
+            digest.update(
+                "{}:{!r}\0".format(
+                    getattr(each, "errors", None),
+                    getattr(each, "criteria", None),
+                ).encode("utf-8")
+            )
+
+        if not hasattr(fh, "seek"):
+            digest.update(fh)
+            return digest.hexdigest()
+
+        # hash the raw bytes of text files so the key does not depend on
+        # how the file was opened.
+        fh.seek(0)
+        raw = getattr(fh, "buffer", fh)
+        while True:
+            chunk = raw.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode("utf-8")
+            digest.update(chunk)
+        fh.seek(0)
+
+        return digest.hexdigest()
+
+    def path(self, key):
+        """
+        Return the path of the cached file for a key.
+        """
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key):
+        """
+        Load cached competitions.
+
+        :param key: Cache key.
+        :type key: :class:`str`
+        :returns: Cached competitions or ``None`` on a cache miss.
+        :rtype: :class:`~.CompetitionStore`
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as fh:
+                buffer = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            store = CompetitionStore.from_buffer(buffer)
+        except FileNotFoundError:
+            return None
+        except Exception:  # pylint: disable=broad-except
+            # whatever failed to decode, the entry is rebuilt from the feed.
+            self._remove(path)
+            return None
+
+        # mark the entry as recently used.
+        try:
+            os.utime(path, None)
+        except OSError:  # pragma: no cover
+            pass
+        return store
+
+    def put(self, key, store):
+        """
+        Add competitions to the cache, evicting old entries when needed.
+
+        :param key: Cache key.
+        :type key: :class:`str`
+        :param store: Competitions being cached.
+        :type store: :class:`~.CompetitionStore`
+        """
+        path = self.path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                store.dump(fh)
+            os.replace(tmp, path)
+        except BaseException:
+            self._remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits within
+        its size limit.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:  # pragma: no cover
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(each[1] for each in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class ColumnarWriter(object):
+    """
+    Writer of the competitions, their selections and market percentages to
+    a typed columnar export file.
+
+    Competitions are appended in batches and buffered in a
+    :class:`~.CompetitionStore`. Every ``chunk_rows`` competitions the
+    buffer is written out as a chunk in the :meth:`CompetitionStore.dump`
+    format, with the market percentages as an extra float column, so at
+    most one chunk is held in memory. Closing the writer adds an index of
+    the chunks at the end of the file, which is read by
+    :class:`~.ColumnarReader`. When used as a context manager the index is
+    left out if the block raises, so a partial file is never read back as a
+    complete export.
+
+    :param fh: Binary write file handler to write to.
+    :type fh: :class:`file`
+    :param chunk_rows: Number of competitions per chunk.
+    :type chunk_rows: :class:`int`
+    """
+    def __init__(self, fh, chunk_rows=65536):
+        self.fh = fh
+        self.chunk_rows = chunk_rows
+        self.chunks = []
+        self.store = CompetitionStore()
+        self.market_percentages = array.array("d")
+        self.offset = EXPORT_HEADER.size
+        self.closed = False
+        fh.write(EXPORT_HEADER.pack(EXPORT_MAGIC, EXPORT_VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+        else:
+            self.closed = True
+
+    def append(self, competitions):
+        """
+        Append a batch of competitions.
+
+        :param competitions: Competitions being added together with their
+            market percentage, which is calculated when ``None``.
+        :type competitions: iterable of (:class:`~.Competition`,
+            :class:`float`)
+        """
+        for competition, market_price in competitions:
+            if market_price is None:
+                market_price = competition.market_percentage()
+            self.store.extend([competition])
+            self.market_percentages.append(market_price)
+            if len(self.market_percentages) >= self.chunk_rows:
+                self.flush()
+
+    def flush(self):
+        """
+        Write the buffered competitions out as a chunk.
+        """
+        rows = len(self.market_percentages)
+        if not rows:
+            return
+
+        buffer = io.BytesIO()
+        self.store.dump(
+            buffer,
+            extra={"market_percentage": self.market_percentages},
+        )
+        payload = buffer.getvalue()
+        # keep every chunk 8 byte aligned so its columns can be used in
+        # place from a memory mapped file.
+        payload += b"\0" * (-len(payload) % 8)
+        self.fh.write(payload)
+
+        self.chunks.append((self.offset, len(payload), rows))
+        self.offset += len(payload)
+        self.store = CompetitionStore()
+        self.market_percentages = array.array("d")
+
+    def close(self):
+        """
+        Write the last chunk and the index of the chunks.
+        """
+        if self.closed:
+            return
+        self.flush()
+        for chunk in self.chunks:
+            self.fh.write(EXPORT_CHUNK.pack(*chunk))
+        self.fh.write(EXPORT_FOOTER.pack(len(self.chunks), EXPORT_MAGIC))
+        self.closed = True
+
+
+class ColumnarReader(IStatsParser):
+    """
+    Parser of the export files written by :class:`~.ColumnarWriter`.
+
+    The file is memory mapped when possible and its chunks are loaded one
+    at a time with :meth:`CompetitionStore.from_buffer`, so nothing is
+    parsed again and the stored market percentages are used as they are.
+    """
+    def __init__(self):
+        super(ColumnarReader, self).__init__()
+        self.chunks = []
+
+    def parse(self, fh):
+        try:
+            buffer = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            buffer = fh.read()
+        self.parse_buffer(buffer)
+
+    def parse_buffer(self, buffer):
+        """
+        Load the index of an export file.
+
+        :param buffer: Content of the file.
+        :type buffer: bytes-like object
+        :raises ValueError: If the buffer is not a valid export file.
+        """
+        view = memoryview(buffer)
+        try:
+            magic, version = EXPORT_HEADER.unpack_from(view)
+            count, end_magic = EXPORT_FOOTER.unpack_from(
+                view,
+                len(view) - EXPORT_FOOTER.size,
+            )
+        except struct.error:
+            raise ValueError("Truncated export file")
+        if (
+            magic != EXPORT_MAGIC or end_magic != EXPORT_MAGIC or
+            version != EXPORT_VERSION
+        ):
+            raise ValueError("Unsupported export format")
+
+        start = len(view) - EXPORT_FOOTER.size - count * EXPORT_CHUNK.size
+        if start < EXPORT_HEADER.size:
+            raise ValueError("Truncated export index")
+        chunks = [
+            EXPORT_CHUNK.unpack_from(view, start + i * EXPORT_CHUNK.size)
+            for i in range(count)
+        ]
+        for offset, length, _ in chunks:
+            if offset + length > start:
+                raise ValueError("Truncated export chunk")
+
+        self.data = buffer
+        self.chunks = chunks
+
+    def iter_chunks(self):
+        """
+        Iterate over the chunks of the file.
+
+        :returns: Chunks in file order.
+        :rtype: iterable of :class:`~.CompetitionStore`
+        """
+        view = memoryview(self.data)
+        for offset, length, _ in self.chunks:
+            yield CompetitionStore.from_buffer(view[offset:offset + length])
+
+    def option_count(self):
+        return sum(each[2] for each in self.chunks)
+
+    def get_competitions(self):
+        for chunk in self.iter_chunks():
+            for each in chunk.get_competitions():
+                yield each
+
+    def get_competitions_by_name(self, name):
+        for chunk in self.iter_chunks():
+            for each in chunk.get_competitions_by_name(name):
+                yield each
+
+    def query(self, query):
+        for chunk in self.iter_chunks():
+            for each in chunk.query(query):
+                yield each
+
+    def query_count(self, query):
+        return sum(chunk.query_count(query) for chunk in self.iter_chunks())
+
+    def iter_market_percentages(self):
+        """
+        Iterate over the competitions together with their stored market
+        percentage.
+
+        :returns: Competitions and their market percentage.
+        :rtype: iterable of (:class:`~.Competition`, :class:`float`)
+        """
+        for chunk in self.iter_chunks():
+            market_percentages = chunk.extra["market_percentage"]
+            for index in range(chunk.option_count()):
+                yield chunk.get_competition(index), market_percentages[index]
+
+
+class QueryParser(IStatsParser):
+    """
+    Parser only exposing the options of another parser matching a query.
+
+    The query is evaluated by the wrapped parser, see
+    :meth:`IStatsParser.query`.
+
+    :param parser: Parser used for parsing the stats files.
+    :type parser: :class:`IStatsParser`
+    :param query: Query the options must match.
+    :type query: :class:`~.Query`
+    """
+    def __init__(self, parser, query):
+        super(QueryParser, self).__init__(
+            errors=getattr(parser, "errors", None),
+        )
+        self.parser = parser
+        self.criteria = query
+
+    def parse(self, fh):
+        self.parser.parse(fh)
+        self.data = self.parser.data
+
+    def parse_buffer(self, buffer):
+        self.parser.parse_buffer(buffer)
+        self.data = self.parser.data
+
+    def release(self):
+        super(QueryParser, self).release()
+        self.parser.release()
+
+    def option_count(self):
+        return self.parser.query_count(self.criteria)
+
+    def get_competitions(self):
+        return self.parser.query(self.criteria)
+
+    def get_competitions_by_name(self, name):
+        return self.parser.query(self.criteria.restrict("competition", name))
+
+    def query(self, query):
+        return (
+            each
+            for each in self.get_competitions()
+            if query.match(each)
+        )
+
+
+_NO_STAGE = contextlib.nullcontext()
+
+
+class Profiler(object):
+    """
+    Profiler collects stage timings and counters of :class:`~.Reporter`
+    runs.
+
+    Stages can be nested, each one records the number of times it was
+    entered, its total time and its own time excluding the stages nested
+    in it. Iterators wrapped with :meth:`iterate` are timed while they
+    produce items, so lazily generated work is attributed to the stage
+    that produces it rather than to the one consuming it.
+
+    :param memory: Also trace the peak Python allocations. Tracing slows
+        everything down noticeably.
+    :type memory: :class:`bool`
+    """
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stages = {}
+        self.counters = {}
+        self.stack = []
+        self.started = time.perf_counter()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start(self, name):
+        """
+        Enter a stage.
+
+        :param name: Stage name.
+        :type name: :class:`str`
+        """
+        self.stack.append([name, time.perf_counter(), 0.0])
+
+    def stop(self):
+        """
+        Leave the current stage.
+        """
+        name, start, nested = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        stage = self.stages.setdefault(name, [0, 0.0, 0.0])
+        stage[0] += 1
+        stage[1] += elapsed
+        stage[2] += elapsed - nested
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time the enclosed block as a stage.
+
+        :param name: Stage name.
+        :type name: :class:`str`
+        """
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def iterate(self, name, iterable, counter=None):
+        """
+        Time the production of every item of an iterable as a stage.
+
+        :param name: Stage name.
+        :type name: :class:`str`
+        :param iterable: Items being timed.
+        :type iterable: iterable
+        :param counter: Counter incremented for every item.
+        :type counter: :class:`str`
+        :returns: The items.
+        :rtype: iterable
+        """
+        iterator = iter(iterable)
+        while True:
+            self.start(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+            if counter is not None:
+                self.count(counter)
+            yield item
+
+    def count(self, name, value=1):
+        """
+        Increment a counter.
+
+        :param name: Counter name.
+        :type name: :class:`str`
+        :param value: Increment.
+        :type value: :class:`int`
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        """
+        Return everything collected so far.
+
+        :returns: Wall time, stages, counters and peak memory usage.
+        :rtype: :class:`dict`
+        """
+        report = {
+            "wall_s": time.perf_counter() - self.started,
+            "stages": dict(
+                (name, {"calls": calls, "total_s": total, "self_s": own})
+                for name, (calls, total, own) in self.stages.items()
+            ),
+            "counters": dict(self.counters),
+        }
+        if resource is not None:
+            report["peak_rss_kb"] = resource.getrusage(
+                resource.RUSAGE_SELF
+            ).ru_maxrss
+        if self.memory and tracemalloc.is_tracing():
+            report["alloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        return report
+
+    def dump(self, fh):
+        """
+        Write the report as JSON.
+
+        :param fh: Text write file handler to write to.
+        :type fh: :class:`file`
+        """
+        json.dump(self.report(), fh, indent=2, sort_keys=True)
+        fh.write("\n")
+
+    def format(self):
+        """
+        Format the report as a table ordered by own time.
+
+        :returns: A profile report.
+        :rtype: :class:`str`
+        """
+        report = self.report()
+        lines = ["{:<24} {:>10} {:>10} {:>10}".format(
+            "Stage", "Calls", "Total (s)", "Self (s)"
+        )]
+        for name, stage in sorted(
+            report["stages"].items(),
+            key=lambda x: -x[1]["self_s"],
+        ):
+            lines.append(
+                "{:<24} {:>10} {:>10.4f} {:>10.4f}".format(
+                    name,
+                    stage["calls"],
+                    stage["total_s"],
+                    stage["self_s"],
+                )
+            )
+        for name, value in sorted(report["counters"].items()):
+            lines.append("{}: {}".format(name, value))
+        lines.append("Wall time: {:.4f}s".format(report["wall_s"]))
+        if "peak_rss_kb" in report:
+            lines.append("Peak RSS: {} kB".format(report["peak_rss_kb"]))
+        if "alloc_peak_bytes" in report:
+            lines.append(
+                "Peak allocations: {} bytes".format(report["alloc_peak_bytes"])
+            )
+        return "\n".join(lines) + "\n"
+
+
+def _parser_chain(parser):
+    """
+    Iterate over a parser and the parsers it wraps, outermost first.
+    """
+    while parser is not None:
+        yield parser
+        parser = getattr(parser, "parser", None)
+
+
+def _skips_options(parser):
+    """
+    Tell whether a parser, or any parser it wraps, skips invalid options.
+    """
+    return any(
+        getattr(each, "errors", None) == "skip"
+        for each in _parser_chain(parser)
+    )
+
+
+class Reporter(object):
+    """
+    Reporter generates a stats summary report.
+
+    :param parser: Parser used for parser stats files.
+    :type parser: :class:`IStatsParser`
+    :param cache: Cache of parsed files. It is not used when the parser
+        skips invalid options, which are only counted and quarantined when
+        the file is parsed.
+    :type cache: :class:`~.FeedCache`
+    :param profiler: Profiler timing the stages of the reports. Nothing is
+        timed when omitted.
+    :type profiler: :class:`~.Profiler`
+    """
+    def __init__(self, parser, cache=None, profiler=None):
+        self.parser = parser
+        self.cache = cache
+        self.profiler = profiler
+
+    def _stage(self, name):
+        """
+        Time a block as a stage of the profiler, if any.
+        """
+        if self.profiler is None:
+            return _NO_STAGE
+        return self.profiler.stage(name)
+
+    def _competitions(self, competitions):
+        """
+        Time the construction of competitions with the profiler, if any.
+        """
+        if self.profiler is None:
+            return competitions
+        return self.profiler.iterate(
+            "get_competitions",
+            competitions,
+            counter="competitions",
+        )
+
+    def load(self, fh):
+        """
         Load and parse the given file.
 
-        :param fh: File being parsed.
-        :type fh: :class:`file`
-        """
-        self.parser.parse(fh)
+        When a cache is used and holds the file, the parser is replaced by
+        the cached :class:`~.CompetitionStore` and the file is not parsed.
+
+        File contents held in a buffer, like the memory mapped files
+        returned by :func:`map_file`, are parsed with
+        :meth:`IStatsParser.parse_buffer`.
+
+        :param fh: File being parsed, or its content.
+        :type fh: :class:`file` or bytes-like object
+        """
+        with self._stage("load"):
+            self._load(fh)
+
+    def _load(self, fh):
+        parse = self.parser.parse
+        if isinstance(fh, (bytes, bytearray, memoryview, mmap.mmap)):
+            parse = self.parser.parse_buffer
+
+        if self.cache is None or _skips_options(self.parser):
+            with self._stage("parse"):
+                parse(fh)
+            return
+
+        with self._stage("cache"):
+            key = self.cache.key(fh, self.parser)
+            store = self.cache.get(key)
+        if store is not None:
+            self.parser = store
+            return
+
+        with self._stage("parse"):
+            parse(fh)
+        with self._stage("cache"):
+            store = CompetitionStore()
+            store.extend(self._competitions(self.parser.get_competitions()))
+            self.cache.put(key, store)
+
+    def option_count(self):
+        """
+        Return the total amount of options available.
+
+        :returns: Total option count.
+        :rtype: :class:`int`
+        """
+        with self._stage("option_count"):
+            return self.parser.option_count()
+
+    def _market_percentages(self):
+        """
+        Iterate over all the competitions together with their market
+        percentage, using the batch calculation of the parser when it has
+        one.
+        """
+        batch = getattr(self.parser, "iter_market_percentages", None)
+        if self.profiler is not None:
+            if batch is not None:
+                return self.profiler.iterate(
+                    "market_percentage",
+                    batch(),
+                    counter="competitions",
+                )
+            return self._profiled_market_percentages()
+        if batch is not None:
+            return batch()
+        return (
+            (each, each.market_percentage())
+            for each in self.parser.get_competitions()
+        )
+
+    def _profiled_market_percentages(self):
+        profiler = self.profiler
+        for each in self._competitions(self.parser.get_competitions()):
+            with profiler.stage("get_selections"):
+                selections = each.get_selections()
+            profiler.count("selections", len(selections))
+            with profiler.stage("market_percentage"):
+                market_price = each.market_percentage()
+            yield each, market_price
+
+    def largest_market_percentage(self):
+        """
+        Return the competition with the larget market percentage.
+
+        :returns: Competition with the largest market percentage.
+        :rtype: :class:`str`
+        """
+        mp = 0
+        largest = None
+        for each, market_price in self._market_percentages():
+            if market_price > mp:
+                largest = each.competition
+                mp = market_price
+        return largest
+
+    def least_market_percentage(self):
+        """
+        Return the competition with the least market percentage.
+
+        :returns: Competition with the least market percentage.
+        :rtype: :class:`str`
+        """
+        mp = None
+        least = None
+        for each, market_price in self._market_percentages():
+            if mp is None or market_price < mp:
+                least = each.competition
+                mp = market_price
+        return least
+
+    def market_rankings(self, k, per_sport=False):
+        """
+        Rank the competitions by market percentage in a single pass.
+
+        :param k: Number of competitions kept at each end of the ranking.
+        :type k: :class:`int`
+        :param per_sport: Rank the competitions of every sport separately.
+        :type per_sport: :class:`bool`
+        :returns: Competitions with the largest and least market percentage.
+        :rtype: :class:`~.MarketRanking`
+        """
+        ranking = MarketRanking(k, per_sport=per_sport)
+        for each, market_price in self._market_percentages():
+            ranking.add(each, market_price)
+        return ranking
+
+    def dump_compentition_market_prices(self, name, fh):
+        """
+        Dump a competitions market prices to a CSV formatted file.
+
+        .. note::
+
+            CSV fields are:
+            Game,Closes,Name,Calculated Market Percentage
+
+        :param name: Competition name that you are dumping market stats for.
+        :type name: :class:`str`
+        :param fh: Write file handler to write to.
+        :type fh: :class:`file`
+        """
+        comps = sorted(
+            self._competitions(self.parser.get_competitions_by_name(name)),
+            key=lambda x: x.closes
+        )
+        with self._stage("csv"):
+            _write_market_prices(
+                fh,
+                (
+                    (
+                        each.game,
+                        each.closes,
+                        each.name,
+                        each.market_percentage(),
+                    )
+                    for each in comps
+                ),
+            )
+
+    def _market_price_rows(self):
+        """
+        Iterate over the market price rows of every competition.
+        """
+        for each, market_price in self._market_percentages():
+            yield (
+                each.competition,
+                each.game,
+                each.closes,
+                each.name,
+                market_price,
+            )
+
+    def export(self, fh, chunk_rows=65536):
+        """
+        Export the competitions, their selections and market percentages to
+        a typed columnar file, read back with :class:`~.ColumnarReader`.
+
+        :param fh: Binary write file handler to write to.
+        :type fh: :class:`file`
+        :param chunk_rows: Number of competitions per chunk.
+        :type chunk_rows: :class:`int`
+        """
+        with ColumnarWriter(fh, chunk_rows=chunk_rows) as writer:
+            writer.append(self._market_percentages())
+
+    def dump_market_prices(self, fh, buffer_rows=None, directory=None):
+        """
+        Dump the market prices of every competition to a CSV formatted file,
+        ordered by closing time.
+
+        Rows are streamed through :func:`external_sort`, so memory stays
+        bounded however many competitions there are.
+
+        .. note::
+
+            CSV fields are:
+            Competition,Game,Closes,Name,Calculated Market Percentage
+
+        :param fh: Write file handler to write to.
+        :type fh: :class:`file`
+        :param buffer_rows: Number of rows sorted in memory.
+        :type buffer_rows: :class:`int`
+        :param directory: Directory of the temporary files.
+        :type directory: :class:`str`
+        :returns: Number of rows written.
+        :rtype: :class:`int`
+        """
+        rows = external_sort(
+            self._market_price_rows(),
+            _closes_key,
+            buffer_rows=buffer_rows,
+            directory=directory,
+        )
+        counted = _CountingIterator(rows)
+        with self._stage("csv"):
+            _write_market_prices(
+                fh,
+                counted,
+                ("Competition",) + MARKET_PRICE_FIELDS,
+            )
+        return counted.count
+
+    def dump_market_prices_by_competition(self, output, buffer_rows=None,
+                                          directory=None):
+        """
+        Dump the market prices of every competition to one CSV file per
+        competition, in the format of :meth:`dump_compentition_market_prices`.
+
+        Rows are sorted by file and closing time with :func:`external_sort`,
+        so a single file is open at once. Files are named by
+        :func:`competition_filename`, competitions mapping to the same name
+        share a file.
+
+        :param output: Directory the files are written to.
+        :type output: :class:`str`
+        :param buffer_rows: Number of rows sorted in memory.
+        :type buffer_rows: :class:`int`
+        :param directory: Directory of the temporary files.
+        :type directory: :class:`str`
+        :returns: Names of the files written keyed by competition.
+        :rtype: :class:`dict`
+        """
+        if not os.path.isdir(output):
+            os.makedirs(output)
+
+        names = {}
+
+        def with_filename(rows):
+            for row in rows:
+                filename = names.get(row[0])
+                if filename is None:
+                    filename = names[row[0]] = os.path.join(
+                        output,
+                        competition_filename(row[0]),
+                    )
+                yield (filename,) + row[1:]
+
+        rows = external_sort(
+            with_filename(self._market_price_rows()),
+            _file_closes_key,
+            buffer_rows=buffer_rows,
+            directory=directory,
+        )
+        with self._stage("csv"):
+            for filename, group in itertools.groupby(rows, key=lambda x: x[0]):
+                with open(filename, "w", newline="") as fh:
+                    _write_market_prices(fh, (row[1:] for row in group))
+        return names
+
+    def summary_counts(self):
+        """
+        Count the competitions of every market of every sport.
+
+        Only the counts are kept while the competitions are walked, the
+        counters of several feeds or parts of a feed can be merged.
+
+        :returns: Market counts.
+        :rtype: :class:`~.SummaryCounter`
+        """
+        counter = SummaryCounter()
+        for each in self._competitions(self.parser.get_competitions()):
+            counter.add(each.sport, each.name)
+        return counter
+
+    def summary(self):
+        """
+        Generate a summary report.
+
+        .. note::
+
+            <Sport Name>
+              <Market Name>: <Total Count>
+
+        Sports and their markets are ordered by name.
+
+        :returns: A summary report.
+        :rtype: :class:`str`
+        """
+        return self.summary_counts().format()
+
+    def write_summary(self, fh):
+        """
+        Write the summary report, see :meth:`summary`.
+
+        :param fh: Text write file handler to write to.
+        :type fh: :class:`file`
+        """
+        self.summary_counts().write(fh)
+
+    def aggregate(self, comp=None, top=None, per_sport=False):
+        """
+        Generate every report in a single pass over the competitions.
+
+        :param comp: Competition name to collect market prices for.
+        :type comp: :class:`str`
+        :param top: Number of competitions kept at each end of the market
+            percentage ranking, no ranking is kept if omitted.
+        :type top: :class:`int`
+        :param per_sport: Rank the competitions of every sport separately.
+        :type per_sport: :class:`bool`
+        :returns: Aggregated reports.
+        :rtype: :class:`~.ReportAggregator`
+        """
+        aggregator = ReportAggregator(comp=comp, top=top, per_sport=per_sport)
+        for each, market_price in self._market_percentages():
+            aggregator.add(each, market_price)
+        return aggregator
+
+
+class ReportAggregator(object):
+    """
+    ReportAggregator collects the data for all the :class:`~.Reporter`
+    reports while the competitions are walked once.
+
+    The reports returned match the ones generated by the equivalent
+    :class:`~.Reporter` methods.
+
+    :param comp: Competition name to collect market prices for.
+    :type comp: :class:`str`
+    :param top: Number of competitions kept at each end of the market
+        percentage ranking, no ranking is kept if omitted.
+    :type top: :class:`int`
+    :param per_sport: Rank the competitions of every sport separately.
+    :type per_sport: :class:`bool`
+    """
+    def __init__(self, comp=None, top=None, per_sport=False):
+        self.comp = comp
+        self.count = 0
+        self.largest = None
+        self.largest_mp = 0
+        self.least = None
+        self.least_mp = None
+        self.markets = SummaryCounter()
+        self.rows = []
+        self.ranking = None
+        if top is not None:
+            self.ranking = MarketRanking(top, per_sport=per_sport)
+
+    def add(self, competition, market_price=None):
+        """
+        Add a competition to the reports.
+
+        :param competition: Competition being added.
+        :type competition: :class:`~.Competition`
+        :param market_price: Market percentage of the competition if it is
+            already known.
+        :type market_price: :class:`float`
+        """
+        self.count += 1
+
+        if market_price is None:
+            market_price = competition.market_percentage()
+        if market_price > self.largest_mp:
+            self.largest = competition.competition
+            self.largest_mp = market_price
+        if self.least_mp is None or market_price < self.least_mp:
+            self.least = competition.competition
+            self.least_mp = market_price
+
+        self.markets.add(competition.sport, competition.name)
+
+        if self.comp is not None and competition.competition == self.comp:
+            self.rows.append(
+                (
+                    competition.game,
+                    competition.closes,
+                    competition.name,
+                    market_price,
+                )
+            )
+
+        if self.ranking is not None:
+            self.ranking.add(competition, market_price)
+
+    def merge(self, other):
+        """
+        Merge the reports of another aggregator into this one.
+
+        Merging the aggregators of consecutive parts of the competitions in
+        order gives the same reports as aggregating all of them at once.
+
+        :param other: Aggregator being merged.
+        :type other: :class:`~.ReportAggregator`
+        """
+        self.count += other.count
+
+        if other.largest_mp > self.largest_mp:
+            self.largest = other.largest
+            self.largest_mp = other.largest_mp
+        if other.least_mp is not None and (
+            self.least_mp is None or other.least_mp < self.least_mp
+        ):
+            self.least = other.least
+            self.least_mp = other.least_mp
+
+        self.markets.merge(other.markets)
+        self.rows.extend(other.rows)
+
+        if self.ranking is not None and other.ranking is not None:
+            self.ranking.merge(other.ranking)
+
+    def option_count(self):
+        """
+        Return the total amount of options seen.
+
+        :returns: Total option count.
+        :rtype: :class:`int`
+        """
+        return self.count
+
+    def largest_market_percentage(self):
+        """
+        Return the competition with the larget market percentage.
+
+        :returns: Competition with the largest market percentage.
+        :rtype: :class:`str`
+        """
+        return self.largest
+
+    def least_market_percentage(self):
+        """
+        Return the competition with the least market percentage.
+
+        :returns: Competition with the least market percentage.
+        :rtype: :class:`str`
+        """
+        return self.least
+
+    def dump_compentition_market_prices(self, name, fh):
+        """
+        Dump a competitions market prices to a CSV formatted file.
+
+        :param name: Competition name that you are dumping market stats for.
+            Only the competition given when the aggregator was created is
+            available.
+        :type name: :class:`str`
+        :param fh: Write file handler to write to.
+        :type fh: :class:`file`
+        :raises ValueError: If market prices were not collected for the
+            competition.
+        """
+        if name != self.comp:
+            raise ValueError(
+                "Market prices were not collected for {!r}".format(name)
+            )
+        _write_market_prices(fh, sorted(self.rows, key=lambda x: x[1]))
+
+    def market_rankings(self, k, per_sport=False):
+        """
+        Return the competitions ranked by market percentage.
+
+        :param k: Number of competitions kept at each end of the ranking.
+            At most the number given when the aggregator was created.
+        :type k: :class:`int`
+        :param per_sport: Rank the competitions of every sport separately.
+        :type per_sport: :class:`bool`
+        :returns: Competitions with the largest and least market percentage.
+        :rtype: :class:`~.MarketRanking`
+        :raises ValueError: If such a ranking was not collected.
+        """
+        if (
+            self.ranking is None or k > self.ranking.k or
+            per_sport != self.ranking.per_sport
+        ):
+            raise ValueError("Market ranking was not collected")
+        return self.ranking.truncated(k)
+
+    def summary(self):
+        """
+        Generate a summary report.
+
+        :returns: A summary report.
+        :rtype: :class:`str`
+        """
+        return self.markets.format()
+
+    def write_summary(self, fh):
+        """
+        Write the summary report.
+
+        :param fh: Text write file handler to write to.
+        :type fh: :class:`file`
+        """
+        self.markets.write(fh)
+
+
+#: CSV fields of the competition market prices dumps.
+MARKET_PRICE_FIELDS = (
+    "Game",
+    "Closes",
+    "Name",
+    "Calculated Market Percentage",
+)
+
+#: Number of rows sorted in memory by :func:`external_sort` before they are
+#: spilled to a temporary file.
+SORT_BUFFER_ROWS = 100000
+
+#: Maximum number of sorted runs merged at once by :func:`external_sort`,
+#: which bounds the temporary files it keeps open.
+SORT_MERGE_RUNS = 64
+
+
+def _write_market_prices(fh, rows, fieldnames=MARKET_PRICE_FIELDS):
+    """
+    Write competition market prices to a CSV formatted file.
+
+    :param fh: Write file handler to write to.
+    :type fh: :class:`file`
+    :param rows: Game, closing time, name and market percentage of the
+        competitions, or one value per field when ``fieldnames`` is given.
+    :type rows: iterable of :class:`tuple`
+    :param fieldnames: CSV header.
+    :type fieldnames: sequence of :class:`str`
+    """
+    writer = csv.writer(fh)
+    writer.writerow(fieldnames)
+    writer.writerows(rows)
+
+
+def external_sort(rows, key, buffer_rows=None, directory=None,
+                  merge_runs=None):
+    """
+    Sort rows in bounded memory.
+
+    Rows are sorted in runs of ``buffer_rows``. When there is more than one
+    run, each one is spilled to a temporary file and the runs are merged
+    back while they are read, so at most ``buffer_rows`` rows plus a block
+    per run are held in memory. Every ``merge_runs`` runs of the same size
+    are merged into a bigger run as soon as they are spilled, so only a few
+    ``merge_runs`` files are open at once however many rows are sorted. The
+    sort is stable like :func:`sorted`.
+
+    :param rows: Rows being sorted, they must be picklable.
+    :type rows: iterable
+    :param key: Callable returning the sort key of a row.
+    :type key: callable
+    :param buffer_rows: Number of rows sorted in memory, defaults to
+        :data:`SORT_BUFFER_ROWS`.
+    :type buffer_rows: :class:`int`
+    :param directory: Directory of the temporary files.
+    :type directory: :class:`str`
+    :param merge_runs: Number of runs merged at once, defaults to
+        :data:`SORT_MERGE_RUNS`.
+    :type merge_runs: :class:`int`
+    :returns: Sorted rows.
+    :rtype: iterable
+    """
+    buffer_rows = buffer_rows or SORT_BUFFER_ROWS
+    merge_runs = max(2, merge_runs or SORT_MERGE_RUNS)
+    # runs are (level, file) pairs in row order, a run of level n holding
+    # merge_runs ** n spilled buffers.
+    runs = []
+    try:
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= buffer_rows:
+                buffer.sort(key=key)
+                runs.append((0, _spill(buffer, directory)))
+                buffer = []
+                _merge_levels(runs, key, merge_runs, directory)
+        buffer.sort(key=key)
+
+        if not runs:
+            for row in buffer:
+                yield row
+            return
+
+        if buffer:
+            runs.append((0, _spill(buffer, directory)))
+            buffer = None
+        # merging the most recent runs keeps the rows in order.
+        while len(runs) > merge_runs:
+            _merge_tail(runs, merge_runs, key, directory)
+        for row in heapq.merge(
+            *[_read_run(run) for _, run in runs],
+            key=key
+        ):
+            yield row
+    finally:
+        for _, run in runs:
+            run.close()
+
+
+def _merge_levels(runs, key, merge_runs, directory=None):
+    """
+    Merge the most recent runs while ``merge_runs`` of them have the same
+    level.
+    """
+    while len(runs) >= merge_runs and len(
+        set(level for level, _ in runs[-merge_runs:])
+    ) == 1:
+        _merge_tail(runs, merge_runs, key, directory)
+
+
+def _merge_tail(runs, count, key, directory=None):
+    """
+    Replace the ``count`` most recent runs by a single merged run.
+    """
+    tail = runs[-count:]
+    try:
+        merged = _spill(
+            heapq.merge(*[_read_run(run) for _, run in tail], key=key),
+            directory,
+        )
+    finally:
+        del runs[-count:]
+        for _, run in tail:
+            run.close()
+    runs.append((max(level for level, _ in tail) + 1, merged))
+
+
+def _spill(rows, directory=None, block=1024):
+    """
+    Write sorted rows to an anonymous temporary file in pickled blocks.
+    """
+    fh = tempfile.TemporaryFile(dir=directory)
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, block))
+        if not chunk:
+            break
+        pickle.dump(chunk, fh, pickle.HIGHEST_PROTOCOL)
+    fh.seek(0)
+    return fh
+
+
+def _read_run(fh):
+    """
+    Read back the rows written by :func:`_spill`.
+    """
+    while True:
+        try:
+            rows = pickle.load(fh)
+        except EOFError:
+            return
+        for row in rows:
+            yield row
+
+
+def _closes_key(row):
+    return row[2] or ""
+
+
+def _file_closes_key(row):
+    return (row[0], row[2] or "")
+
+
+class _CountingIterator(object):  # pylint: disable=too-few-public-methods
+    """
+    Iterator counting the items taken from another one.
+    """
+    def __init__(self, iterable):
+        self.iterable = iter(iterable)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = next(self.iterable)
+        self.count += 1
+        return item
+
+
+def competition_filename(name):
+    """
+    Return a file name for the market prices dump of a competition.
+
+    :param name: Competition name.
+    :type name: :class:`str`
+    :rtype: :class:`str`
+    """
+    return "{}.csv".format(re.sub(r"[^\w.-]+", "_", name or "").strip("._")
+                           or "_")
+
+
+#: Number of summary lines joined before being written out.
+SUMMARY_BUFFER_LINES = 4096
+
+
+class SummaryCounter(object):
+    """
+    SummaryCounter counts the competitions of every market of every sport
+    for the summary report.
+
+    Only the counts are kept, so memory depends on the number of distinct
+    markets rather than on the number of competitions. Counters of separate
+    parts of the competitions, in any order, merge into the counter of all
+    of them.
+    """
+    def __init__(self):
+        self.categories = {}
+
+    def add(self, sport, name, count=1):
+        """
+        Count competitions of a market.
+
+        :param sport: Sport of the competitions.
+        :type sport: :class:`str`
+        :param name: Market name of the competitions.
+        :type name: :class:`str`
+        :param count: Number of competitions.
+        :type count: :class:`int`
+        """
+        markets = self.categories.setdefault(sport, {})
+        markets[name] = markets.get(name, 0) + count
+
+    def remove(self, sport, name):
+        """
+        Uncount a competition of a market, markets and sports are dropped
+        once they have no competitions left.
+
+        :param sport: Sport of the competition.
+        :type sport: :class:`str`
+        :param name: Market name of the competition.
+        :type name: :class:`str`
+        """
+        markets = self.categories[sport]
+        markets[name] -= 1
+        if not markets[name]:
+            del markets[name]
+            if not markets:
+                del self.categories[sport]
+
+    def merge(self, other):
+        """
+        Add the counts of another counter to this one.
+
+        :param other: Counter being merged.
+        :type other: :class:`~.SummaryCounter`
+        """
+        for sport, others in other.categories.items():
+            for name, count in others.items():
+                self.add(sport, name, count)
+
+    def write(self, fh):
+        """
+        Write the summary report, with the sports and their markets ordered
+        by name.
+
+        Lines are joined and written in batches of
+        :data:`SUMMARY_BUFFER_LINES`.
+
+        :param fh: Text write file handler to write to.
+        :type fh: :class:`file`
+        """
+        lines = []
+        for sport in sorted(self.categories, key=str):
+            lines.append("{}\n".format(sport))
+            markets = self.categories[sport]
+            for name in sorted(markets, key=str):
+                lines.append("  {}: {}\n".format(name, markets[name]))
+            if len(lines) >= SUMMARY_BUFFER_LINES:
+                fh.write("".join(lines))
+                del lines[:]
+        fh.write("".join(lines))
+
+    def format(self):
+        """
+        Format the summary report, see :meth:`write`.
+
+        :returns: A summary report.
+        :rtype: :class:`str`
+        """
+        fh = io.StringIO()
+        self.write(fh)
+        return fh.getvalue()
+
+
+#: Competition ranked by :class:`~.MarketRanking`.
+RankedMarket = collections.namedtuple(
+    "RankedMarket",
+    ["market_percentage", "competition", "sport", "name", "game", "closes"],
+)
+
+
+class MarketRanking(object):
+    """
+    MarketRanking keeps the competitions with the largest and the least
+    market percentage while they are walked once.
+
+    Each end of the ranking is a bounded heap holding at most ``k``
+    competitions, whose root is the entry to drop first, so memory stays
+    ``O(k)`` per ranking no matter how many competitions are added.
+
+    When several competitions share a market percentage, the one added first
+    ranks higher, like :meth:`Reporter.largest_market_percentage` and
+    :meth:`Reporter.least_market_percentage`.
+
+    :param k: Number of competitions kept at each end of the ranking.
+    :type k: :class:`int`
+    :param per_sport: Rank the competitions of every sport separately.
+    :type per_sport: :class:`bool`
+    """
+    def __init__(self, k, per_sport=False):
+        if k < 1:
+            raise ValueError("Ranking size must be positive, got {}".format(k))
+        self.k = k
+        self.per_sport = per_sport
+        self.sequence = 0
+        self.largest_heaps = {}
+        self.least_heaps = {}
+
+    def _push(self, heaps, group, item):
+        heap = heaps.setdefault(group, [])
+        if len(heap) < self.k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+    def add(self, competition, market_price=None):
+        """
+        Add a competition to the ranking.
+
+        :param competition: Competition being added.
+        :type competition: :class:`~.Competition`
+        :param market_price: Market percentage of the competition if it is
+            already known.
+        :type market_price: :class:`float`
+        """
+        if market_price is None:
+            market_price = competition.market_percentage()
+        self.sequence += 1
+
+        group = competition.sport if self.per_sport else None
+        entry = RankedMarket(
+            float(market_price),
+            competition.competition,
+            competition.sport,
+            competition.name,
+            competition.game,
+            competition.closes,
+        )
+        self._push(
+            self.largest_heaps,
+            group,
+            (entry.market_percentage, -self.sequence, entry),
+        )
+        self._push(
+            self.least_heaps,
+            group,
+            (-entry.market_percentage, -self.sequence, entry),
+        )
+
+    def merge(self, other):
+        """
+        Merge the ranking of another set of competitions into this one.
+
+        Merging the rankings of consecutive parts of the competitions in
+        order gives the same ranking as adding all of them at once.
+
+        :param other: Ranking being merged.
+        :type other: :class:`~.MarketRanking`
+        """
+        for heaps, others in [
+            (self.largest_heaps, other.largest_heaps),
+            (self.least_heaps, other.least_heaps),
+        ]:
+            for group, heap in others.items():
+                for score, sequence, entry in heap:
+                    self._push(
+                        heaps,
+                        group,
+                        (score, sequence - self.sequence, entry),
+                    )
+        self.sequence += other.sequence
+
+    def truncated(self, k):
+        """
+        Return a copy of the ranking keeping only the first ``k``
+        competitions at each end.
+
+        :param k: Number of competitions kept at each end of the ranking.
+        :type k: :class:`int`
+        :rtype: :class:`~.MarketRanking`
+        """
+        ranking = MarketRanking(k, per_sport=self.per_sport)
+        ranking.merge(self)
+        return ranking
+
+    @staticmethod
+    def _ranked(heaps, per_sport):
+        ranked = dict(
+            (group, [item[2] for item in sorted(heap, reverse=True)])
+            for group, heap in heaps.items()
+        )
+        if per_sport:
+            return ranked
+        return ranked.get(None, [])
+
+    def largest(self):
+        """
+        Return the competitions with the largest market percentage.
+
+        :returns: Competitions ordered from the largest market percentage,
+            keyed by sport when ranked per sport.
+        :rtype: :class:`list` or :class:`dict` of :class:`~.RankedMarket`
+        """
+        return self._ranked(self.largest_heaps, self.per_sport)
+
+    def least(self):
+        """
+        Return the competitions with the least market percentage.
+
+        :returns: Competitions ordered from the least market percentage,
+            keyed by sport when ranked per sport.
+        :rtype: :class:`list` or :class:`dict` of :class:`~.RankedMarket`
+        """
+        return self._ranked(self.least_heaps, self.per_sport)
+
+
+def _format_ranking(title, ranked):
+    """
+    Format ranked competitions as a report.
+
+    :param title: Heading of the report.
+    :type title: :class:`str`
+    :param ranked: Ranked competitions, optionally keyed by sport.
+    :type ranked: :class:`list` or :class:`dict` of :class:`~.RankedMarket`
+    :returns: A ranking report.
+    :rtype: :class:`str`
+    """
+    if isinstance(ranked, dict):
+        groups = [(sport, ranked[sport]) for sport in sorted(ranked)]
+    else:
+        groups = [(None, ranked)]
+
+    lines = [title]
+    for sport, entries in groups:
+        if sport is not None:
+            lines.append(sport)
+        for position, each in enumerate(entries, 1):
+            lines.append(
+                "  {}. {} - {} ({}): {}".format(
+                    position,
+                    each.competition,
+                    each.game,
+                    each.name,
+                    each.market_percentage,
+                )
+            )
+    return "\n".join(lines) + "\n"
+
+
+def option_key(record):
+    """
+    Return the key identifying an option across snapshots of a feed.
+
+    :param record: Competition, decoded JSON option or XML option element.
+    :returns: Number, game and name of the option.
+    :rtype: :class:`tuple`
+    """
+    if isinstance(record, Competition):
+        return (record.number, record.game, record.name)
+    return (int(record.get("number", 0)), record.get("game"), record.get("name"))
+
+
+def _fingerprint(record):
+    """
+    Return a value which changes whenever anything in the option changes.
+    """
+    if isinstance(record, Competition):
+        return (
+            record.venue,
+            record.competition,
+            record.closes,
+            record.sport,
+            tuple(
+                (sel.number, sel.name, sel.odds, sel.status)
+                for sel in record.get_selections()
+            ),
+        )
+    if isinstance(record, dict):
+        return repr(record)
+    return etree.tostring(record)
+
+
+class IncrementalReport(object):
+    """
+    IncrementalReport keeps the reports of a feed up to date as new
+    snapshots of it are loaded.
+
+    Options are matched across snapshots by :func:`option_key` and only the
+    ones which were added, changed or removed update the reports. Options
+    sharing a key within a snapshot are told apart by their order, so each
+    of them is counted. Extrema are kept in heaps whose stale entries are
+    dropped lazily.
+
+    When several competitions share the extreme market percentage, the one
+    that has been unchanged the longest is reported.
+
+    :param comp: Competition name to keep market prices for.
+    :type comp: :class:`str`
+    """
+    def __init__(self, comp=None):
+        self.comp = comp
+        self.entries = {}
+        self.markets = SummaryCounter()
+        self.rows = {}
+        self.largest_heap = []
+        self.least_heap = []
+        self.sequence = 0
+
+    def update(self, parser):
+        """
+        Update the reports with a new snapshot of the feed.
+
+        :param parser: Parser holding the new snapshot.
+        :type parser: :class:`IStatsParser`
+        :returns: Number of added, changed and removed options.
+        :rtype: :class:`tuple` of :class:`int`
+        """
+        records = getattr(parser, "records", None)
+        if records is None:
+            records = parser.get_competitions()
+            make_competition = lambda x: x
+        else:
+            make_competition = parser.make_competition
+
+        added = changed = 0
+        seen = set()
+        occurrences = collections.Counter()
+        for record in records:
+            key = option_key(record)
+            occurrences[key] += 1
+            key += (occurrences[key],)
+            seen.add(key)
+            fingerprint = _fingerprint(record)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                continue
+            if entry is None:
+                added += 1
+            else:
+                changed += 1
+                self._remove(key)
+            self._add(key, fingerprint, make_competition(record))
+
+        removed = [key for key in self.entries if key not in seen]
+        for key in removed:
+            self._remove(key)
+
+        self._compact()
+        return added, changed, len(removed)
+
+    def _add(self, key, fingerprint, competition):
+        market_price = competition.market_percentage()
+        self.sequence += 1
+        self.entries[key] = (
+            fingerprint,
+            self.sequence,
+            competition.sport,
+            competition.name,
+            competition.competition,
+            market_price,
+            competition.game,
+            competition.closes,
+        )
+
+        self.markets.add(competition.sport, competition.name)
+
+        heapq.heappush(self.largest_heap, (-market_price, self.sequence, key))
+        heapq.heappush(self.least_heap, (market_price, self.sequence, key))
+
+        if self.comp is not None and competition.competition == self.comp:
+            self.rows[key] = (
+                competition.game,
+                competition.closes,
+                competition.name,
+                market_price,
+            )
+
+    def _remove(self, key):
+        _, _, sport, name, _, _, _, _ = self.entries.pop(key)
+        self.markets.remove(sport, name)
+        self.rows.pop(key, None)
+
+    def _valid(self, item):
+        entry = self.entries.get(item[2])
+        return entry is not None and entry[1] == item[1]
+
+    def _compact(self):
+        """
+        Drop the stale heap entries once they outnumber the live ones.
+        """
+        for heap in [self.largest_heap, self.least_heap]:
+            if len(heap) > 2 * len(self.entries) + 64:
+                heap[:] = [item for item in heap if self._valid(item)]
+                heapq.heapify(heap)
+
+    def _top(self, heap):
+        while heap and not self._valid(heap[0]):
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        return self.entries[heap[0][2]]
+
+    def option_count(self):
+        """
+        Return the total amount of options available.
+
+        :returns: Total option count.
+        :rtype: :class:`int`
+        """
+        return len(self.entries)
+
+    def largest_market_percentage(self):
+        """
+        Return the competition with the larget market percentage.
+
+        :returns: Competition with the largest market percentage.
+        :rtype: :class:`str`
+        """
+        entry = self._top(self.largest_heap)
+        if entry is None or entry[5] <= 0:
+            return None
+        return entry[4]
+
+    def least_market_percentage(self):
+        """
+        Return the competition with the least market percentage.
+
+        :returns: Competition with the least market percentage.
+        :rtype: :class:`str`
+        """
+        entry = self._top(self.least_heap)
+        return None if entry is None else entry[4]
+
+    def market_rankings(self, k, per_sport=False):
+        """
+        Rank the competitions by market percentage.
+
+        The kept market percentages are ranked, the feed is not parsed
+        again.
+
+        :param k: Number of competitions kept at each end of the ranking.
+        :type k: :class:`int`
+        :param per_sport: Rank the competitions of every sport separately.
+        :type per_sport: :class:`bool`
+        :returns: Competitions with the largest and least market percentage.
+        :rtype: :class:`~.MarketRanking`
+        """
+        ranking = MarketRanking(k, per_sport=per_sport)
+        # rank in the order the options were last updated, like the heaps.
+        for entry in sorted(self.entries.values(), key=lambda x: x[1]):
+            ranking.add(
+                Competition(
+                    venue=None,
+                    competition=entry[4],
+                    closes=entry[7],
+                    name=entry[3],
+                    number=None,
+                    sport=entry[2],
+                    game=entry[6],
+                ),
+                entry[5],
+            )
+        return ranking
+
+    def dump_compentition_market_prices(self, name, fh):
+        """
+        Dump a competitions market prices to a CSV formatted file.
+
+        :param name: Competition name that you are dumping market stats for.
+            Only the competition given when the report was created is
+            available.
+        :type name: :class:`str`
+        :param fh: Write file handler to write to.
+        :type fh: :class:`file`
+        :raises ValueError: If market prices are not kept for the
+            competition.
+        """
+        if name != self.comp:
+            raise ValueError(
+                "Market prices are not kept for {!r}".format(name)
+            )
+        _write_market_prices(
+            fh,
+            sorted(self.rows.values(), key=lambda x: x[1]),
+        )
+
+    def summary(self):
+        """
+        Generate a summary report.
+
+        :returns: A summary report.
+        :rtype: :class:`str`
+        """
+        return self.markets.format()
+
+    def write_summary(self, fh):
+        """
+        Write the summary report.
+
+        :param fh: Text write file handler to write to.
+        :type fh: :class:`file`
+        """
+        self.markets.write(fh)
+
+
+#: Header of the CSV written by :func:`write_diff`.
+DIFF_FIELDS = (
+    "Change",
+    "Number",
+    "Game",
+    "Name",
+    "Sport",
+    "Competition",
+    "Selection",
+    "Selection Name",
+    "Old Odds",
+    "New Odds",
+    "Old Market Percentage",
+    "New Market Percentage",
+    "Market Percentage Delta",
+)
+
+
+#: Option of a snapshot joined by :func:`diff_snapshots`. Its selections
+#: are :data:`_DiffSelection` ordered by number.
+_DiffOption = collections.namedtuple(
+    "_DiffOption",
+    ["key", "sport", "competition", "selections", "market_percentage"],
+)
+
+_DiffSelection = collections.namedtuple(
+    "_DiffSelection",
+    ["number", "name", "odds", "status"],
+)
+
+#: Change yielded by :func:`diff_snapshots`, one value per
+#: :data:`DIFF_FIELDS` field.
+DiffRow = collections.namedtuple(
+    "DiffRow",
+    [
+        "change",
+        "number",
+        "game",
+        "name",
+        "sport",
+        "competition",
+        "selection",
+        "selection_name",
+        "old_odds",
+        "new_odds",
+        "old_market_percentage",
+        "new_market_percentage",
+        "market_percentage_delta",
+    ],
+)
+
+
+def _diff_key(comp):
+    """
+    Return the :func:`option_key` of a competition, with a missing game or
+    name compared as an empty string so every key can be sorted.
+    """
+    number, game, name = option_key(comp)
+    return (number, game or "", name or "")
+
+
+def _diff_options(parser):
+    """
+    Turn the competitions of a snapshot into the picklable options joined by
+    :func:`diff_snapshots`.
+    """
+    for comp in parser.get_competitions():
+        yield _DiffOption(
+            key=_diff_key(comp),
+            sport=comp.sport,
+            competition=comp.competition,
+            selections=tuple(
+                _DiffSelection(sel.number, sel.name, sel.odds, sel.status)
+                for sel in comp.get_selections()
+            ),
+            market_percentage=comp.market_percentage(),
+        )
+
+
+def _option_change(change, old, new):
+    """
+    Build the row of an added, removed or changed option.
+    """
+    option = new or old
+    number, game, name = option.key
+    old_price = old.market_percentage if old else None
+    new_price = new.market_percentage if new else None
+    return DiffRow(
+        change=change,
+        number=number,
+        game=game,
+        name=name,
+        sport=option.sport,
+        competition=option.competition,
+        selection=None,
+        selection_name=None,
+        old_odds=None,
+        new_odds=None,
+        old_market_percentage=old_price,
+        new_market_percentage=new_price,
+        market_percentage_delta=(
+            new_price - old_price if old and new else None
+        ),
+    )
+
+
+def _selection_change(change, option, selection, old_odds, new_odds):
+    """
+    Build the row of an added, removed or changed selection.
+    """
+    number, game, name = option.key
+    return DiffRow(
+        change=change,
+        number=number,
+        game=game,
+        name=name,
+        sport=option.sport,
+        competition=option.competition,
+        selection=selection.number,
+        selection_name=selection.name,
+        old_odds=old_odds,
+        new_odds=new_odds,
+        old_market_percentage=None,
+        new_market_percentage=None,
+        market_percentage_delta=None,
+    )
+
+
+def _selection_changes(old, new):
+    """
+    Join the selections of an option found in both snapshots on their
+    number, both sides being ordered by it.
+    """
+    old_selections = iter(old.selections)
+    new_selections = iter(new.selections)
+    before = next(old_selections, None)
+    after = next(new_selections, None)
+    while before is not None or after is not None:
+        if after is None or (
+            before is not None and before.number < after.number
+        ):
+            yield _selection_change(
+                "selection_removed", new, before, before.odds, None,
+            )
+            before = next(old_selections, None)
+        elif before is None or after.number < before.number:
+            yield _selection_change(
+                "selection_added", new, after, None, after.odds,
+            )
+            after = next(new_selections, None)
+        else:
+            if before != after:
+                yield _selection_change(
+                    "selection_changed", new, after, before.odds, after.odds,
+                )
+            before = next(old_selections, None)
+            after = next(new_selections, None)
+
+
+def _sorted_options(parser, buffer_rows, directory):
+    return external_sort(
+        _diff_options(parser),
+        operator.attrgetter("key"),
+        buffer_rows,
+        directory,
+    )
+
+
+def diff_snapshots(old, new, buffer_rows=None, directory=None):
+    """
+    Compute the changes between two snapshots of a feed.
+
+    Options are joined on their :func:`option_key`, a missing game or name
+    being compared as an empty string, with a sorted merge: both snapshots
+    are ordered by :func:`external_sort`, spilling to temporary files past
+    ``buffer_rows`` options, and then walked side by side once. Only the
+    options being compared are held in memory, so the snapshots can be read
+    by the streaming parsers no matter how big they are.
+
+    Every added or removed option yields a row, and every option whose
+    selections changed yields a ``changed`` row with its market percentage
+    delta, followed by a row per ``selection_added``,
+    ``selection_removed`` or ``selection_changed`` selection. Rows are
+    ordered by option number, game and name.
+
+    :param old: Parser holding the previous snapshot.
+    :type old: :class:`IStatsParser`
+    :param new: Parser holding the current snapshot.
+    :type new: :class:`IStatsParser`
+    :param buffer_rows: Number of options sorted in memory.
+    :type buffer_rows: :class:`int`
+    :param directory: Directory of the temporary files.
+    :type directory: :class:`str`
+    :returns: Changes between the snapshots.
+    :rtype: iterable of :class:`~.DiffRow`
+    """
+    old_options = _sorted_options(old, buffer_rows, directory)
+    new_options = _sorted_options(new, buffer_rows, directory)
+    before = next(old_options, None)
+    after = next(new_options, None)
+    while before is not None or after is not None:
+        if after is None or (before is not None and before.key < after.key):
+            yield _option_change("removed", before, None)
+            before = next(old_options, None)
+        elif before is None or after.key < before.key:
+            yield _option_change("added", None, after)
+            after = next(new_options, None)
+        else:
+            if before.selections != after.selections:
+                yield _option_change("changed", before, after)
+                for row in _selection_changes(before, after):
+                    yield row
+            before = next(old_options, None)
+            after = next(new_options, None)
+
+
+def write_diff(fh, old, new, buffer_rows=None, directory=None):
+    """
+    Write the changes between two snapshots of a feed to a CSV formatted
+    file as they are computed, see :func:`diff_snapshots`.
+
+    :param fh: Write file handler to write to.
+    :type fh: :class:`file`
+    :param old: Parser holding the previous snapshot.
+    :type old: :class:`IStatsParser`
+    :param new: Parser holding the current snapshot.
+    :type new: :class:`IStatsParser`
+    :param buffer_rows: Number of options sorted in memory.
+    :type buffer_rows: :class:`int`
+    :param directory: Directory of the temporary files.
+    :type directory: :class:`str`
+    :returns: Number of added, changed and removed options.
+    :rtype: :class:`tuple` of :class:`int`
+    """
+    counts = collections.Counter()
+
+    def counted(rows):
+        for row in rows:
+            counts[row[0]] += 1
+            yield row
+
+    _write_market_prices(
+        fh,
+        counted(diff_snapshots(old, new, buffer_rows, directory)),
+        fieldnames=DIFF_FIELDS,
+    )
+    return counts["added"], counts["changed"], counts["removed"]
+
+
+def map_file(filename):
+    """
+    Memory map a stats file read-only.
+
+    The mapping shares the page cache with every other process mapping or
+    reading the same file, and can be passed to :meth:`Reporter.load`
+    instead of a file handler. Compressed files can not be mapped and are
+    decompressed into memory instead.
+
+    :param filename: Name of the stats file.
+    :type filename: :class:`str`
+    :returns: Content of the file.
+    :rtype: :class:`mmap.mmap` or :class:`bytes` for empty and compressed
+        files
+    """
+    with open(filename, "rb") as fh:
+        if sniff_compression(fh.read(8)) is not None:
+            with open_feed(filename) as feed:
+                return feed.read()
+        if not os.fstat(fh.fileno()).st_size:
+            # empty files can not be mapped.
+            return b""
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+#: Magic numbers of the supported compressions and the modules reading them.
+COMPRESSIONS = (
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "lzma"),
+)
+
+#: Suffixes of the stats files, used when their content can not be sniffed.
+FORMAT_SUFFIXES = (
+    (".json", "json"),
+    (".xml", "xml"),
+    (EXPORT_SUFFIX, "columnar"),
+)
+
+#: Suffixes of the compressed stats files picked from directories.
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".xz")
+
+#: Number of bytes read from the start of a file to sniff its format.
+SNIFF_SIZE = 4096
+
+
+def sniff_compression(head):
+    """
+    Work out the compression of a file from its first bytes.
+
+    :param head: Start of the file.
+    :type head: :class:`bytes`
+    :returns: Name of the module decompressing the file, ``None`` when it is
+        not compressed.
+    :rtype: :class:`str`
+    """
+    for magic, module in COMPRESSIONS:
+        if head.startswith(magic):
+            return module
+    return None
+
+
+def open_feed(filename):
+    """
+    Open a stats file for reading, decompressing it on the fly when it is
+    compressed with gzip, bzip2 or xz.
+
+    :param filename: Name of the stats file.
+    :type filename: :class:`str`
+    :returns: Binary read file handler.
+    :rtype: :class:`file`
+    """
+    with open(filename, "rb") as fh:
+        compression = sniff_compression(fh.read(8))
+    if compression is None:
+        return open(filename, "rb")
+    return importlib.import_module(compression).open(filename, "rb")
+
+
+def sniff_file(filename):
+    """
+    Work out the format of a stats file from its content.
+
+    :param filename: Name of the stats file.
+    :type filename: :class:`str`
+    :returns: ``"json"``, ``"xml"`` or ``"columnar"``.
+    :rtype: :class:`str`
+    :raises ValueError: If the format is not supported.
+    :raises OSError: If the file can not be read.
+    """
+    with open(filename, "rb") as fh:
+        head = fh.read(SNIFF_SIZE)
+    # exports are mapped in place, so they are never compressed.
+    if head.startswith(EXPORT_MAGIC):
+        return "columnar"
+    if sniff_compression(head) is not None:
+        with open_feed(filename) as fh:
+            head = fh.read(SNIFF_SIZE)
+    return sniff_format(head)
+
+
+def make_parser(filename, stream=False, errors=None, quarantine=None):
+    """
+    Create the parser for a stats file based on its content.
+
+    Files that can not be read or sniffed fall back to their extension.
+
+    :param filename: Name of the stats file.
+    :type filename: :class:`str`
+    :param stream: Use an incremental parser.
+    :type stream: :class:`bool`
+    :param errors: How invalid options are handled, see
+        :class:`IStatsParser`. Exports are never checked.
+    :type errors: :class:`str`
+    :param quarantine: Text write file handler receiving the skipped
+        options.
+    :type quarantine: :class:`file`
+    :returns: Parser for the file.
+    :rtype: :class:`IStatsParser`
+    :raises ValueError: If the file format is not supported.
+    """
+    try:
+        fmt = sniff_file(filename)
+    except (OSError, EOFError, ValueError):
+        fmt = next(
+            (fmt for suffix, fmt in FORMAT_SUFFIXES if filename.endswith(suffix)),
+            None,
+        )
+
+    if fmt == "json":
+        cls = JSONStreamParser if stream else JSONParser
+        return cls(errors=errors, quarantine=quarantine)
+    if fmt == "xml":
+        cls = XMLStreamParser if stream else XMLParser
+        return cls(errors=errors, quarantine=quarantine)
+    if fmt == "columnar":
+        return ColumnarReader()
+    raise ValueError("Unsupported file format for {!r}".format(filename))
+
+
+def expand_filenames(names):
+    """
+    Expand directories and glob patterns into the stats files they match.
+
+    Directories are expanded to the JSON, XML and export files they
+    contain, compressed or not. Both expansions are sorted by name so the
+    files are always processed in the same order.
+
+    :param names: File names, directories or glob patterns.
+    :type names: iterable of :class:`str`
+    :returns: File names.
+    :rtype: :class:`list` of :class:`str`
+    """
+    filenames = []
+    for name in names:
+        if os.path.isdir(name):
+            filenames.extend(
+                sorted(
+                    os.path.join(name, each)
+                    for each in os.listdir(name)
+                    if _stats_filename(each)
+                )
+            )
+        elif glob.has_magic(name):
+            filenames.extend(sorted(glob.glob(name)))
+        else:
+            filenames.append(name)
+    return filenames
+
+
+def _stats_filename(filename):
+    """
+    Return whether a file in a directory looks like a stats file.
+    """
+    for suffix in COMPRESSED_SUFFIXES:
+        if filename.endswith(suffix):
+            filename = filename[:-len(suffix)]
+            break
+    return filename.endswith(tuple(suffix for suffix, _ in FORMAT_SUFFIXES))
+
+
+def aggregate_file(filename, comp=None, stream=False, cache=None, top=None,
+                   per_sport=False, query=None):
+    """
+    Parse a stats file and aggregate all its reports.
+
+    :param filename: Name of the stats file.
+    :type filename: :class:`str`
+    :param comp: Competition name to collect market prices for.
+    :type comp: :class:`str`
+    :param stream: Use an incremental parser.
+    :type stream: :class:`bool`
+    :param cache: Cache of parsed files.
+    :type cache: :class:`~.FeedCache`
+    :param top: Number of competitions kept at each end of the market
+        percentage ranking, no ranking is kept if omitted.
+    :type top: :class:`int`
+    :param per_sport: Rank the competitions of every sport separately.
+    :type per_sport: :class:`bool`
+    :param query: Only aggregate the options matching this query.
+    :type query: :class:`~.Query`
+    :returns: Aggregated reports.
+    :rtype: :class:`~.ReportAggregator`
+    """
+    parser = make_parser(filename, stream=stream)
+    if query is not None:
+        parser = QueryParser(parser, query)
+    reporter = Reporter(parser, cache=cache)
+    with open_feed(filename) as fh:
+        reporter.load(fh)
+        return reporter.aggregate(comp=comp, top=top, per_sport=per_sport)
+
+
+def aggregate_files(filenames, comp=None, stream=False, cache=None, jobs=None,
+                    top=None, per_sport=False, query=None):
+    """
+    Aggregate the reports of many stats files across a pool of processes.
+
+    Each worker parses whole files and only sends back their aggregated
+    reports, which are merged in file order.
+
+    :param filenames: Names of the stats files.
+    :type filenames: iterable of :class:`str`
+    :param comp: Competition name to collect market prices for.
+    :type comp: :class:`str`
+    :param stream: Use an incremental parser.
+    :type stream: :class:`bool`
+    :param cache: Cache of parsed files.
+    :type cache: :class:`~.FeedCache`
+    :param jobs: Number of worker processes, defaults to the number of CPUs.
+        The files are processed in the current process when ``1``.
+    :type jobs: :class:`int`
+    :param top: Number of competitions kept at each end of the market
+        percentage ranking, no ranking is kept if omitted.
+    :type top: :class:`int`
+    :param per_sport: Rank the competitions of every sport separately.
+    :type per_sport: :class:`bool`
+    :param query: Only aggregate the options matching this query.
+    :type query: :class:`~.Query`
+    :returns: Aggregated reports of all the files.
+    :rtype: :class:`~.ReportAggregator`
+    """
+    worker = functools.partial(
+        aggregate_file,
+        comp=comp,
+        stream=stream,
+        cache=cache,
+        top=top,
+        per_sport=per_sport,
+        query=query,
+    )
+
+    aggregator = ReportAggregator(comp=comp, top=top, per_sport=per_sport)
+    if jobs == 1:
+        for each in filenames:
+            aggregator.merge(worker(each))
+        return aggregator
+
+    with futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        for each in pool.map(worker, filenames):
+            aggregator.merge(each)
+    return aggregator
+
+
+def watch_file(filename, callback, comp=None, interval=1.0, iterations=None,
+               query=None):
+    """
+    Watch a stats file and keep its reports up to date as it is rewritten.
+
+    The file is polled every ``interval`` seconds and parsed again when its
+    modification time or size changes. Snapshots that fail to parse, for
+    example while the file is being written, are skipped until the next
+    change.
+
+    :param filename: Name of the stats file.
+    :type filename: :class:`str`
+    :param callback: Called with the :class:`~.IncrementalReport` and the
+        number of added, changed and removed options after every update.
+    :type callback: callable
+    :param comp: Competition name to keep market prices for.
+    :type comp: :class:`str`
+    :param interval: Seconds between polls.
+    :type interval: :class:`float`
+    :param iterations: Stop after this many polls, watch forever if omitted.
+    :type iterations: :class:`int`
+    :param query: Only report on the options matching this query.
+    :type query: :class:`~.Query`
+    :returns: The up to date reports.
+    :rtype: :class:`~.IncrementalReport`
+    """
+    report = IncrementalReport(comp=comp)
+    last = None
+    polls = 0
+
+    while iterations is None or polls < iterations:
+        if polls:
+            time.sleep(interval)
+        polls += 1
+
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            continue
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == last:
+            continue
+
+        try:
+            parser = make_parser(filename)
+            if query is not None:
+                parser = QueryParser(parser, query)
+            with open_feed(filename) as fh:
+                parser.parse(fh)
+        except (ValueError, EOFError, OSError, etree.XMLSyntaxError):
+            continue
+
+        last = signature
+        callback(report, report.update(parser))
+
+    return report
+
+
+#: Start of an option element, but not of the ``<options>`` root.
+OPTION_START = re.compile(br"<option[\s/>]")
+
+#: Start and end tags, leaving out declarations, comments and processing
+#: instructions.
+XML_TAG = re.compile(br"<(/?)([^?!\s/>]+)[^>]*?(/?)>")
+
+
+def split_xml_options(filename, chunks):
+    """
+    Split an XML stats file into byte ranges on ``<option>`` boundaries.
+
+    :param filename: Name of the XML stats file.
+    :type filename: :class:`str`
+    :param chunks: Number of ranges wanted. Fewer are returned when the file
+        does not have enough options.
+    :type chunks: :class:`int`
+    :returns: The prolog preceding the first option, up to and including
+        the start tags wrapping the options, and the ``(start, end)`` ranges
+        of options in document order.
+    :rtype: :class:`tuple` of (:class:`bytes`, :class:`list`)
+    """
+    size = os.path.getsize(filename)
+
+    with open(filename, "rb") as fh:
+        first = _find_option_start(fh, 0)
+        if first is None:
+            return b"", []
+
+        fh.seek(0)
+        prolog = fh.read(first)
+
+        # the options end with the last option element, any wrapping
+        # elements are closed after it.
+        end = _find_options_end(fh, first, size)
+
+        starts = [first]
+        for index in range(1, chunks):
+            target = max(starts[-1] + 1, first + (end - first) * index // chunks)
+            if target >= end:
+                break
+            start = _find_option_start(fh, target)
+            if start is None or start >= end:
+                break
+            if start > starts[-1]:
+                starts.append(start)
+
+    return prolog, list(zip(starts, starts[1:] + [end]))
+
+
+def _find_options_end(fh, first, size):
+    """
+    Return the position following the last option element.
+    """
+    tail = size
+    while tail > first:
+        tail = max(first, tail - CHUNK_SIZE)
+        fh.seek(tail)
+        data = fh.read()
+        starts = list(OPTION_START.finditer(data))
+        if not starts:
+            continue
+        last = starts[-1].start()
+        tag_end = data.find(b">", last)
+        if tag_end > 0 and data[tag_end - 1:tag_end] == b"/":
+            return tail + tag_end + 1
+        close = data.find(b"</option>", last)
+        if close >= 0:
+            return tail + close + len(b"</option>")
+        break
+    return size
+
+
+def _closing_tags(prolog):
+    """
+    Return the end tags of the elements left open by the prolog, innermost
+    first.
+    """
+    opened = []
+    for match in XML_TAG.finditer(prolog):
+        closing, name, empty = match.groups()
+        if closing:
+            if name in opened:
+                del opened[len(opened) - 1 - opened[::-1].index(name):]
+        elif not empty:
+            opened.append(name)
+    return b"".join(b"</" + name + b">" for name in reversed(opened))
+
+
+def _find_option_start(fh, offset):
+    """
+    Return the position of the first option start tag at or after offset.
+    """
+    fh.seek(offset)
+    overlap = b""
+    while True:
+        chunk = fh.read(CHUNK_SIZE)
+        if not chunk:
+            return None
+        data = overlap + chunk
+        match = OPTION_START.search(data)
+        if match is not None:
+            return offset - len(overlap) + match.start()
+        # keep enough of the end so a tag split between reads is found.
+        overlap = data[-8:]
+        offset += len(chunk)
+
+
+def aggregate_xml_range(filename, prolog, start, end, comp=None, top=None,
+                        per_sport=False, query=None):
+    """
+    Parse a range of options of an XML stats file and aggregate its reports.
+
+    :param filename: Name of the XML stats file.
+    :type filename: :class:`str`
+    :param prolog: Content preceding the first option of the file.
+    :type prolog: :class:`bytes`
+    :param start: Offset of the first option of the range.
+    :type start: :class:`int`
+    :param end: Offset following the last option of the range.
+    :type end: :class:`int`
+    :param comp: Competition name to collect market prices for.
+    :type comp: :class:`str`
+    :param top: Number of competitions kept at each end of the market
+        percentage ranking, no ranking is kept if omitted.
+    :type top: :class:`int`
+    :param per_sport: Rank the competitions of every sport separately.
+    :type per_sport: :class:`bool`
+    :param query: Only aggregate the options matching this query.
+    :type query: :class:`~.Query`
+    :returns: Aggregated reports of the range.
+    :rtype: :class:`~.ReportAggregator`
+    """
+    with open(filename, "rb") as fh:
+        fh.seek(start)
+        content = fh.read(end - start)
+
+    # give the options back the elements wrapping them.
+    closing = _closing_tags(prolog)
+
+    parser = XMLParser()
+    if query is not None:
+        parser = QueryParser(parser, query)
+    reporter = Reporter(parser)
+    reporter.load(io.BytesIO(prolog + content + closing))
+    return reporter.aggregate(comp=comp, top=top, per_sport=per_sport)
+
+
+def aggregate_xml_chunks(filename, comp=None, jobs=None, chunks=None,
+                         top=None, per_sport=False, query=None):
+    """
+    Aggregate the reports of a single XML stats file split into chunks
+    parsed by a pool of processes.
+
+    The reports are identical to the ones of a single serial pass.
 
-    def option_count(self):
-        """
-        Return the total amount of options available.
+    :param filename: Name of the XML stats file.
+    :type filename: :class:`str`
+    :param comp: Competition name to collect market prices for.
+    :type comp: :class:`str`
+    :param jobs: Number of worker processes, defaults to the number of CPUs.
+        The chunks are processed in the current process when ``1``.
+    :type jobs: :class:`int`
+    :param chunks: Number of chunks, defaults to the number of workers.
+    :type chunks: :class:`int`
+    :param top: Number of competitions kept at each end of the market
+        percentage ranking, no ranking is kept if omitted.
+    :type top: :class:`int`
+    :param per_sport: Rank the competitions of every sport separately.
+    :type per_sport: :class:`bool`
+    :param query: Only aggregate the options matching this query.
+    :type query: :class:`~.Query`
+    :returns: Aggregated reports of the file.
+    :rtype: :class:`~.ReportAggregator`
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    prolog, ranges = split_xml_options(filename, chunks or jobs)
+    worker = functools.partial(
+        _aggregate_xml_range,
+        filename,
+        prolog,
+        comp=comp,
+        top=top,
+        per_sport=per_sport,
+        query=query,
+    )
 
-        :returns: Total option count.
-        :rtype: :class:`int`
-        """
-        return self.parser.option_count()
+    aggregator = ReportAggregator(comp=comp, top=top, per_sport=per_sport)
+    if jobs == 1:
+        for each in ranges:
+            aggregator.merge(worker(each))
+        return aggregator
 
-    def largest_market_percentage(self):
-        """
-        Return the competition with the larget market percentage.
+    with futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        for each in pool.map(worker, ranges):
+            aggregator.merge(each)
+    return aggregator
 
-        :returns: Competition with the largest market percentage.
-        :rtype: :class:`str`
-        """
-        mp = 0
-        largest = None
-        for each in self.parser.get_competitions():
-            market_price = calc_market_percentage(
-                sel.odds
-                for sel in each.get_selections()
-                if sel.odds > 0
-            )
-            if market_price > mp:
-                largest = each.competition
-                mp = market_price
-        return largest
 
-    def least_market_percentage(self):
-        """
-        Return the competition with the least market percentage.
+def _aggregate_xml_range(filename, prolog, byte_range, comp=None, top=None,
+                         per_sport=False, query=None):
+    return aggregate_xml_range(
+        filename,
+        prolog,
+        byte_range[0],
+        byte_range[1],
+        comp=comp,
+        top=top,
+        per_sport=per_sport,
+        query=query,
+    )
 
-        :returns: Competition with the least market percentage.
-        :rtype: :class:`str`
-        """
-        mp = 100000  # just a random number
-        least = None
-        for each in self.parser.get_competitions():
-            market_price = calc_market_percentage(
-                sel.odds
-                for sel in each.get_selections()
-                if sel.odds > 0
-            )
-            if market_price < mp:
-                least = each.competition
-                mp = market_price
-        return least
 
+def sniff_format(content, content_type=None):
+    """
+    Work out the format of a stats feed held in memory.
 
-    def dump_compentition_market_prices(self, name, fh):
-        """
-        Dump a competitions market prices to a CSV formatted file.
+    :param content: Content of the feed.
+    :type content: :class:`bytes`
+    :param content_type: Media type the feed was sent with, if any.
+    :type content_type: :class:`str`
+    :returns: ``"json"`` or ``"xml"``.
+    :rtype: :class:`str`
+    :raises ValueError: If the format is not supported.
+    """
+    if content_type:
+        media = content_type.split(";")[0].strip().lower()
+        if media.endswith(("/json", "+json")):
+            return "json"
+        if media.endswith(("/xml", "+xml")):
+            return "xml"
 
-        .. note::
+    head = content[:64].lstrip(codecs.BOM_UTF8).lstrip()
+    if head.startswith((b"{", b"[")):
+        return "json"
+    if head.startswith(b"<"):
+        return "xml"
+    raise ValueError("Unsupported feed format")
 
-            CSV fields are:
-            Game,Closes,Name,Calculated Market Percentage
 
-        :param name: Competition name that you are dumping market stats for.
-        :type name: :class:`str`
-        :param fh: Write file handler to write to.
-        :type fh: :class:`file`
-        """
-        fieldnames = [
-            "Game",
-            "Closes",
-            "Name",
-            "Calculated Market Percentage",
-        ]
+#: Reports served by :class:`~.StatsServer`, keyed by request path.
+SERVER_REPORTS = ("options", "summary", "largest", "least", "rank", "comp")
 
-        writer = csv.DictWriter(fh, fieldnames=fieldnames)
-        writer.writeheader()
-        comps = sorted(
-            self.parser.get_competitions_by_name(name),
-            key=lambda x: x.closes
+
+def report_feed(content, fmt, report, params=None):
+    """
+    Parse a stats feed held in memory and generate one of its reports.
+
+    This is the work done by :class:`~.StatsServer` off the event loop.
+
+    :param content: Content of the feed.
+    :type content: :class:`bytes`
+    :param fmt: Format of the feed, ``"json"`` or ``"xml"``.
+    :type fmt: :class:`str`
+    :param report: Report to generate, one of :data:`SERVER_REPORTS`.
+    :type report: :class:`str`
+    :param params: Report parameters, ``name`` for ``comp`` and ``k`` and
+        ``per_sport`` for ``rank``.
+    :type params: :class:`dict`
+    :returns: Media type and body of the report.
+    :rtype: :class:`tuple` of (:class:`str`, :class:`str`)
+    :raises ValueError: If the report or its parameters are invalid.
+    """
+    params = params or {}
+    reporter = Reporter(JSONParser() if fmt == "json" else XMLParser())
+    reporter.load(io.BytesIO(content))
+
+    if report == "options":
+        body = "Available options: {}\n".format(reporter.option_count())
+    elif report == "summary":
+        body = reporter.summary()
+    elif report == "largest":
+        body = "{}\n".format(reporter.largest_market_percentage())
+    elif report == "least":
+        body = "{}\n".format(reporter.least_market_percentage())
+    elif report == "rank":
+        try:
+            k = int(params.get("k", 10))
+        except ValueError:
+            raise ValueError("Invalid ranking size {!r}".format(params["k"]))
+        ranking = reporter.market_rankings(
+            k,
+            per_sport=params.get("per_sport", "") not in ("", "0", "false"),
+        )
+        body = "{}\n{}".format(
+            _format_ranking(
+                "Competitions with the largest market price:",
+                ranking.largest(),
+            ),
+            _format_ranking(
+                "Competitions with the least market price:",
+                ranking.least(),
+            ),
         )
-        for each in comps:
-            market_price = calc_market_percentage(
-                sel.odds
-                for sel in each.get_selections()
-                if sel.odds > 0
+    elif report == "comp":
+        if not params.get("name"):
+            raise ValueError("Missing competition name")
+        fh = io.StringIO()
+        reporter.dump_compentition_market_prices(params["name"], fh)
+        return "text/csv", fh.getvalue()
+    else:
+        raise ValueError("Unknown report {!r}".format(report))
+
+    return "text/plain", body
+
+
+class HTTPError(Exception):
+    """
+    Error answered to a :class:`~.StatsServer` client.
+
+    :param status: HTTP status code.
+    :type status: :class:`int`
+    :param reason: HTTP reason phrase.
+    :type reason: :class:`str`
+    :param message: Body of the response.
+    :type message: :class:`str`
+    """
+    def __init__(self, status, reason, message=None):
+        super(HTTPError, self).__init__(message or reason)
+        self.status = status
+        self.reason = reason
+        self.message = message or reason
+
+
+class StatsServer(object):
+    """
+    Asyncio HTTP server generating the reports of the feeds posted to it.
+
+    Feeds are sent as the body of a ``POST /<report>`` request, where the
+    report is one of :data:`SERVER_REPORTS` and its parameters are passed in
+    the query string, eg: ``POST /comp?name=Super%20Rugby``. The format is
+    taken from the ``Content-Type`` header or sniffed from the body.
+
+    At most ``concurrency`` feeds are read and parsed at once, parsing and
+    reporting run in an executor so the event loop keeps accepting
+    connections. Further requests wait without their body being read, so
+    clients are held back by TCP flow control, and once ``backlog`` of them
+    are waiting new ones are answered with ``503`` straight away.
+
+    :param host: Address to listen on.
+    :type host: :class:`str`
+    :param port: Port to listen on, ``0`` picks a free one.
+    :type port: :class:`int`
+    :param path: Unix socket to listen on instead of a TCP port.
+    :type path: :class:`str`
+    :param concurrency: Maximum number of feeds handled at once.
+    :type concurrency: :class:`int`
+    :param backlog: Maximum number of requests waiting to be handled.
+    :type backlog: :class:`int`
+    :param max_body: Maximum size of a feed in bytes.
+    :type max_body: :class:`int`
+    :param executor: Executor parsing the feeds, defaults to a pool of
+        ``concurrency`` threads.
+    :type executor: :class:`concurrent.futures.Executor`
+    """
+    def __init__(self, host="127.0.0.1", port=0, path=None, concurrency=4,
+                 backlog=64, max_body=256 * 1024 * 1024, executor=None):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.concurrency = concurrency
+        self.backlog = backlog
+        self.max_body = max_body
+        self.executor = executor
+        self.server = None
+        self.semaphore = None
+        self.waiting = 0
+        self._own_executor = executor is None
+
+    async def start(self):
+        """
+        Start listening.
+
+        :returns: Address the server listens on, the socket path or a
+            ``(host, port)`` tuple.
+        """
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        if self.executor is None:
+            self.executor = futures.ThreadPoolExecutor(
+                max_workers=self.concurrency
+            )
+        if self.path is not None:
+            self.server = await asyncio.start_unix_server(
+                self.handle,
+                path=self.path,
             )
-            writer.writerow(
-                {
-                    "Game": each.game,
-                    "Closes": each.closes,
-                    "Name": each.name,
-                    "Calculated Market Percentage": market_price,
-                }
+        else:
+            self.server = await asyncio.start_server(
+                self.handle,
+                host=self.host,
+                port=self.port,
             )
+        return self.address
 
-    def summary(self):
+    @property
+    def address(self):
         """
-        Generate a summary report.
+        Address the server listens on.
+        """
+        if self.path is not None:
+            return self.path
+        return self.server.sockets[0].getsockname()[:2]
 
-        .. note::
+    async def serve_forever(self):
+        """
+        Start listening if needed and serve until cancelled.
+        """
+        if self.server is None:
+            await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
 
-            <Sport Name>
-              <Market Name>: <Total Count>
+    async def close(self):
+        """
+        Stop listening and release the executor.
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self._own_executor and self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
 
-        :returns: A summary report.
-        :rtype: :class:`str`
+    async def handle(self, reader, writer):
         """
-        categories = collections.defaultdict(list)
+        Answer a single request of a client connection.
+        """
+        try:
+            try:
+                content_type, body = await self._handle(reader)
+                await self._respond(writer, 200, "OK", content_type, body)
+            except Exception as err:  # pylint: disable=broad-except
+                if not isinstance(err, HTTPError):
+                    err = HTTPError(500, "Internal Server Error")
+                await self._respond(
+                    writer,
+                    err.status,
+                    err.reason,
+                    "text/plain",
+                    err.message + "\n",
+                )
+                # the body may not have been read, drain what the client
+                # already sent so closing does not reset the connection
+                # before the response is received.
+                if writer.can_write_eof():
+                    writer.write_eof()
+                await self._discard(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _discard(self, reader, timeout=1.0):
+        remaining = self.max_body
+        try:
+            while remaining > 0:
+                chunk = await asyncio.wait_for(
+                    reader.read(min(remaining, CHUNK_SIZE)),
+                    timeout,
+                )
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+        except asyncio.TimeoutError:
+            pass
 
-        for each in self.parser.get_competitions():
-            categories[each.sport].append(each)
+    async def _handle(self, reader):
+        try:
+            line = await reader.readline()
+            method, target, _ = line.decode("latin-1").split(" ", 2)
+        except (ValueError, asyncio.LimitOverrunError):
+            raise HTTPError(400, "Bad Request")
 
-        summary = ""
-        for each in sorted(categories):
-            summary += "{}\n".format(each)
+        headers = {}
+        while True:
+            try:
+                line = await reader.readline()
+            except (ValueError, asyncio.LimitOverrunError):
+                raise HTTPError(400, "Bad Request", "Header line too long")
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
 
-            mn = collections.defaultdict(int)
-            for e in categories[each]:
-                mn[e.name] += 1
+        url = urlparse.urlsplit(target)
+        report = url.path.strip("/")
+        if report not in SERVER_REPORTS:
+            raise HTTPError(404, "Not Found")
+        if method != "POST":
+            raise HTTPError(405, "Method Not Allowed")
+        try:
+            length = int(headers["content-length"])
+        except (KeyError, ValueError):
+            raise HTTPError(411, "Length Required")
+        if length > self.max_body:
+            raise HTTPError(413, "Payload Too Large")
 
-            for k, v in mn.items():
-                summary += "  {}: {}\n".format(k, v)
+        if self.semaphore.locked() and self.waiting >= self.backlog:
+            raise HTTPError(503, "Service Unavailable")
 
-        return summary
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        try:
+            content = await reader.readexactly(length)
+            try:
+                fmt = sniff_format(content, headers.get("content-type"))
+            except ValueError as err:
+                raise HTTPError(415, "Unsupported Media Type", str(err))
+            params = dict(urlparse.parse_qsl(url.query))
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(
+                    self.executor,
+                    report_feed,
+                    content,
+                    fmt,
+                    report,
+                    params,
+                )
+            except (ValueError, etree.XMLSyntaxError) as err:
+                raise HTTPError(400, "Bad Request", str(err))
+            except (AttributeError, KeyError, TypeError) as err:
+                # well-formed documents which are not shaped like a feed.
+                raise HTTPError(
+                    400,
+                    "Bad Request",
+                    "Malformed feed: {}".format(err),
+                )
+        finally:
+            self.semaphore.release()
+
+    @staticmethod
+    async def _respond(writer, status, reason, content_type, body):
+        body = body.encode("utf-8")
+        writer.write(
+            "HTTP/1.1 {} {}\r\n"
+            "Content-Type: {}; charset=utf-8\r\n"
+            "Content-Length: {}\r\n"
+            "Connection: close\r\n\r\n".format(
+                status,
+                reason,
+                content_type,
+                len(body),
+            ).encode("latin-1") + body
+        )
+        await writer.drain()
 
 
 if __name__ == "__main__":  # pragma: no cover
     import argparse
-    import os
-    import sys
 
     args = argparse.ArgumentParser(
         description="Generate a stat reports."
     )
 
     args.add_argument(
-        "filename",
+        "filenames",
         metavar="FILENAME",
-        type=argparse.FileType(),
-        help="File containing statics. Supported files as JSON and XML."
+        nargs="*",
+        help="File containing statics. Supported files as JSON and XML. "
+             "When several files, directories or glob patterns are given "
+             "the reports cover all the files."
     )
 
     args.add_argument(
@@ -424,6 +4907,44 @@ if __name__ == "__main__":  # pragma: no cover
              "be given for dump to work."
     )
 
+    args.add_argument(
+        "--dump-all",
+        metavar="FILENAME",
+        help="File to dump the market prices of every competition to, "
+             "ordered by closing time."
+    )
+
+    args.add_argument(
+        "--dump-all-dir",
+        metavar="DIRECTORY",
+        help="Directory to dump the market prices of every competition to, "
+             "one file per competition."
+    )
+
+    args.add_argument(
+        "--export",
+        metavar="FILENAME",
+        help="File to export the competitions and their market percentages "
+             "to in a typed columnar format, which can be given back as "
+             "FILENAME when named *{}.".format(EXPORT_SUFFIX)
+    )
+
+    args.add_argument(
+        "--diff",
+        metavar="OLD",
+        help="Compare FILENAME to the previous snapshot OLD of the feed and "
+             "write the added, removed and changed options and selections "
+             "to stdout as CSV."
+    )
+
+    args.add_argument(
+        "--sort-buffer",
+        metavar="ROWS",
+        type=int,
+        help="Number of rows sorted in memory by --dump-all, "
+             "--dump-all-dir and --diff before spilling to temporary files."
+    )
+
     args.add_argument(
         "--comp",
         metavar="NAME",
@@ -454,45 +4975,507 @@ if __name__ == "__main__":  # pragma: no cover
         help="Show the markets with the largest market percentage"
     )
 
+    args.add_argument(
+        "--rank",
+        metavar="K",
+        type=int,
+        help="Show the K competitions with the largest and the K with the "
+             "least market percentage."
+    )
+
+    args.add_argument(
+        "--per-sport",
+        action="store_true",
+        help="Rank the competitions of every sport separately with --rank."
+    )
+
+    args.add_argument(
+        "--stream",
+        action="store_true",
+        help="Parse the file incrementally instead of loading it into "
+             "memory as a whole."
+    )
+
+    args.add_argument(
+        "--mmap",
+        action="store_true",
+        help="Memory map the file and parse it in place instead of reading "
+             "it through a file handler."
+    )
+
+    args.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Keep the parsed competitions in a compact columnar store. "
+             "Only supports a single file."
+    )
+
+    args.add_argument(
+        "--cache",
+        metavar="DIRECTORY",
+        help="Directory used to cache parsed files between runs."
+    )
+
+    args.add_argument(
+        "--cache-size",
+        metavar="MB",
+        type=int,
+        default=512,
+        help="Maximum size of the cache in megabytes."
+    )
+
+    args.add_argument(
+        "--jobs",
+        metavar="N",
+        type=int,
+        help="Number of processes used when several files are given. "
+             "Defaults to the number of CPUs."
+    )
+
+    args.add_argument(
+        "--split",
+        action="store_true",
+        help="Split a single XML file into chunks parsed by --jobs "
+             "processes."
+    )
+
+    args.add_argument(
+        "--serve",
+        metavar="ADDRESS",
+        help="Serve the reports of the feeds posted over HTTP instead of "
+             "reading files. ADDRESS is [HOST:]PORT or the path of a unix "
+             "socket."
+    )
+
+    args.add_argument(
+        "--concurrency",
+        metavar="N",
+        type=int,
+        default=4,
+        help="Maximum number of feeds parsed at once by --serve."
+    )
+
+    args.add_argument(
+        "--where",
+        metavar="FIELD=VALUE",
+        action="append",
+        default=[],
+        help="Only report on the options whose FIELD is VALUE, eg: "
+             "sport=Football. Can be given several times, values of the "
+             "same field match any of them."
+    )
+
+    args.add_argument(
+        "--closes-after",
+        metavar="TIME",
+        help="Only report on the options closing at or after TIME, eg: "
+             "'2016-04-20 06:00:00'."
+    )
+
+    args.add_argument(
+        "--closes-before",
+        metavar="TIME",
+        help="Only report on the options closing before TIME."
+    )
+
+    args.add_argument(
+        "--odds-min",
+        metavar="ODDS",
+        type=int,
+        help="Only report on the options with a selection of at least ODDS."
+    )
+
+    args.add_argument(
+        "--odds-max",
+        metavar="ODDS",
+        type=int,
+        help="Only report on the options with a selection of at most ODDS."
+    )
+
+    args.add_argument(
+        "--validate",
+        action="store_true",
+        help="Check every option against the schema before generating the "
+             "reports and stop at the first invalid one."
+    )
+
+    args.add_argument(
+        "--skip-invalid",
+        action="store_true",
+        help="Leave the options not matching the schema out of the reports "
+             "instead of stopping."
+    )
+
+    args.add_argument(
+        "--quarantine",
+        metavar="FILENAME",
+        help="File to write the options skipped by --skip-invalid to, as "
+             "JSON lines. Implies --skip-invalid."
+    )
+
+    args.add_argument(
+        "--profile",
+        metavar="FILENAME",
+        nargs="?",
+        const="-",
+        help="Time the stages of the reports and write the profile to "
+             "FILENAME as JSON, or print it to stderr when FILENAME is "
+             "omitted. Only supports a single file."
+    )
+
+    args.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Also trace the peak Python allocations with --profile."
+    )
+
+    args.add_argument(
+        "--watch",
+        metavar="SECONDS",
+        nargs="?",
+        type=float,
+        const=1.0,
+        help="Keep watching the file and output the refreshed reports "
+             "every time it changes. Polls every second by default."
+    )
+
     ns = args.parse_args()
 
     if ns.comp_dump and not ns.comp:
         print("Missing `--comp` argument.")
         sys.exit(os.EX_USAGE)
 
+    if ns.rank is not None and ns.rank < 1:
+        print("`--rank` must be at least 1.")
+        sys.exit(os.EX_USAGE)
+
+    if ns.serve is not None:
+        host, _, port = ns.serve.rpartition(":")
+        if port.isdigit():
+            server = StatsServer(
+                host=host or "127.0.0.1",
+                port=int(port),
+                concurrency=ns.concurrency,
+            )
+        else:
+            server = StatsServer(path=ns.serve, concurrency=ns.concurrency)
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    if not ns.filenames:
+        args.error("at least one FILENAME is required")
+
+    filenames = expand_filenames(ns.filenames)
+    if not filenames:
+        print("No files found for {}".format(" ".join(ns.filenames)))
+        sys.exit(os.EX_NOINPUT)
+
+    if (ns.dump_all or ns.dump_all_dir or ns.export) and (
+        len(filenames) != 1 or ns.watch is not None or ns.split
+    ):
+        print(
+            "--dump-all, --dump-all-dir and --export only support a single "
+            "file."
+        )
+        sys.exit(os.EX_USAGE)
+
+    if ns.columnar and (
+        len(filenames) != 1 or ns.watch is not None or ns.split
+    ):
+        print("--columnar only supports a single file.")
+        sys.exit(os.EX_USAGE)
+
+    # the options below would otherwise be ignored by the other modes.
+    if ns.mmap and (
+        len(filenames) != 1 or ns.split or
+        ns.watch is not None or ns.diff is not None
+    ):
+        args.error(
+            "--mmap only supports a single file, without --split, --watch "
+            "or --diff"
+        )
+
+    if ns.cache and (ns.split or ns.watch is not None or ns.diff is not None):
+        args.error("--cache cannot be used with --split, --watch or --diff")
+
+    query = None
+    if (
+        ns.where or ns.closes_after or ns.closes_before or
+        ns.odds_min is not None or ns.odds_max is not None
+    ):
+        try:
+            query = Query.parse(
+                ns.where,
+                closes_after=ns.closes_after,
+                closes_before=ns.closes_before,
+                odds_min=ns.odds_min,
+                odds_max=ns.odds_max,
+            )
+        except ValueError as err:
+            print(err)
+            sys.exit(os.EX_USAGE)
+
+    errors = None
+    if ns.skip_invalid or ns.quarantine:
+        errors = "skip"
+    elif ns.validate:
+        errors = "strict"
+    if errors is not None and (
+        len(filenames) != 1 or ns.watch is not None or ns.split
+    ):
+        print(
+            "--validate, --skip-invalid and --quarantine only support a "
+            "single file."
+        )
+        sys.exit(os.EX_USAGE)
+
+    profiler = None
+    if ns.profile is not None:
+        if len(filenames) != 1 or ns.watch is not None or ns.split:
+            print("--profile only supports a single file.")
+            sys.exit(os.EX_USAGE)
+        profiler = Profiler(memory=ns.profile_memory)
+
+    quarantine = None
+    if ns.quarantine:
+        quarantine = open(ns.quarantine, "w")
+
     # work out what type of parser we need to use.
-    if ns.filename.name.endswith(".json"):
-        parser = JSONParser()
-    elif ns.filename.name.endswith(".xml"):
-        parser = XMLParser()
-    else:
-        print("Unsupported file format for {!r}".format(ns.filename.name))
+    try:
+        parsers = [
+            make_parser(
+                each,
+                stream=ns.stream,
+                errors=errors,
+                quarantine=quarantine,
+            )
+            for each in filenames
+        ]
+    except ValueError as err:
+        print(err)
         sys.exit(os.EX_DATAERR)
 
-    reporter = Reporter(parser=parser)
-    reporter.load(ns.filename)
+    # only plain XML files can be split on byte ranges.
+    if ns.split:
+        if len(filenames) != 1 or not isinstance(parsers[0], XMLParser):
+            args.error("--split only supports a single XML file")
+        with open(filenames[0], "rb") as fh:
+            if sniff_compression(fh.read(8)) is not None:
+                args.error("--split does not support compressed files")
 
-    # bump market stats
-    if ns.comp and ns.comp_dump:
-        reporter.dump_compentition_market_prices(ns.comp, ns.comp_dump)
+    cache = None
+    if ns.cache:
+        cache = FeedCache(ns.cache, max_size=ns.cache_size * 1024 * 1024)
 
-    # Print out the option count.
-    if ns.options is True:
-        print("Available options: {}".format(reporter.option_count()))
+    def print_reports(reporter):
+        """
+        Output all the requested reports.
+        """
+        # bump market stats
+        if ns.comp and ns.comp_dump:
+            reporter.dump_compentition_market_prices(ns.comp, ns.comp_dump)
 
-    if ns.largest_market_percentage is True:
-        print(
-            "Competition with the largest market price: {}".format(
-                reporter.largest_market_percentage()
+        # Print out the option count.
+        if ns.options is True:
+            print("Available options: {}".format(reporter.option_count()))
+
+        if ns.largest_market_percentage is True:
+            print(
+                "Competition with the largest market price: {}".format(
+                    reporter.largest_market_percentage()
+                )
+            )
+
+        if ns.least_market_percentage is True:
+            print(
+                "Competition with the least market price: {}".format(
+                    reporter.least_market_percentage()
+                )
+            )
+
+        if ns.rank is not None:
+            ranking = reporter.market_rankings(ns.rank, per_sport=ns.per_sport)
+            print(
+                _format_ranking(
+                    "Competitions with the largest market price:",
+                    ranking.largest(),
+                )
+            )
+            print(
+                _format_ranking(
+                    "Competitions with the least market price:",
+                    ranking.least(),
+                )
             )
+
+        if ns.summary is True:
+            reporter.write_summary(sys.stdout)
+            print()
+
+    if ns.diff is not None:
+        if len(filenames) != 1 or ns.watch is not None or ns.split:
+            print("--diff only supports a single file.")
+            sys.exit(os.EX_USAGE)
+
+        # both snapshots are streamed, only the sort buffer is kept in
+        # memory. They are only decoded while the changes are written, so
+        # a broken snapshot can stop the CSV part way.
+        with contextlib.ExitStack() as stack:
+            try:
+                snapshots = []
+                for filename in [ns.diff, filenames[0]]:
+                    snapshot = make_parser(
+                        filename,
+                        stream=True,
+                        errors=errors,
+                        quarantine=quarantine,
+                    )
+                    snapshot.parse(stack.enter_context(open_feed(filename)))
+                    if query is not None:
+                        snapshot = QueryParser(snapshot, query)
+                    snapshots.append(snapshot)
+
+                counts = write_diff(
+                    sys.stdout,
+                    *snapshots,
+                    buffer_rows=ns.sort_buffer
+                )
+            except IOError as err:
+                sys.stdout.flush()
+                sys.stderr.write("{}\n".format(err))
+                sys.exit(os.EX_NOINPUT)
+            except (ValueError, EOFError, etree.XMLSyntaxError) as err:
+                sys.stdout.flush()
+                sys.stderr.write("{}\n".format(err))
+                sys.exit(os.EX_DATAERR)
+
+        if quarantine is not None:
+            quarantine.close()
+        sys.stderr.write(
+            "{} added, {} changed, {} removed options.\n".format(*counts)
         )
+        sys.exit(0)
 
-    if ns.least_market_percentage is True:
-        print(
-            "Competition with the least market price: {}".format(
-                reporter.least_market_percentage()
+    if ns.watch is not None:
+        if len(filenames) != 1:
+            print("--watch only supports a single file.")
+            sys.exit(os.EX_USAGE)
+
+        def on_update(report, changes):
+            """
+            Output the refreshed reports after an update of the file.
+            """
+            print(
+                "== {}: {} added, {} changed, {} removed".format(
+                    time.strftime("%Y-%m-%d %H:%M:%S"),
+                    *changes
+                )
+            )
+            if ns.comp and ns.comp_dump:
+                ns.comp_dump.seek(0)
+                ns.comp_dump.truncate()
+            print_reports(report)
+            if ns.comp_dump:
+                ns.comp_dump.flush()
+            sys.stdout.flush()
+
+        try:
+            watch_file(
+                filenames[0],
+                on_update,
+                comp=ns.comp,
+                interval=ns.watch,
+                query=query,
             )
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    if ns.split:
+        reporter = aggregate_xml_chunks(
+            filenames[0],
+            comp=ns.comp,
+            jobs=ns.jobs,
+            top=ns.rank,
+            per_sport=ns.per_sport,
+            query=query,
+        )
+    elif len(filenames) > 1:
+        reporter = aggregate_files(
+            filenames,
+            comp=ns.comp,
+            stream=ns.stream,
+            cache=cache,
+            jobs=ns.jobs,
+            top=ns.rank,
+            per_sport=ns.per_sport,
+            query=query,
         )
+    else:
+        parser = parsers[0]
+        if query is not None:
+            parser = QueryParser(parser, query)
+        if ns.columnar:
+            parser = CompetitionStore(parser=parser)
+
+        reporter = Reporter(parser=parser, cache=cache, profiler=profiler)
+        try:
+            # the streaming parsers read the file again for every report,
+            # so it is left open until the process exits.
+            if ns.mmap:
+                reporter.load(map_file(filenames[0]))
+            else:
+                reporter.load(open_feed(filenames[0]))
+        except IOError as err:
+            print(err)
+            sys.exit(os.EX_NOINPUT)
+        except RecordError as err:
+            print(err)
+            sys.exit(os.EX_DATAERR)
+
+        if quarantine is not None:
+            quarantine.close()
+        if parsers[0].skipped:
+            sys.stderr.write(
+                "Skipped {} invalid options.\n".format(parsers[0].skipped)
+            )
+
+        if ns.dump_all:
+            with open(ns.dump_all, "w", newline="") as fh:
+                reporter.dump_market_prices(fh, buffer_rows=ns.sort_buffer)
+        if ns.dump_all_dir:
+            reporter.dump_market_prices_by_competition(
+                ns.dump_all_dir,
+                buffer_rows=ns.sort_buffer,
+            )
+        if ns.export:
+            with open(ns.export, "wb") as fh:
+                reporter.export(fh)
+
+        # when several reports are requested generate them all in one pass.
+        requested = [
+            ns.comp and ns.comp_dump,
+            ns.options,
+            ns.largest_market_percentage,
+            ns.least_market_percentage,
+            ns.rank,
+            ns.summary,
+        ]
+        if len([each for each in requested if each]) > 1:
+            reporter = reporter.aggregate(
+                comp=ns.comp,
+                top=ns.rank,
+                per_sport=ns.per_sport,
+            )
+
+    print_reports(reporter)
 
-    if ns.summary is True:
-        print(reporter.summary())
+    if profiler is not None:
+        if ns.profile == "-":
+            sys.stderr.write(profiler.format())
+        else:
+            with open(ns.profile, "w") as fh:
+                profiler.dump(fh)
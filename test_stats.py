@@ -1,5 +1,13 @@
+import asyncio
+import bench_stats
+import codecs
+import importlib
+import io
+import json
 import os
+import shutil
 import stats
+import tempfile
 import unittest
 import lxml.etree
 
@@ -66,9 +74,63 @@ class TestFunctions(unittest.TestCase):
             ),
         )
 
+    def test_abstract_parsers(self):
+        for cls in [stats.IStatsParser, stats.IndexedStatsParser]:
+            with self.assertRaises(TypeError):
+                cls()
+
+        class Partial(stats.IndexedStatsParser):
+            def parse(self, fh):
+                pass
+
+            def option_count(self):
+                return 0
+
+            def get_competitions(self):
+                return []
+
+            def make_competition(self, record):
+                return record
+
+        with self.assertRaises(TypeError):
+            Partial()
+
+    def test_calc_market_percentages(self):
+        sets = [
+            [1.95, 2.05],
+            [],
+            [1.30, 7.90, 14.65, 5.90, 33.20],
+            [250, 0, -1, 310],
+            [],
+        ]
+        prices = [price for each in sets for price in each]
+        offsets = [0]
+        for each in sets:
+            offsets.append(offsets[-1] + len(each))
+        expected = [
+            stats.calc_market_percentage(p for p in each if p > 0)
+            for each in sets
+        ]
+
+        self.assertEqual(
+            expected,
+            list(stats.calc_market_percentages(prices, offsets)),
+        )
+
+        got = stats.calc_market_percentages(prices, offsets, exact=False)
+        self.assertEqual(len(expected), len(got))
+        for a, b in zip(expected, got):
+            self.assertAlmostEqual(a, b, places=12)
+
+        self.assertEqual([], list(stats.calc_market_percentages([], [0])))
 
 
 class TestJSONParser(unittest.TestCase):
+    SINGLE_OPTION = (
+        '{"options": {"option": [{"number": "1", '
+        '"competition": "Super Rugby"}]}}'
+    )
+
     def setUp(self):
         self.parser = stats.JSONParser()
         with open(JSONFILE) as fh:
@@ -83,6 +145,13 @@ class TestJSONParser(unittest.TestCase):
         self.assertIsNotNone(self.parser.data)
         self.assertIsInstance(self.parser.data, dict)
 
+    def test_parse_rebuilds_index(self):
+        self.parser.parse(StringIO(self.SINGLE_OPTION))
+        self.assertEqual(
+            1,
+            len(list(self.parser.get_competitions_by_name("Super Rugby"))),
+        )
+
     def test_option_count(self):
         # based on the sample output.json
         self.assertEqual(543, self.parser.option_count())
@@ -99,6 +168,46 @@ class TestJSONParser(unittest.TestCase):
             stats.Competition,
         )
 
+    def test_get_competitions_by(self):
+        # based on the sample output.json
+        self.assertEqual(
+            76,
+            len(list(self.parser.get_competitions_by("sport", "Tennis"))),
+        )
+        self.assertEqual(
+            6,
+            len(list(self.parser.get_competitions_by("venue", "Dunedin"))),
+        )
+        # not an indexed attribute
+        self.assertEqual(
+            8,
+            len(list(self.parser.get_competitions_by("name", "Tri-Bet"))),
+        )
+        self.assertEqual(
+            [],
+            list(self.parser.get_competitions_by("sport", "Curling")),
+        )
+
+    def test_get_competitions_by_closes(self):
+        # based on the sample output.json
+        comps = list(
+            self.parser.get_competitions_by_closes(
+                "2016-04-22 19:35:00",
+                "2016-04-23 00:00:00",
+            )
+        )
+        self.assertEqual(53, len(comps))
+        self.assertEqual(
+            sorted(each.closes for each in comps),
+            [each.closes for each in comps],
+        )
+        self.assertEqual("2016-04-22 19:35:00", comps[0].closes)
+
+        self.assertEqual(
+            543,
+            len(list(self.parser.get_competitions_by_closes())),
+        )
+
     def test_get_competitions(self):
         # based on the sample output.json
         self.assertEqual(
@@ -112,7 +221,80 @@ class TestJSONParser(unittest.TestCase):
         )
 
 
+class TestJSONStreamParser(TestJSONParser):
+    def setUp(self):
+        self.fh = open(JSONFILE)
+        self.parser = stats.JSONStreamParser()
+        self.parser.parse(self.fh)
+
+    def tearDown(self):
+        self.fh.close()
+
+    def test_parse(self):
+        self.assertIs(self.fh, self.parser.data)
+
+    def test_parse_binary_file(self):
+        with open(JSONFILE, "rb") as fh:
+            self.parser.parse(fh)
+            self.assertEqual(543, self.parser.option_count())
+
+    def test_small_chunks(self):
+        chunk_size = stats.CHUNK_SIZE
+        stats.CHUNK_SIZE = 7
+        try:
+            self.assertEqual(543, self.parser.option_count())
+        finally:
+            stats.CHUNK_SIZE = chunk_size
+
+    def test_matches_json_parser(self):
+        parser = stats.JSONParser()
+        with open(JSONFILE) as fh:
+            parser.parse(fh)
+
+        expected = [
+            (c.number, c.name, [(s.number, s.odds) for s in c.get_selections()])
+            for c in parser.get_competitions()
+        ]
+        got = [
+            (c.number, c.name, [(s.number, s.odds) for s in c.get_selections()])
+            for c in self.parser.get_competitions()
+        ]
+        self.assertEqual(expected, got)
+
+    def test_skips_other_keys(self):
+        self.parser.parse(
+            StringIO(
+                '{"meta": {"x": [1, 2]}, "options": {"count": 12, '
+                '"option": [{"number": "1"}, {"number": "2"}]}}'
+            )
+        )
+        self.assertEqual(
+            [1, 2],
+            [c.number for c in self.parser.get_competitions()],
+        )
+
+    def test_missing_options(self):
+        self.parser.parse(StringIO('{"other": []}'))
+        self.assertEqual(0, self.parser.option_count())
+
+    def test_reporter(self):
+        reporter = stats.Reporter(parser=self.parser)
+        self.assertEqual("Super Rugby", reporter.largest_market_percentage())
+        self.assertEqual(
+            "NBA Playoffs-Rd 1 Series",
+            reporter.least_market_percentage(),
+        )
+        self.assertEqual(
+            make_json_loaded_reporter().summary(),
+            reporter.summary(),
+        )
+
+
 class TestXMLParser(TestJSONParser):
+    SINGLE_OPTION = (
+        '<options><option number="1" competition="Super Rugby"/></options>'
+    )
+
     def setUp(self):
         self.parser = stats.XMLParser()
         with open(XMLFILE) as fh:
@@ -130,6 +312,471 @@ class TestXMLParser(TestJSONParser):
             lxml.etree._Element,
         )
 
+    def test_nested_options(self):
+        parser = stats.XMLParser()
+        parser.parse_buffer(
+            b"<feed><options>"
+            b'<option number="1"><selections>'
+            b'<selection number="1" odds="200"/>'
+            b"</selections></option>"
+            b'<option number="2"/>'
+            b"</options></feed>"
+        )
+        self.assertEqual(2, parser.option_count())
+        self.assertEqual(
+            [1, 2],
+            [each.number for each in parser.get_competitions()],
+        )
+        self.assertEqual(
+            [200],
+            [
+                each.odds
+                for each in next(parser.get_competitions()).get_selections()
+            ],
+        )
+
+
+class TestXMLStreamParser(TestJSONParser):
+    SINGLE_OPTION = (
+        '<options><option number="1" competition="Super Rugby"/></options>'
+    )
+
+    def setUp(self):
+        self.fh = open(XMLFILE, "rb")
+        self.parser = stats.XMLStreamParser()
+        self.parser.parse(self.fh)
+
+    def tearDown(self):
+        self.fh.close()
+
+    def test_parse(self):
+        self.assertIs(self.fh, self.parser.data)
+
+    def test_parse_text_file(self):
+        with open(XMLFILE) as fh:
+            self.parser.parse(fh)
+            self.assertEqual(543, self.parser.option_count())
+
+    def test_matches_xml_parser(self):
+        parser = stats.XMLParser()
+        with open(XMLFILE) as fh:
+            parser.parse(fh)
+
+        expected = [
+            (c.number, c.name, [(s.number, s.odds) for s in c.get_selections()])
+            for c in parser.get_competitions()
+        ]
+        got = [
+            (c.number, c.name, [(s.number, s.odds) for s in c.get_selections()])
+            for c in self.parser.get_competitions()
+        ]
+        self.assertEqual(expected, got)
+
+    def test_elements_are_cleared(self):
+        for each in self.parser.iter_options():
+            self.assertIsNone(each.getprevious())
+
+
+class TestCompetitionStore(TestJSONParser):
+    def setUp(self):
+        self.parser = stats.CompetitionStore(parser=stats.JSONParser())
+        with open(JSONFILE) as fh:
+            self.parser.parse(fh)
+
+    def test_parse(self):
+        self.assertIsNone(self.parser.parser.data)
+        self.assertEqual(543, len(self.parser.data["number"]))
+
+    def test_get_competitions_by_unknown_name(self):
+        self.assertEqual(
+            [],
+            list(self.parser.get_competitions_by_name("Unknown")),
+        )
+
+    def test_round_trip(self):
+        parser = stats.JSONParser()
+        with open(JSONFILE) as fh:
+            parser.parse(fh)
+
+        for expected, got in zip(
+            parser.get_competitions(),
+            self.parser.get_competitions(),
+        ):
+            self.assertEqual(
+                (
+                    expected.venue,
+                    expected.competition,
+                    expected.closes,
+                    expected.name,
+                    expected.number,
+                    expected.sport,
+                    expected.game,
+                ),
+                (
+                    got.venue,
+                    got.competition,
+                    got.closes,
+                    got.name,
+                    got.number,
+                    got.sport,
+                    got.game,
+                ),
+            )
+            self.assertEqual(
+                [
+                    (s.number, s.name, s.odds, s.status)
+                    for s in expected.get_selections()
+                ],
+                [
+                    (s.number, s.name, s.odds, s.status)
+                    for s in got.get_selections()
+                ],
+            )
+
+    def test_market_percentages(self):
+        expected = [
+            each.market_percentage()
+            for each in self.parser.get_competitions()
+        ]
+        got = self.parser.market_percentages()
+
+        self.assertEqual(expected, list(got))
+
+        got = self.parser.market_percentages(exact=False)
+        self.assertEqual(len(expected), len(got))
+        for a, b in zip(expected, got):
+            self.assertAlmostEqual(a, b, places=12)
+
+    def test_market_percentages_empty_selections(self):
+        store = stats.CompetitionStore()
+        comps = []
+        for number, odds in enumerate([[], [200, 0, 400], []]):
+            comp = stats.Competition(
+                venue="Dunedin",
+                competition="Super Rugby",
+                closes="2016-04-22 19:35:00",
+                name="Tri-Bet",
+                number=number,
+                sport="Rugby Union",
+                game="Highlanders v Sharks",
+            )
+            for i, price in enumerate(odds):
+                comp.add_selection(stats.Selection(i, "x", price, "OK"))
+            comps.append(comp)
+        store.extend(comps)
+
+        self.assertEqual(
+            [0.0, 0.0075, 0.0],
+            list(store.market_percentages()),
+        )
+
+    def test_reporter(self):
+        expected = make_json_loaded_reporter()
+        reporter = stats.Reporter(parser=self.parser)
+
+        self.assertEqual(
+            expected.largest_market_percentage(),
+            reporter.largest_market_percentage(),
+        )
+        self.assertEqual(
+            expected.least_market_percentage(),
+            reporter.least_market_percentage(),
+        )
+        self.assertEqual(expected.summary(), reporter.summary())
+
+    def test_dump_from_buffer(self):
+        fh = io.BytesIO()
+        self.parser.dump(fh)
+        store = stats.CompetitionStore.from_buffer(fh.getvalue())
+
+        self.assertEqual(543, store.option_count())
+        self.assertEqual(
+            list(self.parser.market_percentages()),
+            list(store.market_percentages()),
+        )
+        self.assertEqual(
+            69,
+            len(list(store.get_competitions_by_name("Super Rugby"))),
+        )
+
+    def test_from_buffer_invalid(self):
+        fh = io.BytesIO()
+        self.parser.dump(fh)
+        content = fh.getvalue()
+
+        for buffer in [b"", b"garbage" * 10, content[:len(content) // 2]]:
+            with self.assertRaises(ValueError):
+                stats.CompetitionStore.from_buffer(buffer)
+
+
+class TestMapFile(unittest.TestCase):
+    def test_parsers(self):
+        for filename, parsers in [
+            (JSONFILE, [stats.JSONParser, stats.JSONStreamParser]),
+            (XMLFILE, [stats.XMLParser, stats.XMLStreamParser]),
+        ]:
+            for parser in parsers:
+                reporter = stats.Reporter(parser())
+                reporter.load(stats.map_file(filename))
+                self.assertEqual(543, reporter.option_count())
+                self.assertEqual(
+                    "Super Rugby",
+                    reporter.largest_market_percentage(),
+                )
+
+    def test_bytes(self):
+        with open(JSONFILE, "rb") as fh:
+            content = fh.read()
+        reporter = stats.Reporter(stats.JSONParser())
+        reporter.load(codecs.BOM_UTF8 + content)
+        self.assertEqual(543, reporter.option_count())
+
+        store = stats.CompetitionStore(parser=stats.XMLStreamParser())
+        with open(XMLFILE, "rb") as fh:
+            store.parse_buffer(fh.read())
+        self.assertEqual(543, store.option_count())
+
+    def test_empty_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "empty.json")
+            open(filename, "w").close()
+            self.assertEqual(b"", stats.map_file(filename))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_cache_key(self):
+        parser = stats.JSONParser()
+        with open(JSONFILE, "rb") as fh:
+            expected = stats.FeedCache.key(fh, parser)
+        self.assertEqual(
+            expected,
+            stats.FeedCache.key(stats.map_file(JSONFILE), parser),
+        )
+        with open(JSONFILE, "rb") as fh:
+            self.assertEqual(
+                expected,
+                stats.FeedCache.key(fh.read(), parser),
+            )
+
+
+class TestColumnarExport(unittest.TestCase):
+    def setUp(self):
+        self.reporter = make_json_loaded_reporter()
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "options.stx")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def export(self, chunk_rows):
+        with open(self.filename, "wb") as fh:
+            self.reporter.export(fh, chunk_rows=chunk_rows)
+        reporter = stats.Reporter(stats.make_parser(self.filename))
+        with open(self.filename, "rb") as fh:
+            reporter.load(fh)
+        return reporter
+
+    def test_round_trip(self):
+        for chunk_rows in [1000, 100, 1]:
+            reporter = self.export(chunk_rows)
+            self.assertEqual(
+                -(-543 // chunk_rows),
+                len(reporter.parser.chunks),
+            )
+            self.assertEqual(543, reporter.option_count())
+            self.assertEqual(self.reporter.summary(), reporter.summary())
+            self.assertEqual(
+                [
+                    (each.number, each.market_percentage())
+                    for each in self.reporter.parser.get_competitions()
+                ],
+                [
+                    (each.number, market_price)
+                    for each, market_price
+                    in reporter.parser.iter_market_percentages()
+                ],
+            )
+
+            expected = StringIO()
+            self.reporter.dump_compentition_market_prices(
+                "Super Rugby",
+                expected,
+            )
+            got = StringIO()
+            reporter.dump_compentition_market_prices("Super Rugby", got)
+            self.assertEqual(expected.getvalue(), got.getvalue())
+
+    def test_batched_appends(self):
+        comps = list(self.reporter.parser.get_competitions())
+        fh = io.BytesIO()
+        with stats.ColumnarWriter(fh, chunk_rows=50) as writer:
+            writer.append((each, None) for each in comps[:120])
+            writer.append((each, None) for each in comps[120:])
+        self.assertEqual(11, len(writer.chunks))
+
+        parser = stats.ColumnarReader()
+        parser.parse_buffer(fh.getvalue())
+        self.assertEqual(543, parser.option_count())
+        self.assertEqual(
+            69,
+            len(list(parser.get_competitions_by_name("Super Rugby"))),
+        )
+
+    def test_failed_export(self):
+        comps = list(self.reporter.parser.get_competitions())
+        fh = io.BytesIO()
+        with self.assertRaises(KeyError):
+            with stats.ColumnarWriter(fh, chunk_rows=50) as writer:
+                writer.append((each, None) for each in comps[:120])
+                raise KeyError("market")
+        self.assertTrue(writer.closed)
+        with self.assertRaises(ValueError):
+            stats.ColumnarReader().parse_buffer(fh.getvalue())
+
+    def test_empty(self):
+        fh = io.BytesIO()
+        stats.ColumnarWriter(fh).close()
+        parser = stats.ColumnarReader()
+        parser.parse_buffer(fh.getvalue())
+        self.assertEqual(0, parser.option_count())
+        self.assertEqual([], list(parser.get_competitions()))
+
+    def test_invalid(self):
+        fh = io.BytesIO()
+        self.reporter.export(fh)
+        content = fh.getvalue()
+        for buffer in [b"", b"STATSEXP", content[:-1], content[:100]]:
+            with self.assertRaises(ValueError):
+                stats.ColumnarReader().parse_buffer(buffer)
+
+    def test_extra_column_length(self):
+        store = stats.CompetitionStore()
+        store.extend(self.reporter.parser.get_competitions())
+        with self.assertRaises(ValueError):
+            store.dump(io.BytesIO(), extra={"x": [1.0]})
+
+
+class TestFeedCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = stats.FeedCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self):
+        reporter = stats.Reporter(stats.JSONParser(), cache=self.cache)
+        with open(JSONFILE) as fh:
+            reporter.load(fh)
+        return reporter
+
+    def test_miss_then_hit(self):
+        reporter = self.load()
+        self.assertIsInstance(reporter.parser, stats.JSONParser)
+        self.assertEqual(1, len(os.listdir(self.directory)))
+
+        reporter = self.load()
+        self.assertIsInstance(reporter.parser, stats.CompetitionStore)
+        self.assertEqual(543, reporter.option_count())
+        self.assertEqual("Super Rugby", reporter.largest_market_percentage())
+        self.assertEqual(
+            make_json_loaded_reporter().summary(),
+            reporter.summary(),
+        )
+
+    def test_key(self):
+        with open(JSONFILE) as fh:
+            json_key = self.cache.key(fh, stats.JSONParser())
+            self.assertEqual(0, fh.tell())
+        with open(JSONFILE, "rb") as fh:
+            self.assertEqual(json_key, self.cache.key(fh, stats.JSONParser()))
+            self.assertNotEqual(
+                json_key,
+                self.cache.key(fh, stats.JSONStreamParser()),
+            )
+
+    def test_query_key(self):
+        counts = []
+        for where in ["sport=Tennis", "sport=Football", None]:
+            for _ in range(2):
+                parser = stats.JSONParser()
+                if where is not None:
+                    parser = stats.QueryParser(
+                        parser,
+                        stats.Query.parse([where]),
+                    )
+                reporter = stats.Reporter(
+                    stats.CompetitionStore(parser=parser),
+                    cache=self.cache,
+                )
+                with open(JSONFILE) as fh:
+                    reporter.load(fh)
+                counts.append(reporter.option_count())
+        self.assertEqual([76, 76, 208, 208, 543, 543], counts)
+        self.assertEqual(3, len(os.listdir(self.directory)))
+
+    def test_corrupt_entry(self):
+        self.load()
+        path = os.path.join(self.directory, os.listdir(self.directory)[0])
+        with open(path, "r+b") as fh:
+            fh.truncate(100)
+
+        reporter = self.load()
+        self.assertIsInstance(reporter.parser, stats.JSONParser)
+        self.assertEqual(543, reporter.option_count())
+
+        # the corrupt entry has been replaced
+        reporter = self.load()
+        self.assertIsInstance(reporter.parser, stats.CompetitionStore)
+
+    def test_corrupt_columns(self):
+        self.load()
+        path = os.path.join(self.directory, os.listdir(self.directory)[0])
+        with open(path, "rb") as fh:
+            content = fh.read()
+        with open(path, "rb") as fh:
+            store = stats.CompetitionStore.from_buffer(fh.read())
+
+        # an array section which is not a whole number of values.
+        offset = stats.STORE_HEADER.size
+        kind, size, length = stats.STORE_SECTION.unpack_from(content, offset)
+        self.assertEqual(b"q", kind)
+        misaligned = (
+            content[:offset] +
+            stats.STORE_SECTION.pack(kind, size, length - 1) +
+            content[offset + stats.STORE_SECTION.size:]
+        )
+
+        # codes pointing past the end of their string table.
+        store.tables["option.sport"] = store.tables["option.sport"][:1]
+        out_of_table = io.BytesIO()
+        store.dump(out_of_table)
+
+        for corrupt in [misaligned, out_of_table.getvalue()]:
+            with self.assertRaises(ValueError):
+                stats.CompetitionStore.from_buffer(corrupt)
+
+            with open(path, "wb") as fh:
+                fh.write(corrupt)
+            reporter = self.load()
+            self.assertIsInstance(reporter.parser, stats.JSONParser)
+            self.assertEqual(543, reporter.option_count())
+            with open(path, "rb") as fh:
+                self.assertEqual(content, fh.read())
+
+    def test_evict(self):
+        self.load()
+        path = os.path.join(self.directory, os.listdir(self.directory)[0])
+        os.utime(path, (0, 0))
+
+        self.cache.max_size = os.path.getsize(path) + 1
+        self.cache.put("other", stats.CompetitionStore())
+
+        self.assertEqual(
+            ["other" + self.cache.SUFFIX],
+            os.listdir(self.directory),
+        )
 
 
 class TestReporter(unittest.TestCase):
@@ -185,80 +832,1327 @@ class TestReporter(unittest.TestCase):
             fh.readlines()[0].strip(),
         )
 
-    @unittest.skip("Not really testable.")
     def test_summary(self):
-        pass
+        summary = self.reporter.summary()
+        fh = StringIO()
+        self.reporter.write_summary(fh)
+        self.assertEqual(summary, fh.getvalue())
 
-class TestCompetition(unittest.TestCase):
-    def test_add_selection(self):
-        comp = stats.Competition(
-            venue="Dunedin",
-            competition="Super Rugby",
-            closes="2016-04-22 19:35:00",
-            name="Tri-Bet",
-            number=2023,
-            sport="Rugby Union",
-            game="Highlanders v Sharks",
+        sports = []
+        for line in summary.splitlines():
+            if line.startswith(" "):
+                sports[-1][1].append(line.strip().rsplit(": ", 1)[0])
+            else:
+                sports.append((line, []))
+        self.assertEqual(sorted(sports), sports)
+        for _, markets in sports:
+            self.assertEqual(sorted(markets), markets)
+        self.assertEqual(
+            ("Aussie Rules", ["1st Scoring Play"]),
+            (sports[1][0], sports[1][1][:1]),
         )
+        self.assertIn("Aussie Rules\n  1st Scoring Play: 9\n", summary)
 
-        sel = stats.Selection(
-            number=1,
-            name="Highlanders 8 & Over",
-            odds=170,
-            status="OK",
+    def test_summary_shards(self):
+        competitions = list(self.reporter.parser.get_competitions())
+        shards = []
+        for start in range(0, len(competitions), 100):
+            counter = stats.SummaryCounter()
+            for each in competitions[start:start + 100]:
+                counter.add(each.sport, each.name)
+            shards.append(counter)
+
+        merged = stats.SummaryCounter()
+        for each in reversed(shards):
+            merged.merge(each)
+        self.assertEqual(self.reporter.summary(), merged.format())
+
+        counts = self.reporter.summary_counts()
+        self.assertEqual(
+            543,
+            sum(sum(x.values()) for x in counts.categories.values()),
         )
 
-        comp.add_selection(sel)
-        self.assertEqual(1, len(comp.selections))
-        self.assertEqual(set([sel]), comp.selections)
+        fh = StringIO()
+        original = stats.SUMMARY_BUFFER_LINES
+        stats.SUMMARY_BUFFER_LINES = 1
+        try:
+            counts.write(fh)
+        finally:
+            stats.SUMMARY_BUFFER_LINES = original
+        self.assertEqual(self.reporter.summary(), fh.getvalue())
 
-        # no doulbe ups should happen
-        comp.add_selection(sel)
-        self.assertEqual(set([sel]), comp.selections)
 
-    def test_get_selections(self):
-        comp = stats.Competition(
-            venue="Dunedin",
-            competition="Super Rugby",
-            closes="2016-04-22 19:35:00",
-            name="Tri-Bet",
-            number=2023,
-            sport="Rugby Union",
-            game="Highlanders v Sharks",
-        )
+class TestDumpMarketPrices(unittest.TestCase):
+    def setUp(self):
+        self.reporter = make_json_loaded_reporter()
+        self.directory = tempfile.mkdtemp()
 
-        sel1 = stats.Selection(
-            number=1,
-            name="Highlanders 8 & Over",
-            odds=170,
-            status="OK",
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_external_sort(self):
+        rows = [(i % 7, i) for i in range(100)]
+        for buffer_rows in [1, 3, 100, 1000]:
+            self.assertEqual(
+                sorted(rows, key=lambda x: x[0]),
+                list(
+                    stats.external_sort(
+                        rows,
+                        key=lambda x: x[0],
+                        buffer_rows=buffer_rows,
+                    )
+                ),
+            )
+        self.assertEqual([], list(stats.external_sort([], key=len)))
+
+    def test_external_sort_fan_in(self):
+        rows = [(i % 7, i) for i in range(500)]
+        spill = stats._spill
+        open_runs = set()
+        most = []
+
+        def tracked(*args, **kwargs):
+            fh = spill(*args, **kwargs)
+            close = fh.close
+
+            def closed():
+                open_runs.discard(fh)
+                close()
+            fh.close = closed
+            open_runs.add(fh)
+            most.append(len(open_runs))
+            return fh
+
+        stats._spill = tracked
+        try:
+            for merge_runs in [2, 3, 8]:
+                del most[:]
+                self.assertEqual(
+                    sorted(rows, key=lambda x: x[0]),
+                    list(
+                        stats.external_sort(
+                            rows,
+                            key=lambda x: x[0],
+                            buffer_rows=3,
+                            merge_runs=merge_runs,
+                        )
+                    ),
+                )
+                self.assertFalse(open_runs)
+                self.assertLess(max(most), 5 * merge_runs)
+        finally:
+            stats._spill = spill
+
+    def test_dump_market_prices(self):
+        expected = StringIO()
+        self.assertEqual(543, self.reporter.dump_market_prices(expected))
+
+        got = StringIO()
+        self.reporter.dump_market_prices(got, buffer_rows=10)
+        self.assertEqual(expected.getvalue(), got.getvalue())
+
+        lines = expected.getvalue().splitlines()
+        self.assertEqual(
+            "Competition,Game,Closes,Name,Calculated Market Percentage",
+            lines[0],
         )
+        closes = [line.split(",")[2] for line in lines[1:]]
+        self.assertEqual(sorted(closes), closes)
 
-        sel2 = stats.Selection(
-            number=2,
-            name="Sharks 8 & Over",
-            odds=700,
-            status="OK",
+    def test_dump_market_prices_by_competition(self):
+        filenames = self.reporter.dump_market_prices_by_competition(
+            self.directory,
+            buffer_rows=50,
+        )
+        self.assertEqual(
+            os.path.join(self.directory, "Super_Rugby.csv"),
+            filenames["Super Rugby"],
         )
 
-        sel3 = stats.Selection(
-            number=3,
-            name="Either 7 & Under/Draw",
-            odds=260,
-            status="OK",
+        expected = StringIO()
+        self.reporter.dump_compentition_market_prices("Super Rugby", expected)
+        with open(filenames["Super Rugby"], newline="") as fh:
+            self.assertEqual(expected.getvalue(), fh.read())
+
+        rows = 0
+        for filename in set(filenames.values()):
+            with open(filename) as fh:
+                rows += len(fh.readlines()) - 1
+        self.assertEqual(543, rows)
+
+    def test_competition_filename(self):
+        self.assertEqual("Super_Rugby.csv", stats.competition_filename(
+            "Super Rugby"
+        ))
+        self.assertEqual("a_b.csv", stats.competition_filename("../a/b"))
+        self.assertEqual("_.csv", stats.competition_filename(None))
+
+
+class TestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.profiler = stats.Profiler()
+        self.reporter = stats.Reporter(
+            parser=stats.JSONParser(),
+            profiler=self.profiler,
         )
+        with open(JSONFILE) as fh:
+            self.reporter.load(fh)
 
-        comp.add_selection(sel1)
-        comp.add_selection(sel2)
-        comp.add_selection(sel3)
+    def test_stages(self):
+        profiler = stats.Profiler()
+        with profiler.stage("outer"):
+            with profiler.stage("inner"):
+                pass
+            with profiler.stage("inner"):
+                pass
+        self.assertEqual(
+            [1, 2],
+            [profiler.stages[each][0] for each in ["outer", "inner"]],
+        )
+        outer = profiler.stages["outer"]
+        inner = profiler.stages["inner"]
+        self.assertAlmostEqual(outer[1], outer[2] + inner[1])
 
         self.assertEqual(
-            [
-                sel1,
-                sel2,
-                sel3,
-            ],
-            comp.get_selections(),
+            [1, 2, 3],
+            list(profiler.iterate("items", [1, 2, 3], counter="items")),
+        )
+        self.assertEqual(4, profiler.stages["items"][0])
+        self.assertEqual({"items": 3}, profiler.counters)
+
+    def test_reporter(self):
+        expected = make_json_loaded_reporter()
+        self.assertEqual(
+            expected.largest_market_percentage(),
+            self.reporter.largest_market_percentage(),
+        )
+        got = StringIO()
+        self.reporter.dump_compentition_market_prices("Super Rugby", got)
+        self.assertEqual(543, self.reporter.dump_market_prices(StringIO()))
+
+        report = self.profiler.report()
+        for each in [
+            "load",
+            "parse",
+            "get_competitions",
+            "get_selections",
+            "market_percentage",
+            "csv",
+        ]:
+            self.assertIn(each, report["stages"])
+        self.assertEqual(
+            1086 + len(got.getvalue().splitlines()) - 1,
+            report["counters"]["competitions"],
+        )
+        self.assertGreater(report["counters"]["selections"], 0)
+        self.assertGreater(report["peak_rss_kb"], 0)
+
+    def test_dump(self):
+        self.reporter.summary()
+        fh = StringIO()
+        self.profiler.dump(fh)
+        fh.seek(0)
+        report = json.load(fh)
+        self.assertEqual(
+            543,
+            report["stages"]["get_competitions"]["calls"] - 1,
+        )
+        self.assertIn("get_competitions", self.profiler.format())
+
+    def test_memory(self):
+        profiler = stats.Profiler(memory=True)
+        try:
+            with profiler.stage("list"):
+                list(range(1000))
+            self.assertGreater(profiler.report()["alloc_peak_bytes"], 0)
+        finally:
+            stats.tracemalloc.stop()
+
+
+class TestReportAggregator(unittest.TestCase):
+    def setUp(self):
+        self.reporter = make_json_loaded_reporter()
+        self.aggregator = self.reporter.aggregate(comp="Super Rugby")
+
+    def test_option_count(self):
+        self.assertEqual(
+            self.reporter.option_count(),
+            self.aggregator.option_count(),
+        )
+
+    def test_extrema(self):
+        self.assertEqual(
+            self.reporter.largest_market_percentage(),
+            self.aggregator.largest_market_percentage(),
+        )
+        self.assertEqual(
+            self.reporter.least_market_percentage(),
+            self.aggregator.least_market_percentage(),
+        )
+
+    def test_summary(self):
+        self.assertEqual(self.reporter.summary(), self.aggregator.summary())
+
+    def test_dump_compentition_market_prices(self):
+        expected = StringIO()
+        self.reporter.dump_compentition_market_prices("Super Rugby", expected)
+
+        got = StringIO()
+        self.aggregator.dump_compentition_market_prices("Super Rugby", got)
+
+        self.assertEqual(expected.getvalue(), got.getvalue())
+
+    def test_dump_other_competition(self):
+        with self.assertRaises(ValueError):
+            self.aggregator.dump_compentition_market_prices("Other", StringIO())
+
+    def test_merge(self):
+        comps = list(self.reporter.parser.get_competitions())
+        half = len(comps) // 2
+
+        first = stats.ReportAggregator(comp="Super Rugby")
+        for each in comps[:half]:
+            first.add(each)
+        second = stats.ReportAggregator(comp="Super Rugby")
+        for each in comps[half:]:
+            second.add(each)
+        first.merge(second)
+
+        for method in [
+            "option_count",
+            "largest_market_percentage",
+            "least_market_percentage",
+            "summary",
+        ]:
+            self.assertEqual(
+                getattr(self.aggregator, method)(),
+                getattr(first, method)(),
+            )
+
+        expected = StringIO()
+        self.aggregator.dump_compentition_market_prices("Super Rugby", expected)
+        got = StringIO()
+        first.dump_compentition_market_prices("Super Rugby", got)
+        self.assertEqual(expected.getvalue(), got.getvalue())
+
+
+class TestMarketRanking(unittest.TestCase):
+    def setUp(self):
+        self.reporter = make_json_loaded_reporter()
+        self.comps = list(self.reporter.parser.get_competitions())
+
+    def expected(self, k, least=False):
+        ranked = sorted(
+            enumerate(self.comps),
+            key=lambda x: (
+                x[1].market_percentage() if least
+                else -x[1].market_percentage(),
+                x[0],
+            ),
+        )
+        return [
+            (each.competition, each.game, each.name)
+            for _, each in ranked[:k]
+        ]
+
+    def names(self, ranked):
+        return [(each.competition, each.game, each.name) for each in ranked]
+
+    def test_single(self):
+        ranking = self.reporter.market_rankings(1)
+        self.assertEqual(
+            self.reporter.largest_market_percentage(),
+            ranking.largest()[0].competition,
+        )
+        self.assertEqual(
+            self.reporter.least_market_percentage(),
+            ranking.least()[0].competition,
+        )
+
+    def test_top_k(self):
+        ranking = self.reporter.market_rankings(10)
+        self.assertEqual(self.expected(10), self.names(ranking.largest()))
+        self.assertEqual(
+            self.expected(10, least=True),
+            self.names(ranking.least()),
+        )
+
+    def test_more_than_available(self):
+        ranking = self.reporter.market_rankings(1000)
+        self.assertEqual(543, len(ranking.largest()))
+        self.assertEqual(self.expected(543), self.names(ranking.largest()))
+
+    def test_per_sport(self):
+        ranking = self.reporter.market_rankings(2, per_sport=True)
+        largest = ranking.largest()
+        self.assertEqual(
+            set(each.sport for each in self.comps),
+            set(largest),
+        )
+        tennis = [each for each in self.comps if each.sport == "Tennis"]
+        best = max(each.market_percentage() for each in tennis)
+        self.assertEqual(best, largest["Tennis"][0].market_percentage)
+        self.assertEqual(2, len(ranking.least()["Tennis"]))
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            stats.MarketRanking(0)
+
+    def test_merge(self):
+        half = len(self.comps) // 2
+        first = stats.MarketRanking(5)
+        for each in self.comps[:half]:
+            first.add(each)
+        second = stats.MarketRanking(5)
+        for each in self.comps[half:]:
+            second.add(each)
+        first.merge(second)
+
+        self.assertEqual(self.expected(5), self.names(first.largest()))
+        self.assertEqual(
+            self.expected(5, least=True),
+            self.names(first.least()),
+        )
+
+    def test_aggregator(self):
+        aggregator = self.reporter.aggregate(top=5)
+        self.assertEqual(
+            self.expected(3),
+            self.names(aggregator.market_rankings(3).largest()),
+        )
+        with self.assertRaises(ValueError):
+            aggregator.market_rankings(6)
+        with self.assertRaises(ValueError):
+            aggregator.market_rankings(5, per_sport=True)
+        with self.assertRaises(ValueError):
+            self.reporter.aggregate().market_rankings(1)
+
+    def test_incremental_report(self):
+        report = stats.IncrementalReport()
+        report.update(self.reporter.parser)
+        ranking = report.market_rankings(5)
+        self.assertEqual(self.expected(5), self.names(ranking.largest()))
+        self.assertEqual(
+            self.expected(5, least=True),
+            self.names(ranking.least()),
+        )
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for each in [JSONFILE, XMLFILE]:
+            shutil.copy(each, self.directory)
+        with open(os.path.join(self.directory, "notes.txt"), "w") as fh:
+            fh.write("not a feed")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_make_parser(self):
+        self.assertIsInstance(stats.make_parser("a.json"), stats.JSONParser)
+        self.assertIsInstance(
+            stats.make_parser("a.xml", stream=True),
+            stats.XMLStreamParser,
+        )
+        with self.assertRaises(ValueError):
+            stats.make_parser("a.txt")
+
+    def test_sniff(self):
+        for each, module, parser in [
+            ("json", "gzip", stats.JSONParser),
+            ("xml", "bz2", stats.XMLParser),
+            ("json", "lzma", stats.JSONParser),
+            ("xml", None, stats.XMLParser),
+        ]:
+            source = os.path.join(self.directory, "options." + each)
+            filename = os.path.join(self.directory, "feed")
+            with open(source, "rb") as fh:
+                content = fh.read()
+            if module is not None:
+                content = importlib.import_module(module).compress(content)
+            with open(filename, "wb") as fh:
+                fh.write(content)
+
+            self.assertEqual(
+                module,
+                stats.sniff_compression(content[:8]),
+            )
+            self.assertEqual(each, stats.sniff_file(filename))
+            reporter = stats.Reporter(stats.make_parser(filename))
+            self.assertIsInstance(reporter.parser, parser)
+            with stats.open_feed(filename) as fh:
+                reporter.load(fh)
+            self.assertEqual(543, reporter.option_count())
+            self.assertEqual(
+                543,
+                stats.aggregate_file(filename).option_count(),
+            )
+
+        self.assertEqual(None, stats.sniff_compression(b"{}"))
+        with self.assertRaises(ValueError):
+            stats.make_parser(os.path.join(self.directory, "notes.txt"))
+
+    def test_expand_filenames(self):
+        expected = [
+            os.path.join(self.directory, "options.json"),
+            os.path.join(self.directory, "options.xml"),
+        ]
+        self.assertEqual(expected, stats.expand_filenames([self.directory]))
+        self.assertEqual(
+            expected,
+            stats.expand_filenames([os.path.join(self.directory, "options.*")]),
+        )
+        self.assertEqual(["a.json"], stats.expand_filenames(["a.json"]))
+
+    def test_aggregate_files(self):
+        filenames = stats.expand_filenames([self.directory])
+        serial = stats.aggregate_files(filenames, comp="Super Rugby", jobs=1)
+        parallel = stats.aggregate_files(filenames, comp="Super Rugby", jobs=2)
+
+        self.assertEqual(1086, serial.option_count())
+        self.assertEqual(1086, parallel.option_count())
+        self.assertEqual(serial.summary(), parallel.summary())
+        self.assertEqual(138, len(parallel.rows))
+        self.assertEqual(
+            "Super Rugby",
+            parallel.largest_market_percentage(),
+        )
+
+
+class TestIncrementalReport(unittest.TestCase):
+    def setUp(self):
+        with open(JSONFILE) as fh:
+            self.data = json.load(fh)
+        self.report = stats.IncrementalReport(comp="Super Rugby")
+
+    def parser(self):
+        parser = stats.JSONParser()
+        parser.parse(StringIO(json.dumps(self.data)))
+        return parser
+
+    def assertSameReports(self):
+        expected = stats.Reporter(self.parser()).aggregate(comp="Super Rugby")
+        self.assertEqual(expected.option_count(), self.report.option_count())
+        self.assertEqual(
+            expected.largest_market_percentage(),
+            self.report.largest_market_percentage(),
+        )
+        self.assertEqual(
+            expected.least_market_percentage(),
+            self.report.least_market_percentage(),
+        )
+        self.assertEqual(expected.summary(), self.report.summary())
+
+        got = StringIO()
+        self.report.dump_compentition_market_prices("Super Rugby", got)
+        dumped = StringIO()
+        expected.dump_compentition_market_prices("Super Rugby", dumped)
+        self.assertEqual(
+            sorted(dumped.getvalue().splitlines()),
+            sorted(got.getvalue().splitlines()),
+        )
+
+    def test_initial_update(self):
+        self.assertEqual((543, 0, 0), self.report.update(self.parser()))
+        self.assertSameReports()
+        self.assertEqual(
+            make_json_loaded_reporter().summary(),
+            self.report.summary(),
+        )
+
+    def test_unchanged_update(self):
+        self.report.update(self.parser())
+        self.assertEqual((0, 0, 0), self.report.update(self.parser()))
+        self.assertSameReports()
+
+    def test_changed_odds(self):
+        self.report.update(self.parser())
+
+        options = self.data["options"]["option"]
+        rugby = [
+            each for each in options
+            if each["competition"] == "Super Rugby"
+        ]
+        for each in rugby:
+            for sel in each["selections"]["selection"]:
+                sel["odds"] = "1000000"
+
+        self.assertEqual(
+            (0, len(rugby), 0),
+            self.report.update(self.parser()),
+        )
+        self.assertSameReports()
+        self.assertNotEqual(
+            "Super Rugby",
+            self.report.largest_market_percentage(),
+        )
+
+    def test_added_and_removed(self):
+        self.report.update(self.parser())
+
+        options = self.data["options"]["option"]
+        removed = options.pop(0)
+        added = json.loads(json.dumps(options[0]))
+        added["number"] = "999999"
+        options.append(added)
+
+        self.assertEqual((1, 0, 1), self.report.update(self.parser()))
+        self.assertSameReports()
+
+        del options[:]
+        self.assertEqual((0, 0, 543), self.report.update(self.parser()))
+        self.assertEqual(0, self.report.option_count())
+        self.assertEqual("", self.report.summary())
+        self.assertIsNone(self.report.largest_market_percentage())
+        self.assertIsNone(self.report.least_market_percentage())
+
+    def test_duplicated_key(self):
+        options = self.data["options"]["option"]
+        options.append(json.loads(json.dumps(options[0])))
+        self.assertEqual((544, 0, 0), self.report.update(self.parser()))
+        self.assertSameReports()
+        self.assertEqual((0, 0, 0), self.report.update(self.parser()))
+
+        for sel in options[-1]["selections"]["selection"]:
+            sel["odds"] = "1000000"
+        self.assertEqual((0, 1, 0), self.report.update(self.parser()))
+        self.assertSameReports()
+
+        options.pop()
+        self.assertEqual((0, 0, 1), self.report.update(self.parser()))
+        self.assertSameReports()
+
+    def test_streaming_parser(self):
+        parser = stats.JSONStreamParser()
+        with open(JSONFILE) as fh:
+            parser.parse(fh)
+            self.report.update(parser)
+        self.assertSameReports()
+
+    def test_watch_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "options.json")
+            shutil.copy(JSONFILE, filename)
+
+            updates = []
+            report = stats.watch_file(
+                filename,
+                lambda report, changes: updates.append(changes),
+                interval=0,
+                iterations=3,
+            )
+            self.assertEqual([(543, 0, 0)], updates)
+            self.assertEqual(543, report.option_count())
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestDiff(unittest.TestCase):
+    def setUp(self):
+        with open(JSONFILE) as fh:
+            self.data = json.load(fh)
+        self.old = self.parser()
+
+    def parser(self):
+        parser = stats.JSONStreamParser()
+        parser.parse(io.BytesIO(json.dumps(self.data).encode("utf-8")))
+        return parser
+
+    def diff(self, buffer_rows=None):
+        fh = StringIO()
+        counts = stats.write_diff(
+            fh,
+            self.old,
+            self.parser(),
+            buffer_rows=buffer_rows,
+        )
+        return counts, fh.getvalue().splitlines()
+
+    def test_unchanged(self):
+        counts, lines = self.diff()
+        self.assertEqual((0, 0, 0), counts)
+        self.assertEqual([",".join(stats.DIFF_FIELDS)], lines)
+
+    def test_formats(self):
+        old = stats.XMLStreamParser()
+        with open(XMLFILE, "rb") as fh:
+            old.parse(fh)
+            self.assertEqual(
+                [],
+                list(stats.diff_snapshots(old, self.parser(), buffer_rows=50)),
+            )
+
+    def test_changes(self):
+        options = self.data["options"]["option"]
+        removed = options.pop(0)
+        added = json.loads(json.dumps(options[0]))
+        added["number"] = "999999"
+        options.append(added)
+
+        changed = options[1]
+        selections = changed["selections"]["selection"]
+        old_odds = int(selections[0]["odds"])
+        selections[0]["odds"] = str(old_odds * 2)
+        dropped = selections.pop()
+        before = stats._make_json_competition(
+            self.old_option(changed["number"])
+        ).market_percentage()
+        after = stats._make_json_competition(changed).market_percentage()
+
+        expected = list(stats.diff_snapshots(self.old, self.parser()))
+        for buffer_rows in [1, 7]:
+            self.assertEqual(
+                expected,
+                list(
+                    stats.diff_snapshots(
+                        self.old,
+                        self.parser(),
+                        buffer_rows=buffer_rows,
+                    )
+                ),
+            )
+
+        changes = [row[0] for row in expected]
+        self.assertEqual(
+            ["added", "changed", "removed", "selection_changed",
+             "selection_removed"],
+            sorted(changes),
+        )
+
+        row = expected[changes.index("removed")]
+        self.assertEqual(int(removed["number"]), row[1])
+        self.assertEqual(removed["name"], row[3])
+        self.assertIsNone(row[11])
+
+        row = expected[changes.index("added")]
+        self.assertEqual((999999, added["game"]), row[1:3])
+        self.assertIsNone(row[10])
+
+        position = changes.index("changed")
+        row = expected[position]
+        self.assertEqual(int(changed["number"]), row[1])
+        self.assertEqual((before, after), row[10:12])
+        self.assertAlmostEqual(after - before, row[12])
+        self.assertEqual(
+            (int(selections[0]["number"]), old_odds, old_odds * 2),
+            (expected[position + 1][6],) + expected[position + 1][8:10],
+        )
+        self.assertEqual(
+            ("selection_removed", int(dropped["number"]), None),
+            (expected[position + 2][0], expected[position + 2][6],
+             expected[position + 2][9]),
+        )
+
+        counts, lines = self.diff(buffer_rows=10)
+        self.assertEqual((1, 1, 1), counts)
+        self.assertEqual(6, len(lines))
+
+    def old_option(self, number):
+        return next(
+            each for each in self.old.iter_options()
+            if each["number"] == number
+        )
+
+
+async def http_post(address, path, body, headers=None):
+    if isinstance(address, str):
+        reader, writer = await asyncio.open_unix_connection(address)
+    else:
+        reader, writer = await asyncio.open_connection(*address)
+    head = "POST {} HTTP/1.1\r\nContent-Length: {}\r\n".format(
+        path,
+        len(body),
+    )
+    for key, value in (headers or {}).items():
+        head += "{}: {}\r\n".format(key, value)
+    writer.write(head.encode("latin-1") + b"\r\n" + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), content.decode("utf-8")
+
+
+class TestStatsServer(unittest.TestCase):
+    def setUp(self):
+        with open(JSONFILE, "rb") as fh:
+            self.json = fh.read()
+        with open(XMLFILE, "rb") as fh:
+            self.xml = fh.read()
+        self.reporter = make_json_loaded_reporter()
+
+    def request(self, requests, **kwargs):
+        async def run():
+            server = stats.StatsServer(**kwargs)
+            address = await server.start()
+            try:
+                return await asyncio.gather(
+                    *[http_post(address, *each) for each in requests]
+                )
+            finally:
+                await server.close()
+        return asyncio.run(run())
+
+    def test_sniff_format(self):
+        self.assertEqual("json", stats.sniff_format(self.json))
+        self.assertEqual("xml", stats.sniff_format(self.xml))
+        self.assertEqual("xml", stats.sniff_format(b"{", "application/xml"))
+        with self.assertRaises(ValueError):
+            stats.sniff_format(b"Game,Closes")
+
+    def test_reports(self):
+        (status, options), (_, summary), (_, largest), (_, comp) = (
+            self.request(
+                [
+                    ("/options", self.json),
+                    ("/summary", self.xml),
+                    ("/largest", self.json),
+                    ("/comp?name=Super%20Rugby", self.xml),
+                ]
+            )
+        )
+        self.assertEqual(200, status)
+        self.assertEqual("Available options: 543\n", options)
+        self.assertEqual(self.reporter.summary(), summary)
+        self.assertEqual("Super Rugby\n", largest)
+
+        expected = StringIO()
+        self.reporter.dump_compentition_market_prices("Super Rugby", expected)
+        self.assertEqual(expected.getvalue(), comp)
+
+    def test_rank(self):
+        [(status, body)] = self.request([("/rank?k=1", self.json)])
+        self.assertEqual(200, status)
+        self.assertIn("1. Super Rugby", body)
+
+    def test_errors(self):
+        responses = self.request(
+            [
+                ("/unknown", self.json),
+                ("/options", b"not a feed"),
+                ("/options", b"{broken"),
+                ("/comp", self.json),
+                ("/options", self.json),
+            ],
+            max_body=len(self.json) - 1,
+        )
+        self.assertEqual(
+            [404, 415, 400, 413, 413],
+            [each[0] for each in responses],
+        )
+
+    def test_malformed(self):
+        option = json.loads(self.json)["options"]["option"][0]
+        option["selections"] = None
+        responses = self.request(
+            [
+                ("/options", b"[]"),
+                ("/largest", json.dumps(
+                    {"options": {"option": [option]}}
+                ).encode("utf-8")),
+                ("/options", self.json, {"X-Long": "x" * 100000}),
+            ],
+        )
+        self.assertEqual([400, 400, 400], [each[0] for each in responses])
+        self.assertIn("Malformed feed", responses[0][1])
+
+    def test_internal_error(self):
+        async def fail(reader):
+            raise RuntimeError("boom")
+
+        async def run():
+            server = stats.StatsServer()
+            server._handle = fail
+            address = await server.start()
+            try:
+                return await http_post(address, "/options", self.json)
+            finally:
+                await server.close()
+
+        self.assertEqual(
+            (500, "Internal Server Error\n"),
+            asyncio.run(run()),
+        )
+
+    def test_backlog(self):
+        responses = self.request(
+            [("/options", self.json)] * 6,
+            concurrency=1,
+            backlog=1,
+        )
+        statuses = sorted(each[0] for each in responses)
+        self.assertIn(200, statuses)
+        self.assertIn(503, statuses)
+
+    def test_unix_socket(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "stats.sock")
+            [(status, body)] = self.request(
+                [("/options", self.xml)],
+                path=path,
+            )
+            self.assertEqual(200, status)
+            self.assertEqual("Available options: 543\n", body)
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestXMLChunks(unittest.TestCase):
+    def setUp(self):
+        reporter = make_xml_reporter()
+        with open(XMLFILE, "rb") as fh:
+            reporter.load(fh)
+        self.expected = reporter.aggregate(comp="Super Rugby")
+
+    def assertSameReports(self, aggregator):
+        self.assertEqual(self.expected.count, aggregator.count)
+        self.assertEqual(self.expected.largest, aggregator.largest)
+        self.assertEqual(self.expected.least, aggregator.least)
+        self.assertEqual(self.expected.summary(), aggregator.summary())
+        self.assertEqual(self.expected.rows, aggregator.rows)
+
+    def test_split_xml_options(self):
+        prolog, ranges = stats.split_xml_options(XMLFILE, 5)
+        self.assertEqual(5, len(ranges))
+        self.assertTrue(prolog.rstrip().endswith(b"<options>"))
+
+        with open(XMLFILE, "rb") as fh:
+            content = fh.read()
+        for start, end in ranges:
+            self.assertTrue(content[start:].startswith(b"<option "))
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+        self.assertTrue(content[:ranges[-1][1]].endswith(b"</option>"))
+        self.assertTrue(
+            content[ranges[-1][1]:].lstrip().startswith(b"</options>")
+        )
+
+    def test_split_nested_xml_options(self):
+        with open(XMLFILE, "rb") as fh:
+            content = fh.read()
+        start = content.index(b"<options>")
+        end = content.rindex(b"</options>") + len(b"</options>")
+        nested = (
+            content[:start] + b"<feed>\n<meta/>\n" + content[start:end] +
+            b"\n</feed>" + content[end:]
+        )
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "nested.xml")
+            with open(filename, "wb") as fh:
+                fh.write(nested)
+
+            _, ranges = stats.split_xml_options(filename, 3)
+            self.assertTrue(nested[:ranges[-1][1]].endswith(b"</option>"))
+
+            self.assertSameReports(
+                stats.aggregate_xml_chunks(
+                    filename, comp="Super Rugby", jobs=1, chunks=3
+                )
+            )
+        finally:
+            shutil.rmtree(directory)
+
+    def test_split_more_chunks_than_options(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "small.xml")
+            with open(filename, "w") as fh:
+                fh.write(
+                    '<options><option number="1"/>'
+                    '<option number="2"/></options>'
+                )
+            _, ranges = stats.split_xml_options(filename, 10)
+            self.assertEqual(2, len(ranges))
+
+            aggregator = stats.aggregate_xml_chunks(filename, jobs=1)
+            self.assertEqual(2, aggregator.option_count())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_aggregate_xml_chunks(self):
+        for chunks in [1, 3, 7]:
+            self.assertSameReports(
+                stats.aggregate_xml_chunks(
+                    XMLFILE,
+                    comp="Super Rugby",
+                    jobs=1,
+                    chunks=chunks,
+                )
+            )
+
+    def test_aggregate_xml_chunks_parallel(self):
+        self.assertSameReports(
+            stats.aggregate_xml_chunks(XMLFILE, comp="Super Rugby", jobs=2)
+        )
+
+
+class TestQuery(unittest.TestCase):
+    QUERIES = [
+        stats.Query(where={"sport": ["Football", "Tennis"]}),
+        stats.Query(where={"competition": "Super Rugby", "number": "2003"}),
+        stats.Query(
+            where={"sport": "Football"},
+            closes_after="2016-04-20 06:00:00",
+            closes_before="2016-04-21 00:00:00",
+        ),
+        stats.Query(closes_before="2016-04-20 06:00:00", odds_min=5000),
+        stats.Query(where={"name": "Head to Head"}, odds_max=150),
+        stats.Query(where={"sport": "Curling"}),
+        stats.Query(),
+    ]
+
+    def parsers(self):
+        for cls, filename in [
+            (stats.JSONParser, JSONFILE),
+            (stats.JSONStreamParser, JSONFILE),
+            (stats.XMLParser, XMLFILE),
+            (stats.XMLStreamParser, XMLFILE),
+        ]:
+            parser = cls()
+            with open(filename, "rb") as fh:
+                parser.parse_buffer(fh.read())
+            yield parser
+
+        store = stats.CompetitionStore(parser=stats.JSONParser())
+        with open(JSONFILE, "rb") as fh:
+            store.parse(fh)
+        yield store
+
+        fh = io.BytesIO()
+        make_json_loaded_reporter().export(fh, chunk_rows=100)
+        reader = stats.ColumnarReader()
+        reader.parse_buffer(fh.getvalue())
+        yield reader
+
+    def numbers(self, competitions):
+        return [each.number for each in competitions]
+
+    def test_query(self):
+        for parser in self.parsers():
+            competitions = list(parser.get_competitions())
+            for query in self.QUERIES:
+                expected = self.numbers(
+                    each for each in competitions if query.match(each)
+                )
+                self.assertEqual(expected, self.numbers(parser.query(query)))
+                self.assertEqual(len(expected), parser.query_count(query))
+            self.assertEqual(
+                [2003],
+                self.numbers(parser.query(self.QUERIES[1])),
+            )
+
+    def test_pushdown(self):
+        parser = stats.JSONParser()
+        with open(JSONFILE) as fh:
+            parser.parse(fh)
+        built = []
+        make_competition = parser.make_competition
+
+        def counted(record):
+            built.append(record)
+            return make_competition(record)
+        parser.make_competition = counted
+
+        matched = list(parser.query(self.QUERIES[2]))
+        self.assertTrue(matched)
+        self.assertEqual(len(matched), len(built))
+
+    def test_option_count(self):
+        with open(JSONFILE) as fh:
+            data = json.load(fh)
+        football = [
+            each for each in data["options"]["option"]
+            if each["sport"] == "Football"
+        ]
+        football[0]["number"] = "x"
+        content = json.dumps(data).encode("utf-8")
+
+        for cls in [stats.JSONParser, stats.JSONStreamParser]:
+            parser = stats.QueryParser(
+                cls(),
+                stats.Query(where={"sport": "Football"}),
+            )
+            parser.parse(io.BytesIO(content))
+            parser.parser.make_competition = None
+            self.assertEqual(len(football), parser.option_count())
+
+    def test_parse(self):
+        query = stats.Query.parse(
+            ["sport=Football", "sport=Tennis", "number= 7"],
+            odds_min=100,
+        )
+        self.assertEqual(
+            {"sport": {"Football", "Tennis"}, "number": {7}},
+            query.where,
+        )
+        self.assertEqual(100, query.odds_min)
+        self.assertEqual(
+            repr(query),
+            repr(stats.Query.parse(["number=7", "sport=Tennis",
+                                    "sport=Football"], odds_min=100)),
+        )
+        self.assertEqual(
+            {"Tennis"},
+            query.restrict("sport", "Tennis").where["sport"],
+        )
+        for conditions in [["sport"], ["colour=red"], ["number=x"]]:
+            with self.assertRaises(ValueError):
+                stats.Query.parse(conditions)
+
+    def test_reporter(self):
+        query = stats.Query(where={"sport": "Rugby Union"})
+        reporter = stats.Reporter(
+            stats.QueryParser(stats.XMLParser(), query)
+        )
+        with open(XMLFILE, "rb") as fh:
+            reporter.load(fh)
+
+        expected = make_json_loaded_reporter()
+        competitions = [
+            each for each in expected.parser.get_competitions()
+            if query.match(each)
+        ]
+        self.assertEqual(len(competitions), reporter.option_count())
+        self.assertEqual("Rugby Union\n", reporter.summary().split("  ")[0])
+        self.assertEqual("Super Rugby", reporter.largest_market_percentage())
+
+        got = StringIO()
+        reporter.dump_compentition_market_prices("Super Rugby", got)
+        want = StringIO()
+        expected.dump_compentition_market_prices("Super Rugby", want)
+        self.assertEqual(want.getvalue(), got.getvalue())
+
+        self.assertEqual(
+            2 * len(competitions),
+            stats.aggregate_files(
+                [JSONFILE, XMLFILE],
+                jobs=1,
+                query=query,
+            ).option_count(),
+        )
+
+    def test_cache_key(self):
+        content = b'{"options": {"option": []}}'
+        keys = set(
+            stats.FeedCache.key(content, parser)
+            for parser in [
+                stats.JSONParser(),
+                stats.QueryParser(stats.JSONParser(), self.QUERIES[0]),
+                stats.QueryParser(stats.JSONParser(), self.QUERIES[1]),
+            ]
+        )
+        self.assertEqual(3, len(keys))
+        self.assertEqual(
+            stats.FeedCache.key(
+                content,
+                stats.QueryParser(stats.JSONParser(), self.QUERIES[0]),
+            ),
+            stats.FeedCache.key(
+                content,
+                stats.QueryParser(stats.XMLParser(), self.QUERIES[0]),
+            ),
+        )
+
+
+class TestValidation(unittest.TestCase):
+    def setUp(self):
+        with open(JSONFILE) as fh:
+            self.data = json.load(fh)
+        options = self.data["options"]["option"]
+        options[3]["selections"]["selection"][1]["odds"] = "n/a"
+        options[10]["number"] = "x"
+        self.json = json.dumps(self.data).encode("utf-8")
+
+        with open(XMLFILE, "rb") as fh:
+            root = lxml.etree.parse(fh).getroot()
+        options = list(root.iterchildren("option"))
+        list(options[3].iter("selection"))[1].set("odds", "n/a")
+        options[10].set("number", "x")
+        self.xml = lxml.etree.tostring(root)
+
+        expected = stats.JSONParser()
+        expected.parse(io.BytesIO(self.json))
+        self.expected = [
+            each for position, each in enumerate(expected.records)
+            if position not in (3, 10)
+        ]
+
+    def parsers(self, **kwargs):
+        for cls, content in [
+            (stats.JSONParser, self.json),
+            (stats.JSONStreamParser, self.json),
+            (stats.XMLParser, self.xml),
+            (stats.XMLStreamParser, self.xml),
+        ]:
+            yield cls(**kwargs), content
+
+    def test_unchecked(self):
+        reporter = stats.Reporter(stats.JSONParser())
+        reporter.load(self.json)
+        self.assertEqual(543, reporter.option_count())
+        with self.assertRaises(ValueError):
+            reporter.largest_market_percentage()
+
+    def test_strict(self):
+        for parser, content in self.parsers(errors="strict"):
+            with self.assertRaises(stats.RecordError) as ctx:
+                parser.parse(io.BytesIO(content))
+            self.assertEqual(3, ctx.exception.position)
+            self.assertEqual("selection.odds", ctx.exception.field)
+            self.assertEqual("n/a", ctx.exception.value)
+            self.assertEqual("int", ctx.exception.expected)
+
+        parser = stats.JSONParser(errors="strict")
+        parser.parse(
+            io.BytesIO(b'{"options": {"option": [{"name": "a", "number": 1}]}}')
+        )
+        with self.assertRaises(stats.RecordError):
+            parser.parse(io.BytesIO(b'{"options": {"option": [1]}}'))
+        with self.assertRaises(ValueError):
+            stats.JSONParser(errors="ignore")
+
+    def test_skip(self):
+        expected = stats.Reporter(stats.JSONParser())
+        expected.load(
+            json.dumps({"options": {"option": self.expected}}).encode("utf-8")
+        )
+        for parser, content in self.parsers(errors="skip"):
+            quarantine = StringIO()
+            parser.quarantine = quarantine
+            reporter = stats.Reporter(parser)
+            reporter.load(io.BytesIO(content))
+
+            self.assertEqual(2, parser.skipped)
+            self.assertEqual(541, reporter.option_count())
+            self.assertEqual(expected.summary(), reporter.summary())
+            self.assertEqual(
+                expected.largest_market_percentage(),
+                reporter.largest_market_percentage(),
+            )
+
+            lines = [
+                json.loads(line)
+                for line in quarantine.getvalue().splitlines()
+            ]
+            self.assertEqual([3, 10], [each["position"] for each in lines])
+            self.assertEqual(
+                ["selection.odds", "number"],
+                [each["field"] for each in lines],
+            )
+            self.assertIn('"x"', lines[1]["record"])
+
+    def test_skip_with_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = stats.FeedCache(directory)
+            for _ in range(2):
+                quarantine = StringIO()
+                parser = stats.JSONParser(
+                    errors="skip",
+                    quarantine=quarantine,
+                )
+                reporter = stats.Reporter(
+                    stats.QueryParser(parser, stats.Query()),
+                    cache=cache,
+                )
+                reporter.load(io.BytesIO(self.json))
+
+                self.assertEqual(2, parser.skipped)
+                self.assertEqual(2, len(quarantine.getvalue().splitlines()))
+                self.assertEqual(541, reporter.option_count())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_make_parser(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "feed")
+            with open(filename, "wb") as fh:
+                fh.write(self.xml)
+            parser = stats.make_parser(filename, stream=True, errors="skip")
+            self.assertIsInstance(parser, stats.XMLStreamParser)
+            with open(filename, "rb") as fh:
+                parser.parse(fh)
+                self.assertEqual(541, parser.option_count())
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestCompetition(unittest.TestCase):
+    def test_add_selection(self):
+        comp = stats.Competition(
+            venue="Dunedin",
+            competition="Super Rugby",
+            closes="2016-04-22 19:35:00",
+            name="Tri-Bet",
+            number=2023,
+            sport="Rugby Union",
+            game="Highlanders v Sharks",
+        )
+
+        sel = stats.Selection(
+            number=1,
+            name="Highlanders 8 & Over",
+            odds=170,
+            status="OK",
+        )
+
+        comp.add_selection(sel)
+        self.assertEqual(1, len(comp.selections))
+        self.assertEqual(set([sel]), comp.selections)
+
+        # no doulbe ups should happen
+        comp.add_selection(sel)
+        self.assertEqual(set([sel]), comp.selections)
+
+    def test_get_selections(self):
+        comp = stats.Competition(
+            venue="Dunedin",
+            competition="Super Rugby",
+            closes="2016-04-22 19:35:00",
+            name="Tri-Bet",
+            number=2023,
+            sport="Rugby Union",
+            game="Highlanders v Sharks",
+        )
+
+        sel1 = stats.Selection(
+            number=1,
+            name="Highlanders 8 & Over",
+            odds=170,
+            status="OK",
+        )
+
+        sel2 = stats.Selection(
+            number=2,
+            name="Sharks 8 & Over",
+            odds=700,
+            status="OK",
+        )
+
+        sel3 = stats.Selection(
+            number=3,
+            name="Either 7 & Under/Draw",
+            odds=260,
+            status="OK",
+        )
+
+        comp.add_selection(sel1)
+        comp.add_selection(sel2)
+        comp.add_selection(sel3)
+
+        self.assertEqual(
+            [
+                sel1,
+                sel2,
+                sel3,
+            ],
+            comp.get_selections(),
         )
 
         self.assertEqual(
@@ -269,3 +2163,168 @@ class TestCompetition(unittest.TestCase):
             ],
             comp.get_selections(key=lambda x: x.odds),
         )
+
+    def test_get_selections_out_of_order(self):
+        comp = stats.Competition(
+            venue="Dunedin",
+            competition="Super Rugby",
+            closes="2016-04-22 19:35:00",
+            name="Tri-Bet",
+            number=2023,
+            sport="Rugby Union",
+            game="Highlanders v Sharks",
+        )
+
+        sels = [
+            stats.Selection(number=n, name="x", odds=100 + n, status="OK")
+            for n in (3, 1, 2, 1)
+        ]
+        for each in sels + sels:
+            comp.add_selection(each)
+
+        self.assertEqual(
+            [sels[1], sels[3], sels[2], sels[0]],
+            comp.get_selections(),
+        )
+
+    def test_get_selections_sort_cache(self):
+        comp = stats.Competition(
+            venue="Dunedin",
+            competition="Super Rugby",
+            closes="2016-04-22 19:35:00",
+            name="Tri-Bet",
+            number=2023,
+            sport="Rugby Union",
+            game="Highlanders v Sharks",
+        )
+
+        sel1 = stats.Selection(number=1, name="a", odds=300, status="OK")
+        sel2 = stats.Selection(number=2, name="b", odds=200, status="OK")
+        sel3 = stats.Selection(number=3, name="c", odds=100, status="OK")
+
+        key = lambda x: x.odds
+        comp.add_selection(sel1)
+        comp.add_selection(sel2)
+        self.assertEqual([sel2, sel1], comp.get_selections(key=key))
+
+        # returned lists can be changed without affecting the cache.
+        comp.get_selections(key=key).pop()
+        self.assertEqual([sel2, sel1], comp.get_selections(key=key))
+
+        comp.add_selection(sel3)
+        self.assertEqual([sel3, sel2, sel1], comp.get_selections(key=key))
+
+    def test_slots(self):
+        sel = stats.Selection(number=1, name="a", odds=300, status="OK")
+        with self.assertRaises(AttributeError):
+            sel.other = 1
+
+    def test_lazy(self):
+        decoded = []
+
+        def decode(source):
+            decoded.append(source)
+            for number, odds in source:
+                yield stats.Selection(number, "x", odds, "OK")
+
+        comp = stats.Competition(
+            venue="Dunedin",
+            competition="Super Rugby",
+            closes="2016-04-22 19:35:00",
+            name="Tri-Bet",
+            number=1,
+            sport="Rugby Union",
+            game="Highlanders v Sharks",
+        ).lazy([(2, 400), (1, 200)], decode)
+        self.assertEqual([], decoded)
+
+        self.assertEqual(0.0075, comp.market_percentage())
+        self.assertEqual([1, 2], [s.number for s in comp.get_selections()])
+        comp.add_selection(stats.Selection(3, "x", 0, "OK"))
+        self.assertEqual(3, len(comp.selections))
+        self.assertEqual(1, len(decoded))
+
+    def test_lazy_failure(self):
+        def decode(source):
+            for number, odds in source:
+                yield stats.Selection(number, "x", int(odds), "OK")
+
+        comp = stats.Competition(
+            venue="Dunedin",
+            competition="Super Rugby",
+            closes="2016-04-22 19:35:00",
+            name="Tri-Bet",
+            number=1,
+            sport="Rugby Union",
+            game="Highlanders v Sharks",
+        ).lazy([(1, "200"), (2, "n/a"), (3, "400")], decode)
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                comp.get_selections()
+            with self.assertRaises(ValueError):
+                comp.market_percentage()
+
+    def test_lazy_parsers(self):
+        for filename, parser in [
+            (JSONFILE, stats.JSONParser()),
+            (XMLFILE, stats.XMLParser()),
+            (JSONFILE, stats.CompetitionStore(parser=stats.JSONParser())),
+        ]:
+            with open(filename, "rb") as fh:
+                parser.parse(fh)
+            comps = list(parser.get_competitions())
+            self.assertTrue(all(each._source is not None for each in comps))
+            self.assertEqual(
+                make_json_loaded_reporter().summary(),
+                stats.Reporter(parser).summary(),
+            )
+            comps[0].get_selections()
+            self.assertIsNone(comps[0]._source)
+
+
+class TestBenchmarks(unittest.TestCase):
+    PARAMS = {
+        "batch": {"count": 20, "files": 2, "jobs": 2},
+        "chunks": {"count": 160, "jobs": 2},
+        "columnar": {"count": 20},
+        "diff": {"count": 40},
+        "dump": {"count": 40, "competitions": 5},
+        "export": {"count": 20},
+        "load": {"count": 20},
+        "market_percentage": {"count": 20},
+        "model": {"scale": 1},
+        "query": {"count": 20},
+        "startup": {"repeat": 1},
+        "suite": {"count": 20, "repeat": 1},
+        "validate": {"count": 20, "every": 5},
+        "xml": {"count": 20},
+    }
+
+    def test_compare(self):
+        self.assertEqual(set(bench_stats.BENCHMARKS), set(self.PARAMS))
+        for name, params in sorted(self.PARAMS.items()):
+            results = bench_stats.BENCHMARKS[name](
+                **bench_stats.benchmark_params(name, params)
+            )
+            document = {"results": results}
+            names = [each["name"] for each in results]
+            self.assertEqual(len(names), len(set(names)), name)
+
+            rows = bench_stats.compare(document, document)
+            self.assertEqual(names, [each["name"] for each in rows])
+            self.assertTrue(all(each["ratio"] == 1.0 for each in rows))
+
+        self.assertEqual(
+            [],
+            bench_stats.compare({"results": [{"wall_s": 1.0}]}, document),
+        )
+
+    def test_params(self):
+        self.assertEqual(
+            {"scale": 2},
+            bench_stats.benchmark_params("model", {"scale": 2, "count": None}),
+        )
+        with self.assertRaises(ValueError) as ctx:
+            bench_stats.benchmark_params("startup", {"scale": 3})
+        self.assertIn("--scale", str(ctx.exception))
+